@@ -0,0 +1,113 @@
+"""
+Pipelines IA
+============
+Plumbing shared by the batched AI pipelines (email_campaign, basket_segments):
+
+* run_sql / insert_rows / lookup_rows / replace_rows - statements on the
+  session, multi-row INSERTs and IN (...) lookups in bounded chunks, and
+  per-chunk DELETE + INSERT transactions keyed on the first column;
+* run_batches - one model call per batch on worker threads, each result
+  saved on the calling thread as soon as it returns: the saved rows are the
+  checkpoint, a failed batch is left for the next run;
+* parse_products / basket_hash - purchased products as a list whatever the
+  backend returned, and the key of a canonical basket.
+
+Writes hold the router's warehouse (WarehouseRouter.pinned) while the
+worker threads route the model calls to the AI warehouse, so the memo
+tables never land on it.
+"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+INSERT_ROWS = 200  # rows per multi-row INSERT
+IN_LIST_SIZE = 1_000  # keys per IN (...) lookup or replaced chunk
+
+
+def run_sql(session, sql: str, params: Optional[Sequence] = None):
+    return session.sql(sql, params=params).collect()
+
+
+def chunks(values: Sequence, size: int) -> Iterable[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def insert_rows(session, table: str, columns: Sequence[str], rows: Sequence[Sequence]):
+    placeholders = "(" + ", ".join("?" for _ in columns) + ")"
+    for chunk in chunks(rows, INSERT_ROWS):
+        run_sql(session, f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join(placeholders for _ in chunk)}",
+                [value for row in chunk for value in row])
+
+
+def lookup_rows(router, sql: str, keys: Sequence, params: Sequence = ()) -> List:
+    """Rows of `sql`, whose {keys} placeholder becomes IN-list bind markers, chunk by chunk"""
+    rows = []
+    for chunk in chunks(list(keys), IN_LIST_SIZE):
+        with router.pinned() as session:
+            rows.extend(run_sql(session, sql.format(keys=", ".join("?" for _ in chunk)), list(params) + list(chunk)))
+    return rows
+
+
+def replace_rows(router, table: str, columns: Sequence[str], rows: Sequence[Sequence]) -> int:
+    """Replace the rows of `table` whose first column matches, one transaction per chunk"""
+    for chunk in chunks(rows, IN_LIST_SIZE):
+        with router.pinned() as session:
+            run_sql(session, "BEGIN")
+            try:
+                run_sql(session, f"DELETE FROM {table} WHERE {columns[0]} IN ({', '.join('?' for _ in chunk)})",
+                        [row[0] for row in chunk])
+                insert_rows(session, table, columns, chunk)
+            except Exception:
+                run_sql(session, "ROLLBACK")
+                raise
+            run_sql(session, "COMMIT")
+    return len(rows)
+
+
+def run_batches(
+    router,
+    call: Callable[[Sequence], List],
+    items: Sequence,
+    save: Callable[[object, Sequence, List], None],
+    batch_size: int,
+    concurrency: int,
+    name: str = "ai",
+) -> List[str]:
+    """
+    `call(batch)` on up to `concurrency` threads; `save(session, batch, results)` as each one returns.
+
+    `save` runs on the calling thread with the router pinned. A batch whose
+    call fails is not saved.
+
+    Returns:
+        List[str]: The error of every failed batch.
+    """
+    errors = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name) as executor:
+        futures = {executor.submit(call, batch): batch for batch in chunks(list(items), batch_size)}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            with router.pinned() as session:
+                save(session, futures[future], results)
+    return errors
+
+
+def parse_products(products) -> List[str]:
+    """Product names from a list, an array or Snowpark's JSON text; [] for None / NaN / NA"""
+    if not isinstance(products, (str, list, tuple, np.ndarray)):
+        return []
+    if isinstance(products, str):
+        products = json.loads(products)
+    return [str(p) for p in products if p is not None]
+
+
+def basket_hash(basket: Sequence[str]) -> str:
+    return hashlib.md5("\n".join(basket).encode("utf-8")).hexdigest()
@@ -0,0 +1,452 @@
+"""
+Streaming Cortex Analyst
+========================
+Consumes the server-sent events of the Analyst API ("stream": true) and
+rebuilds the message content item by item, so the chatbot can render text
+as it arrives and run the SQL as soon as its item is complete.
+
+ReplayServer is a local HTTP/SSE stand-in that replays recorded event
+streams, optionally cut into small writes, truncated or stalled;
+`python analyst_stream.py [recording.jsonl]` streams one through it and
+prints the timings, `--self-check` checks split events, truncated and stalled
+streams and errors against it.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+Event = Tuple[str, Dict]
+
+TRUNCATED = "stream_truncated"
+# Every Analyst stream ends with one of these
+FINAL_EVENTS = ("done", "error")
+
+
+class StreamError(Exception):
+    """HTTP error returned before the event stream started, or a stream cut before its end"""
+
+    def __init__(self, status: int, content: Dict):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.content = content
+
+
+class StreamingUnavailable(Exception):
+    """The streaming endpoint cannot be reached from this session: use the blocking call"""
+
+
+def iter_sse(lines: Iterable[str]) -> Iterator[Event]:
+    """
+    (event, data) pairs of a server-sent events stream, data parsed as JSON.
+
+    An event is dispatched on its blank line only: the unterminated last one
+    of a cut stream is dropped, as the SSE spec requires.
+    """
+    event, data = "message", []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        else:
+            name, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if name == "event":
+                event = value
+            elif name == "data":
+                data.append(value)
+
+
+def stream_events(url: str, headers: Dict, body: Dict, timeout: float) -> Iterator[Event]:
+    """
+    POST `body` with "stream": true and yield its events.
+
+    Raises:
+        StreamingUnavailable: The endpoint could not be reached, or did not
+            answer within `timeout`.
+        StreamError: HTTP error status, or the stream ended without its
+            final event (error_code "stream_truncated"), reset or stalled
+            for more than `timeout` included.
+    """
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream", **headers}
+    try:
+        resp = requests.post(url, json={**body, "stream": True}, headers=headers, stream=True, timeout=timeout)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise StreamingUnavailable(str(e)) from e
+    with resp:
+        if resp.status_code >= 400:
+            try:
+                content = resp.json()
+            except ValueError:
+                content = {"message": resp.text}
+            content.setdefault("request_id", resp.headers.get("X-Snowflake-Request-Id"))
+            raise StreamError(resp.status_code, content)
+        request_id = resp.headers.get("X-Snowflake-Request-Id")
+        if request_id:
+            yield "request_id", {"request_id": request_id}
+        ended = False
+        try:
+            for event, data in iter_sse(resp.iter_lines(decode_unicode=True)):
+                ended = ended or event in FINAL_EVENTS
+                yield event, data
+        except requests.RequestException:
+            pass  # connection reset or read timeout mid-stream: reported below
+        if not ended:
+            raise StreamError(200, {"message": "Le flux de réponse s'est interrompu avant la fin.",
+                                    "error_code": TRUNCATED, "request_id": request_id})
+
+
+class StreamedResponse:
+    """
+    Analyst message rebuilt from `message.content.delta` events.
+
+    apply() returns the indexes of the content items completed by an event:
+    an item is complete once a delta for a later item arrives, or at the end
+    of the stream.
+    """
+
+    def __init__(self):
+        self.items: Dict[int, Dict] = {}
+        self.request_id: Optional[str] = None
+        self.warnings: List[Dict] = []
+        self.error: Optional[Dict] = None
+        self.status_message: Optional[str] = None
+        self.done = False
+        self._open: Optional[int] = None
+
+    def _delta(self, data: Dict):
+        index = data["index"]
+        item = self.items.setdefault(index, {"type": data["type"]})
+        if data["type"] == "text":
+            item["text"] = item.get("text", "") + data.get("text_delta", "")
+        elif data["type"] == "sql":
+            item["statement"] = item.get("statement", "") + data.get("statement_delta", "")
+            if "confidence" in data:
+                item["confidence"] = data["confidence"]
+            item.setdefault("confidence", None)
+        elif data["type"] == "suggestions":
+            suggestions = item.setdefault("suggestions", [])
+            delta = data.get("suggestions_delta", {})
+            while len(suggestions) <= delta.get("index", 0):
+                suggestions.append("")
+            suggestions[delta.get("index", 0)] += delta.get("suggestion_delta", "")
+
+    def apply(self, event: str, data: Dict) -> List[int]:
+        if data.get("request_id"):
+            self.request_id = data["request_id"]
+        if event == "status":
+            self.status_message = data.get("status_message") or data.get("status")
+        elif event == "message.content.delta":
+            completed = []
+            if self._open is not None and data["index"] != self._open:
+                completed.append(self._open)
+            self._open = data["index"]
+            self._delta(data)
+            return completed
+        elif event == "warnings":
+            self.warnings.extend(data.get("warnings", []))
+        elif event == "error":
+            self.error = data
+        elif event == "done":
+            return self.finish()
+        return []
+
+    def finish(self) -> List[int]:
+        """Indexes still open at the end of the stream"""
+        self.done = True
+        completed = [] if self._open is None else [self._open]
+        self._open = None
+        return completed
+
+    @property
+    def content(self) -> List[Dict]:
+        return [self.items[index] for index in sorted(self.items)]
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(item["text"] for item in self.content if item["type"] == "text")
+
+    def as_response(self) -> Dict:
+        """Same shape as the body of a non-streamed Analyst response"""
+        response = {
+            "message": {"role": "analyst", "content": self.content},
+            "request_id": self.request_id,
+        }
+        if self.warnings:
+            response["warnings"] = self.warnings
+        return response
+
+
+def load_recording(path: str) -> List[Event]:
+    """Events of a recording file, one {"event": ..., "data": ...} per line"""
+    with open(path, encoding="utf-8") as f:
+        return [(row["event"], row["data"]) for row in map(json.loads, f) if row]
+
+
+def save_recording(events: Iterable[Event], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for event, data in events:
+            f.write(json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n")
+
+
+SAMPLE_RECORDING: List[Event] = [
+    ("status", {"status": "interpreting_question", "status_message": "Interprétation de la question"}),
+    ("message.content.delta", {"index": 0, "type": "text", "text_delta": "Voici le classement "}),
+    ("message.content.delta", {"index": 0, "type": "text", "text_delta": "des magasins par ventes."}),
+    ("status", {"status": "generating_sql", "status_message": "Génération du SQL"}),
+    ("message.content.delta", {"index": 1, "type": "sql", "statement_delta": "SELECT STORE_NAME, SUM(SALES_PRICE_EURO) AS VENTES "}),
+    ("message.content.delta", {"index": 1, "type": "sql", "statement_delta": "FROM SS_101.ANALYTICS.ORDERS_V GROUP BY 1 ORDER BY 2 DESC",
+                               "confidence": {"verified_query_used": None}}),
+    ("message.content.delta", {"index": 2, "type": "text", "text_delta": "Les ventes incluent toutes les commandes."}),
+    ("response_metadata", {"request_id": "replay-0001"}),
+    ("done", {}),
+]
+
+
+def recorded_events(recordings, body: Dict) -> List[Event]:
+    """Events replayed for a request: the recording, or the one of its last question"""
+    if not isinstance(recordings, dict):
+        return recordings
+    question = body["messages"][-1]["content"][0]["text"]
+    return recordings.get(question, [("error", {"message": f"no recording for {question!r}"})])
+
+
+def replayed_response(recordings, body: Dict) -> Tuple[int, Dict]:
+    """HTTP status and body of the non-streamed answer rebuilt from a recording"""
+    stream = StreamedResponse()
+    for event, data in recorded_events(recordings, body):
+        stream.apply(event, data)
+    stream.finish()
+    if stream.error is not None:
+        return 400, {"request_id": stream.request_id, **stream.error}
+    return 200, stream.as_response()
+
+
+class ReplayServer:
+    """
+    Local stand-in for the Analyst endpoint replaying recorded events.
+
+    Args:
+        recordings (List[Event] | Dict[str, List[Event]]): One recording, or
+            recordings keyed by the text of the last user message.
+        delay (float): Seconds between two events, to mimic generation time.
+        status (int): HTTP status to answer with; >= 400 returns `error_body`.
+        chunk_size (int): Write the stream in pieces of this many bytes, so
+            events and lines are split across reads.
+        truncate_at (int): Close the connection after this many bytes of stream.
+        stall_at (int): Stop writing after this many bytes of stream and keep
+            the connection open until the server stops; 0 stalls before the
+            response headers.
+    """
+
+    def __init__(self, recordings, delay: float = 0.05, status: int = 200, error_body: Dict = None,
+                 chunk_size: Optional[int] = None, truncate_at: Optional[int] = None,
+                 stall_at: Optional[int] = None):
+        self.recordings = recordings
+        self.delay = delay
+        self.status = status
+        self.chunk_size = chunk_size
+        self.truncate_at = truncate_at
+        self.stall_at = stall_at
+        self._stopped = threading.Event()
+        self.error_body = error_body or {"message": "replay error", "error_code": "000", "request_id": "replay"}
+        self.requests: List[Dict] = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/api/v2/cortex/analyst/message"
+
+    def _handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                replay.requests.append(body)
+                if replay.stall_at == 0:
+                    replay._stopped.wait()
+                    return
+                if replay.status >= 400:
+                    payload = json.dumps(replay.error_body).encode("utf-8")
+                    self.send_response(replay.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("X-Snowflake-Request-Id", "replay-0001")
+                self.end_headers()
+                sent = 0
+                cut_at = replay.stall_at if replay.stall_at is not None else replay.truncate_at
+                for event, data in recorded_events(replay.recordings, body):
+                    time.sleep(replay.delay)
+                    payload = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+                    if cut_at is not None:
+                        payload = payload[:cut_at - sent]
+                    size = replay.chunk_size or len(payload) or 1
+                    for start in range(0, len(payload), size):
+                        self.wfile.write(payload[start:start + size])
+                        self.wfile.flush()
+                    sent += len(payload)
+                    if cut_at is not None and sent >= cut_at:
+                        if replay.stall_at is not None:
+                            replay._stopped.wait()
+                        return  # HTTP/1.0: the connection closes here
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+QUESTION = "Classement des magasins"
+
+
+def _body(question: str = QUESTION) -> Dict:
+    return {"messages": [{"role": "user", "content": [{"type": "text", "text": question}]}]}
+
+
+def _replay(events: List[Event], question: str = QUESTION, timeout: float = 10,
+            **server) -> Tuple[StreamedResponse, List[Event]]:
+    """Stream `events` through a ReplayServer; the rebuilt response and the events received"""
+    stream, received = StreamedResponse(), []
+    with ReplayServer(events, delay=0, **server) as replay:
+        try:
+            for event, data in stream_events(replay.url, {}, _body(question), timeout=timeout):
+                received.append((event, data))
+                stream.apply(event, data)
+        finally:
+            assert replay.requests[0]["stream"] is True
+    stream.finish()
+    return stream, received
+
+
+def self_check():
+    """Split events, truncated and stalled streams, error events and HTTP errors against ReplayServer"""
+    expected = replayed_response(SAMPLE_RECORDING, _body())[1]["message"]["content"]
+
+    # Events and lines split across reads rebuild the same message
+    for chunk_size in (1, 7, 64):
+        stream, received = _replay(SAMPLE_RECORDING, chunk_size=chunk_size)
+        assert stream.content == expected, (chunk_size, stream.content)
+        assert len(received) == len(SAMPLE_RECORDING) + 1  # + the request id header
+    # Multi-line data and comments, straight into the parser
+    lines = [": ping", "event: status", 'data: {"status":', 'data:  "ok"}', "", 'data: {"a": 1}', ""]
+    assert list(iter_sse(lines)) == [("status", {"status": "ok"}), ("message", {"a": 1})]
+
+    # Cut in the middle of the 4th event: the 3 complete ones arrive, then the error
+    head = sum(len(f"event: {e}\ndata: {json.dumps(d)}\n\n".encode("utf-8")) for e, d in SAMPLE_RECORDING[:3])
+    try:
+        _replay(SAMPLE_RECORDING, truncate_at=head + 10)
+    except StreamError as e:
+        assert e.status == 200 and e.content["error_code"] == TRUNCATED, e.content
+    else:
+        raise AssertionError("flux tronqué non détecté")
+    received = []
+    with ReplayServer(SAMPLE_RECORDING, delay=0, truncate_at=head + 10) as replay:
+        try:
+            for event, data in stream_events(replay.url, {}, _body(), timeout=10):
+                received.append(event)
+        except StreamError:
+            pass
+    assert received == ["request_id"] + [event for event, _ in SAMPLE_RECORDING[:3]], received
+
+    # Stalled in the middle of the 4th event: the read timeout ends the stream as truncated
+    try:
+        _replay(SAMPLE_RECORDING, timeout=0.5, stall_at=head + 10)
+    except StreamError as e:
+        assert e.status == 200 and e.content["error_code"] == TRUNCATED, e.content
+    else:
+        raise AssertionError("flux bloqué non détecté")
+    # Stalled before the headers: no answer in time, streaming unavailable
+    try:
+        _replay(SAMPLE_RECORDING, timeout=0.5, stall_at=0)
+    except StreamingUnavailable:
+        pass
+    else:
+        raise AssertionError("endpoint muet non détecté")
+
+    # Error event: a normal end of stream, the error is on the response
+    stream, _ = _replay({"autre question": SAMPLE_RECORDING})
+    assert stream.error is not None and "no recording" in stream.error["message"] and not stream.content
+    assert replayed_response({}, _body())[0] == 400
+
+    # HTTP error before the stream
+    try:
+        _replay(SAMPLE_RECORDING, status=503)
+    except StreamError as e:
+        assert e.status == 503 and e.content["request_id"] == "replay", e.content
+    else:
+        raise AssertionError("erreur HTTP non remontée")
+
+    # Nothing listening: streaming unavailable, not a stream error
+    with ReplayServer(SAMPLE_RECORDING) as replay:
+        url = replay.url
+    try:
+        list(stream_events(url, {}, _body(), timeout=2))
+    except StreamingUnavailable:
+        pass
+    else:
+        raise AssertionError("endpoint injoignable non détecté")
+    print("flux découpés, tronqués, bloqués, erreurs et endpoint injoignable : OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", nargs="?", help="enregistrement .jsonl, l'exemple intégré sinon")
+    parser.add_argument("--self-check", action="store_true")
+    args = parser.parse_args()
+
+    if args.self_check:
+        self_check()
+        return
+
+    events = load_recording(args.recording) if args.recording else SAMPLE_RECORDING
+    body = _body()
+    with ReplayServer(events) as server:
+        stream = StreamedResponse()
+        start = time.perf_counter()
+        first_text = sql_ready = None
+        for event, data in stream_events(server.url, {}, body, timeout=10):
+            for index in stream.apply(event, data):
+                if stream.items[index]["type"] == "sql" and sql_ready is None:
+                    sql_ready = time.perf_counter() - start
+            if first_text is None and stream.text:
+                first_text = time.perf_counter() - start
+        stream.finish()
+        total = time.perf_counter() - start
+
+    print(f"request_id      : {stream.request_id}")
+    print(f"first text      : {first_text * 1000:.0f} ms")
+    print(f"sql complete    : {sql_ready * 1000:.0f} ms" if sql_ready else "sql complete    : -")
+    print(f"stream complete : {total * 1000:.0f} ms")
+    print(json.dumps(stream.content, ensure_ascii=False, indent=2))
+    assert server.requests[0]["stream"] is True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Cache des réponses
+==================
+Process-wide cache of Cortex Analyst answers keyed by the normalized
+question (accents, case, punctuation, whitespace and stop words removed)
+and the normalized previous question, since a follow-up only means something
+in its context. Results of the generated SQL are kept alongside within a byte
+budget. Everything is invalidated when the semantic view changes (its
+created_on moves on CREATE OR REPLACE), checked at most once per
+`refresh_seconds`.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+import unidecode
+
+from result_store import frame_nbytes
+from warehouse_router import POINT_KPI, router_for
+
+SEMANTIC_VIEW_DATABASE = "SS_101"
+SEMANTIC_VIEW_SCHEMA = "HARMONIZED"
+SEMANTIC_VIEW_NAME = "ORDERS_SV"
+VERSION_QUERY = f"SHOW SEMANTIC VIEWS LIKE '{SEMANTIC_VIEW_NAME}' IN SCHEMA {SEMANTIC_VIEW_DATABASE}.{SEMANTIC_VIEW_SCHEMA}"
+
+DEFAULT_REFRESH_SECONDS = 60
+DEFAULT_MAX_ANSWERS = 500
+DEFAULT_MAX_RESULT_BYTES = 128 * 1024 * 1024
+MAX_RESULT_BYTES_PER_QUERY = 8 * 1024 * 1024  # bigger results are re-executed
+RESULT_TTL = 600  # in seconds, results follow the data, answers only the view
+
+STOP_WORDS = frozenset("""
+    a au aux avec c ce ces cet cette d de des du en est et il j je l la le les
+    leur leurs m ma me mes moi mon n ne nos notre on ou par pas pour qu que quel
+    quelle quelles quels qui s sa se ses son sur t ta te tes toi ton tu un une
+    vos votre y donne donnez montre montrez affiche affichez peux pouvez stp svp
+    plait quoi est-ce
+""".split())
+
+
+def normalize_question(question: str) -> str:
+    """'Quel est le Top 10 des   marques ?' -> 'top 10 marques'"""
+    text = unidecode.unidecode(question or "").lower()
+    words = re.sub(r"[^a-z0-9]+", " ", text).split()
+    return " ".join(word for word in words if word not in STOP_WORDS)
+
+
+@dataclass
+class CachedAnswer:
+    content: List[Dict]
+    request_id: str
+    warnings: List[Dict] = field(default_factory=list)
+    latency_ms: float = 0.0  # what the Analyst call cost the first time
+
+
+class AnswerCache:
+    """Cached Analyst answers and SQL results, with hit statistics"""
+
+    def __init__(
+        self,
+        session,
+        refresh_seconds: int = DEFAULT_REFRESH_SECONDS,
+        max_answers: int = DEFAULT_MAX_ANSWERS,
+        max_result_bytes: int = DEFAULT_MAX_RESULT_BYTES,
+    ):
+        self.session = session
+        self.refresh_seconds = refresh_seconds
+        self.max_answers = max_answers
+        self.max_result_bytes = max_result_bytes
+        self._lock = threading.Lock()
+        self._answers = OrderedDict()  # (previous, question) -> CachedAnswer
+        self._results = OrderedDict()  # sql -> (DataFrame, exec ms, stored at, nbytes)
+        self._result_bytes = 0
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def key(question: str, previous_question: Optional[str] = None):
+        return normalize_question(previous_question), normalize_question(question)
+
+    def _check_version(self):
+        now = time.time()
+        if now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+        try:
+            rows = router_for(self.session).collect_nowait(VERSION_QUERY, query_class=POINT_KPI).result()
+        except Exception:
+            # Without metadata access, keep the cache until the next check
+            return
+        version = rows[0]["created_on"] if rows else None
+        if version != self._version:
+            self._answers.clear()
+            self._results.clear()
+            self._result_bytes = 0
+            self._version = version
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def lookup(self, question: str, previous_question: Optional[str] = None) -> Optional[CachedAnswer]:
+        with self._lock:
+            self._check_version()
+            answer = self._answers.get(self.key(question, previous_question))
+            if answer is None:
+                self.misses += 1
+                return None
+            self._answers.move_to_end(self.key(question, previous_question))
+            self.hits += 1
+            self.saved_ms += answer.latency_ms
+            return answer
+
+    def store(self, question: str, previous_question: Optional[str], answer: CachedAnswer):
+        with self._lock:
+            self._check_version()
+            key = self.key(question, previous_question)
+            self._answers[key] = answer
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.max_answers:
+                self._answers.popitem(last=False)
+
+    def result(self, sql: str) -> Optional[pd.DataFrame]:
+        """Stored result of `sql` if still fresh"""
+        with self._lock:
+            self._check_version()
+            entry = self._results.get(sql)
+            if entry is None:
+                return None
+            df, exec_ms, stored_at, nbytes = entry
+            if time.time() - stored_at > RESULT_TTL:
+                del self._results[sql]
+                self._result_bytes -= nbytes
+                return None
+            self._results.move_to_end(sql)
+            self.saved_ms += exec_ms
+            return df
+
+    def store_result(self, sql: str, df: pd.DataFrame, exec_ms: float):
+        nbytes = frame_nbytes(df)
+        if nbytes > MAX_RESULT_BYTES_PER_QUERY:
+            return
+        with self._lock:
+            if sql in self._results:
+                self._result_bytes -= self._results.pop(sql)[3]
+            self._results[sql] = (df, exec_ms, time.time(), nbytes)
+            self._result_bytes += nbytes
+            while self._result_bytes > self.max_result_bytes and self._results:
+                self._result_bytes -= self._results.popitem(last=False)[1][3]
+
+
+@st.cache_resource
+def answer_cache(_session) -> AnswerCache:
+    """The AnswerCache shared by every session of this process"""
+    return AnswerCache(_session)
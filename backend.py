@@ -0,0 +1,446 @@
+"""
+Backends d'exécution
+====================
+What the three apps need from the platform, behind one interface:
+
+* `session` - Snowpark-shaped object used by the router, the scheduler and
+  the decoders: sql(text, params) with collect / to_pandas / collect_nowait,
+  connection.cursor() with Arrow batches;
+* sql() / table() - pandas results for SQL text and whole tables;
+* send_api_request() / analyst_stream_target() - the Cortex Analyst endpoint.
+
+SnowflakeBackend wraps the active Snowpark session and _snowflake.
+LocalBackend runs the same SQL on DuckDB over the Parquet datasets written
+by synthetic_data.py (or a mirror of the production tables), with the
+SS_101 and SPORTS_DB views of SUMMIT_SPORTS.ipynb, and answers Analyst calls
+from recorded event streams (analyst_stream). It needs no network, so the
+apps run offline for UI work and end-to-end latency tests, or next to a
+store on its own data.
+
+SS_BACKEND=local selects it; SS_LOCAL_DATA is the Parquet directory and
+SS_ANALYST_RECORDINGS a recording (.jsonl) or a JSON file of recordings
+keyed by question.
+"""
+import itertools
+import json
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+import loyalty_metrics
+from analyst_stream import SAMPLE_RECORDING, ReplayServer, StreamingUnavailable, load_recording, replayed_response
+
+SNOWFLAKE, LOCAL = "snowflake", "local"
+BACKEND = os.environ.get("SS_BACKEND", SNOWFLAKE)
+LOCAL_DATA = os.environ.get("SS_LOCAL_DATA", os.path.join("data", "sports_db"))
+ANALYST_RECORDINGS = os.environ.get("SS_ANALYST_RECORDINGS")
+# Streaming endpoint override, e.g. the URL of an analyst_stream.ReplayServer
+ANALYST_STREAM_URL = os.environ.get("ANALYST_STREAM_URL")
+
+ANALYST_ENDPOINT = "/api/v2/cortex/analyst/message"
+STORES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SS_STORES.csv")
+ARROW_BATCH_ROWS = 100_000
+EXPLAIN_JSON = "EXPLAIN USING JSON"
+TRANSACTION_START = ("BEGIN", "BEGIN TRANSACTION", "START TRANSACTION")
+TRANSACTION_END = ("COMMIT", "ROLLBACK")
+FORECAST_HISTORY_DAYS = 365
+FORECAST_HORIZON = 180
+
+
+class Backend(ABC):
+    """Interface shared by the Snowflake and local backends"""
+
+    name: str
+    session = None
+    sql_errors: Tuple[type, ...] = ()
+
+    def sql(self, query: str, params: Optional[Sequence] = None) -> pd.DataFrame:
+        return self.session.sql(query, params=params).to_pandas()
+
+    def table(self, name: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return self.sql(f"SELECT {', '.join(columns) if columns else '*'} FROM {name}")
+
+    @abstractmethod
+    def send_api_request(self, method: str, path: str, headers: Dict, params: Dict, body: Dict,
+                         request_guid=None, timeout: int = 50000) -> Dict:
+        """Same arguments and result as _snowflake.send_snow_api_request"""
+
+    def analyst_stream_target(self) -> Tuple[str, Dict]:
+        """
+        URL and headers of the streaming Analyst endpoint.
+
+        Raises:
+            StreamingUnavailable: This session cannot call it directly.
+        """
+        raise StreamingUnavailable(f"pas de streaming sur le backend {self.name}")
+
+
+class SnowflakeBackend(Backend):
+    name = SNOWFLAKE
+
+    def __init__(self, session=None):
+        from snowflake.snowpark.context import get_active_session
+        from snowflake.snowpark.exceptions import SnowparkSQLException
+
+        self.session = session or get_active_session()
+        self.sql_errors = (SnowparkSQLException,)
+
+    def send_api_request(self, method, path, headers, params, body, request_guid=None, timeout=50000):
+        import _snowflake
+
+        return _snowflake.send_snow_api_request(method, path, headers, params, body, request_guid, timeout)
+
+    def analyst_stream_target(self):
+        if ANALYST_STREAM_URL:
+            return ANALYST_STREAM_URL, {}
+        connection = self.session.connection
+        host = getattr(connection, "host", None)
+        token = getattr(getattr(connection, "rest", None), "token", None)
+        if not host or not token:
+            # Streamlit in Snowflake keeps the REST token to itself
+            raise StreamingUnavailable("ni hôte ni jeton REST dans cette session")
+        return f"https://{host}{ANALYST_ENDPOINT}", {"Authorization": f'Snowflake Token="{token}"'}
+
+
+# ---------------------------------------------------------------- local
+
+class Row(tuple):
+    """Snowpark Row look-alike: by position or by column name"""
+
+    def __new__(cls, values, fields):
+        row = super().__new__(cls, values)
+        row._fields = fields
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return super().__getitem__(self._fields[key])
+        return super().__getitem__(key)
+
+    def as_dict(self) -> Dict:
+        return {name: self[i] for name, i in self._fields.items()}
+
+
+def _rows(df: pd.DataFrame) -> List[Row]:
+    fields = {name: i for i, name in enumerate(df.columns)}
+    return [Row(values, fields) for values in df.itertuples(index=False, name=None)]
+
+
+class LocalJob:
+    """AsyncJob look-alike over a future"""
+
+    def __init__(self, future):
+        self.query_id = str(uuid.uuid4())
+        self._future = future
+
+    def is_done(self) -> bool:
+        return self._future.done()
+
+    def cancel(self):
+        self._future.cancel()
+
+    def result(self, result_type: Optional[str] = None):
+        df = self._future.result()
+        return df if result_type == "pandas" else _rows(df)
+
+
+class LocalDataFrame:
+    """Result of LocalSession.sql(); the query runs on collect / to_pandas"""
+
+    def __init__(self, session: "LocalSession", query: str, params: Optional[Sequence] = None):
+        self._session = session
+        self._query = query
+        self._params = params
+
+    @property
+    def queries(self) -> Dict[str, List[str]]:
+        return {"queries": [self._query]}
+
+    def to_pandas(self, block: bool = True, statement_params: Optional[Dict] = None):
+        if not block:
+            return self.collect_nowait(statement_params)
+        return self._session.execute(self._query, self._params)
+
+    def collect(self, statement_params: Optional[Dict] = None) -> List[Row]:
+        return _rows(self.to_pandas())
+
+    def collect_nowait(self, statement_params: Optional[Dict] = None) -> LocalJob:
+        return LocalJob(self._session.executor.submit(self._session.execute, self._query, self._params))
+
+
+class _Column:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class LocalCursor:
+    """Connector cursor look-alike: results stream as Arrow tables"""
+
+    def __init__(self, session: "LocalSession"):
+        self._session = session
+        self._reader = None
+        self.sfqid = None
+        self.description: List[_Column] = []
+
+    def execute(self, sql: str, params: Optional[Sequence] = None, _statement_params: Optional[Dict] = None):
+        if sql.strip().upper().startswith("USE "):
+            return self
+        self.sfqid = str(uuid.uuid4())
+        self._reader = self._session.reader(sql, params)
+        self.description = [_Column(name) for name in self._reader.schema.names]
+        return self
+
+    def execute_async(self, sql: str, params: Optional[Sequence] = None, _statement_params: Optional[Dict] = None):
+        self.execute(sql, params)
+        return {"queryId": self.sfqid}
+
+    def get_results_from_sfqid(self, query_id: str):
+        pass
+
+    def fetch_arrow_batches(self) -> Iterator[pa.Table]:
+        for batch in self._reader:
+            yield pa.Table.from_batches([batch])
+
+    def close(self):
+        self._reader = None
+
+
+class LocalConnection:
+    def __init__(self, session: "LocalSession"):
+        self._session = session
+
+    def cursor(self) -> LocalCursor:
+        return LocalCursor(self._session)
+
+
+class LocalSession:
+    """
+    The part of a Snowpark session the apps use, on a DuckDB database.
+
+    Every query gets its own DuckDB cursor, so threads (scheduler, prefetch,
+    streamed SQL) run concurrently. There is no warehouse to switch and no
+    partition statistics: EXPLAIN USING JSON returns empty GlobalStats, so
+    the guardrails only apply their row limit.
+
+    BEGIN ... COMMIT / ROLLBACK keep one cursor for the statements of the
+    calling thread in between, so a transaction spans them as it would in
+    a Snowflake session.
+    """
+
+    def __init__(self, con, max_workers: int = 4):
+        self._con = con
+        self._local = threading.local()
+        self.connection = LocalConnection(self)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="duckdb")
+
+    def _cursor(self):
+        return getattr(self._local, "transaction", None) or self._con.cursor()
+
+    def _release(self, cursor):
+        if cursor is not getattr(self._local, "transaction", None):
+            cursor.close()
+
+    def execute(self, query: str, params: Optional[Sequence] = None) -> pd.DataFrame:
+        statement = query.strip().rstrip(";").upper()
+        if statement in TRANSACTION_START:
+            self._local.transaction = self._con.cursor()
+            return self._local.transaction.execute("BEGIN").df()
+        if statement in TRANSACTION_END and getattr(self._local, "transaction", None) is not None:
+            cursor, self._local.transaction = self._local.transaction, None
+            try:
+                return cursor.execute(statement).df()
+            finally:
+                cursor.close()
+        explain = statement.startswith(EXPLAIN_JSON)
+        cursor = self._cursor()
+        try:
+            if explain:
+                # Invalid SQL still fails here, as it does on Snowflake
+                cursor.execute(f"EXPLAIN {query.lstrip()[len(EXPLAIN_JSON):]}", params)
+                return pd.DataFrame({"plan": [json.dumps({"GlobalStats": {}})]})
+            return cursor.execute(query, params).df()
+        finally:
+            self._release(cursor)
+
+    def reader(self, query: str, params: Optional[Sequence] = None) -> pa.RecordBatchReader:
+        return self._cursor().execute(query, params).fetch_record_batch(ARROW_BATCH_ROWS)
+
+    def sql(self, query: str, params: Optional[Sequence] = None) -> LocalDataFrame:
+        return LocalDataFrame(self, query, params)
+
+    def table(self, name) -> LocalDataFrame:
+        return self.sql(f"SELECT * FROM {'.'.join(name) if isinstance(name, (list, tuple)) else name}")
+
+    def get_current_warehouse(self) -> Optional[str]:
+        return None
+
+    def use_warehouse(self, warehouse: str):
+        pass
+
+
+def memory_session(schemas: Sequence[str] = ("HARMONIZED",)) -> LocalSession:
+    """Empty in-memory SS_101 database with the given schemas, for the self-checks"""
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute("ATTACH ':memory:' AS SS_101")
+    for schema in schemas:
+        con.execute(f"CREATE SCHEMA SS_101.{schema}")
+    return LocalSession(con)
+
+
+def _parquet(directory: str, dataset: str) -> str:
+    path = os.path.join(directory, dataset, "**", "*.parquet")
+    return f"read_parquet('{path}', hive_partitioning = false)"
+
+
+def local_views(directory: str) -> List[Tuple[str, str]]:
+    """(name, SELECT) of every table and view the apps read, in dependency order"""
+    return [
+        ("SPORTS_DB.SPORTS_DATA.INSTORE_SALES_DATA_CRM3", f"SELECT * FROM {_parquet(directory, 'orders')}"),
+        ("SPORTS_DB.SPORTS_DATA.SPORTS_PRODUCT_CATALOGUE", f"SELECT * FROM {_parquet(directory, 'catalogue')}"),
+        ("SPORTS_DB.SPORTS_DATA.CUSTOMERS", f"SELECT * FROM {_parquet(directory, 'customers')}"),
+        ("SS_101.RAW_POS.MAGASINS", f"SELECT * FROM read_csv('{STORES_CSV}', all_varchar = true)"),
+        ("SS_101.RAW_POS.REFERENTIELS_PRODUIT", "SELECT * FROM SPORTS_DB.SPORTS_DATA.SPORTS_PRODUCT_CATALOGUE"),
+        ("SS_101.RAW_POS.ORDER_DETAIL", "SELECT * EXCLUDE (STORE_NAME) FROM SPORTS_DB.SPORTS_DATA.INSTORE_SALES_DATA_CRM3"),
+        ("SS_101.RAW_CUSTOMER.CUSTOMER_LOYALTY", "SELECT * FROM SPORTS_DB.SPORTS_DATA.CUSTOMERS"),
+        ("SS_101.HARMONIZED.ORDERS_V", """
+            SELECT
+                od.ORDER_ID, od.STOREID, od.SALE_DATE, od.PRODUCT_ID, od.QUANTITY, od.SALES_PRICE_EURO,
+                od.DISCOUNT_AMOUNT_EURO, od.PAYMENT_METHOD, od.SALES_ASSISTANT_ID, od.CUSTOMER_ID, od.CARD_ID,
+                cl.FIRST_NAME, cl.LAST_NAME,
+                m.STORE_NAME, m.STORE_TYPE, m.POSTCODE,
+                rp.PRODUCT_NAME, rp.BRAND, rp.MRP, rp.SALE_PRICE, rp.COLOUR, rp.PRODUCT_CATEGORY
+            FROM SS_101.RAW_POS.ORDER_DETAIL od
+            LEFT JOIN SS_101.RAW_CUSTOMER.CUSTOMER_LOYALTY cl ON od.CUSTOMER_ID = cl.CUSTOMER_ID
+            LEFT JOIN SS_101.RAW_POS.MAGASINS m ON od.STOREID = m.STOREID
+            LEFT JOIN SS_101.RAW_POS.REFERENTIELS_PRODUIT rp ON od.PRODUCT_ID = rp.PRODUCTID
+        """),
+        ("SS_101.HARMONIZED.ORDERS_DT", "SELECT * FROM SS_101.HARMONIZED.ORDERS_V"),
+        ("SS_101.ANALYTICS.ORDERS_V", "SELECT DATE(o.SALE_DATE) AS DATE, * FROM SS_101.HARMONIZED.ORDERS_V o"),
+    ]
+
+
+# Tables of the Snowflake pipelines, materialized when the backend opens
+LOCAL_TABLES = [
+    ("SPORTS_DB.SPORTS_TRANSFORMATION.INSTORE_SALES_CRM3_DAILY_AGGREGATED", """
+        SELECT SALE_DATE, SUM(SALES_PRICE_EURO) AS DAILY_REVENUE, COUNT(DISTINCT ORDER_ID) AS DAILY_TRANSACTIONS
+        FROM SPORTS_DB.SPORTS_DATA.INSTORE_SALES_DATA_CRM3
+        GROUP BY SALE_DATE
+    """),
+    ("SPORTS_DB.SPORTS_TRANSFORMATION.INSTORE_SALES_CRM3_DAILY_MAGASIN_AGGREGATED", """
+        SELECT STORE_NAME, SALE_DATE, SUM(SALES_PRICE_EURO) AS DAILY_REVENUE,
+               COUNT(DISTINCT ORDER_ID) AS DAILY_TRANSACTIONS
+        FROM SPORTS_DB.SPORTS_DATA.INSTORE_SALES_DATA_CRM3
+        GROUP BY STORE_NAME, SALE_DATE
+    """),
+]
+FORECAST_TABLE = "SPORTS_DB.SPORTS_DATASCIENCE.SPORTS_AGGREGATED_FORECAST"
+FORECAST_STORE_TABLE = "SPORTS_DB.SPORTS_DATASCIENCE.SPORTS_AGGREGATED_FORECAST_STORE"
+
+
+class LocalBackend(Backend):
+    """
+    DuckDB over Parquet, with Analyst answers replayed from recordings.
+
+    Args:
+        directory (str): Parquet datasets orders/, catalogue/, customers/.
+        recordings: One recording, or recordings keyed by question
+            (see analyst_stream.ReplayServer); SAMPLE_RECORDING by default.
+        stream_delay (float): Seconds between replayed events when streaming.
+    """
+
+    name = LOCAL
+
+    def __init__(self, directory: str = LOCAL_DATA, recordings=None, stream_delay: float = 0.0):
+        import duckdb
+
+        self.directory = directory
+        self.recordings = recordings if recordings is not None else SAMPLE_RECORDING
+        self.stream_delay = stream_delay
+        self.sql_errors = (duckdb.Error,)
+        self._replay: Optional[ReplayServer] = None
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+
+        con = duckdb.connect()
+        for catalog in ("SS_101", "SPORTS_DB"):
+            con.execute(f"ATTACH ':memory:' AS {catalog}")
+        for name, select in local_views(directory):
+            con.execute(f"CREATE SCHEMA IF NOT EXISTS {name.rsplit('.', 1)[0]}")
+            con.execute(f"CREATE OR REPLACE VIEW {name} AS {select}")
+        for name, select in LOCAL_TABLES:
+            con.execute(f"CREATE SCHEMA IF NOT EXISTS {name.rsplit('.', 1)[0]}")
+            con.execute(f"CREATE OR REPLACE TABLE {name} AS {select}")
+        self.session = LocalSession(con)
+        self._create_forecasts(con)
+        # Loyalty metrics: running totals behind CUSTOMER_LOYALTY_METRICS_V
+        loyalty_metrics.install(self.session)
+        loyalty_metrics.refresh(self.session)
+
+    def _create_forecasts(self, con):
+        """Stored forecasts of the ML pipeline, computed here with batch_forecast"""
+        from batch_forecast import forecast_all_stores
+
+        con.execute("CREATE SCHEMA IF NOT EXISTS SPORTS_DB.SPORTS_DATASCIENCE")
+        history = con.execute(f"""
+            SELECT STORE_NAME, SALE_DATE, DAILY_REVENUE FROM {LOCAL_TABLES[1][0]}
+            WHERE SALE_DATE > (SELECT MAX(SALE_DATE) FROM {LOCAL_TABLES[1][0]}) - {FORECAST_HISTORY_DAYS}
+        """).df()
+        if history.empty:
+            return
+        result = forecast_all_stores(history, horizon=FORECAST_HORIZON)
+        for name, frame in ((FORECAST_STORE_TABLE, result.stores), (FORECAST_TABLE, result.total)):
+            con.register("forecast_frame", frame)
+            con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM forecast_frame")
+            con.unregister("forecast_frame")
+
+    def send_api_request(self, method, path, headers, params, body, request_guid=None, timeout=50000):
+        request_id = f"local-{next(self._request_ids):04d}"
+        if path == ANALYST_ENDPOINT:
+            status, content = replayed_response(self.recordings, body)
+            content["request_id"] = content.get("request_id") or request_id
+        else:
+            # Feedback and other endpoints: accepted and ignored
+            status, content = 200, {"request_id": request_id}
+        return {"status": status, "content": json.dumps(content)}
+
+    def analyst_stream_target(self):
+        with self._lock:
+            if self._replay is None:
+                self._replay = ReplayServer(self.recordings, delay=self.stream_delay).__enter__()
+        return self._replay.url, {}
+
+
+def load_recordings(path: Optional[str]):
+    """A .jsonl recording, or a JSON file {question: [{"event": ..., "data": ...}, ...]}"""
+    if not path:
+        return None
+    if path.endswith(".jsonl"):
+        return load_recording(path)
+    with open(path, encoding="utf-8") as f:
+        return {question: [(e["event"], e["data"]) for e in events] for question, events in json.load(f).items()}
+
+
+_backend: Optional[Backend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> Backend:
+    """The backend selected by SS_BACKEND, shared by every session of the process"""
+    global _backend
+    if BACKEND == SNOWFLAKE:
+        # The active session is per Streamlit session: never shared
+        return SnowflakeBackend()
+    with _backend_lock:
+        if _backend is None:
+            if BACKEND != LOCAL:
+                raise ValueError(f"SS_BACKEND inconnu : {BACKEND}")
+            _backend = LocalBackend(LOCAL_DATA, load_recordings(ANALYST_RECORDINGS))
+        return _backend
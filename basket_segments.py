@@ -0,0 +1,331 @@
+"""
+Segmentation par panier
+=======================
+Memoized AI_FILTER segments ("a des enfants"...) over the purchased products
+of customer_loyalty_metrics_v. The notebook evaluates the prompt for every
+customer on every query; here it is evaluated once per distinct basket.
+
+* Baskets are canonicalized (lowercase, accents and model numbers removed,
+  distinct, sorted): "100 Ski Jacket Men's" and "500 Ski Jacket Men's" are the
+  same item, so near-identical baskets share one key;
+* BASKET_VERDICTS memoizes the verdict of each (prompt, basket); a changed
+  prompt gets a new hash and is evaluated again, baskets already seen never.
+  The empty basket (no order) is memoized as False without calling the
+  model, so those customers are never in the segment, as with the NULL
+  verdict of the notebook;
+* CUSTOMER_BASKETS maps customers to their basket, rewritten only for
+  customers whose basket changed, and CUSTOMER_SEGMENTS_V joins the verdicts
+  of the current prompts back to the loyalty metrics.
+
+Cost and latency grow with the number of new distinct baskets, not with the
+number of customers. snowflake_filter() runs AI_FILTER by batch on the AI
+warehouse (ai_pipeline.run_batches); local_filter() is a keyword stand-in
+for the local backend and the self-check.
+
+Usage:
+    python basket_segments.py --segment enfants
+    python basket_segments.py --self-check
+"""
+import argparse
+import hashlib
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import unidecode
+
+from ai_pipeline import basket_hash, insert_rows, parse_products, replace_rows, run_batches, run_sql
+from loyalty_metrics import METRICS_VIEW
+from warehouse_router import AI_FUNCTION, router_for
+
+# Prompts of the segments; {0} receives the basket
+SEGMENTS = {
+    "enfants": "Basé sur le liste de produit acheté, cette personne a des enfants: {0}",
+}
+
+VERDICTS_TABLE = "SS_101.HARMONIZED.BASKET_VERDICTS"
+CUSTOMER_BASKETS_TABLE = "SS_101.HARMONIZED.CUSTOMER_BASKETS"
+SEGMENTS_VIEW = "SS_101.HARMONIZED.CUSTOMER_SEGMENTS_V"
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_CONCURRENCY = 4
+VERDICT_COLUMNS = ["SEGMENT", "PROMPT_HASH", "BASKET_HASH", "BASKET", "VERDICT", "EVALUATED_AT"]
+
+# Basket text -> verdict, same order
+Filter = Callable[[str, List[str]], List[bool]]
+
+_MODEL_NUMBER = re.compile(r"\b\d+\b")
+_SPACES = re.compile(r"\s+")
+
+
+def canonical_item(name: str) -> str:
+    """"100 Ski Jacket Men's" -> "ski jacket men's" """
+    return _SPACES.sub(" ", _MODEL_NUMBER.sub(" ", unidecode.unidecode(name).lower())).strip()
+
+
+def item_set(products) -> Tuple[str, ...]:
+    """Sorted distinct canonical items: near-identical baskets compare equal"""
+    return tuple(sorted({item for item in map(canonical_item, parse_products(products)) if item}))
+
+
+def basket_text(basket: Sequence[str]) -> str:
+    return ", ".join(basket)
+
+
+def prompt_hash(template: str) -> str:
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()
+
+
+def snowflake_filter(session) -> Filter:
+    """AI_FILTER(PROMPT(template, basket)) over a batch of baskets in one query"""
+
+    def evaluate(template: str, baskets: List[str]) -> List[bool]:
+        rows = ", ".join("(?, ?)" for _ in baskets)
+        literal = template.replace("\\", "\\\\").replace("'", "\\'")
+        df = router_for(session).to_pandas(
+            f"SELECT column1 AS I, AI_FILTER(PROMPT('{literal}', column2)) AS VERDICT "
+            f"FROM VALUES {rows} ORDER BY I",
+            query_class=AI_FUNCTION, params=[value for i, basket in enumerate(baskets) for value in (i, basket)],
+        )
+        return [bool(v) for v in df["VERDICT"]]
+
+    return evaluate
+
+
+# Stand-in vocabulary of the "enfants" segment
+_CHILD_WORDS = re.compile(r"\b(kids?|enfants?|junior|jr|girls?|boys?|baby|bebe|fille|garcon)\b")
+
+
+def local_filter(template: str, baskets: List[str]) -> List[bool]:
+    """Stand-in for AI_FILTER: children's items in the basket, whatever the prompt"""
+    return [bool(_CHILD_WORDS.search(basket)) for basket in baskets]
+
+
+@dataclass
+class SegmentStats:
+    segment: str
+    customers: int = 0
+    baskets: int = 0  # distinct canonical baskets
+    memoized: int = 0
+    evaluated: int = 0
+    failed_batches: int = 0
+    remapped: int = 0  # customers whose basket changed
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+
+def install(session, segments: Dict[str, str] = SEGMENTS):
+    """Create the memo tables when missing; the view follows the current prompts of `segments`"""
+    run_sql(session, f"""
+        CREATE TABLE IF NOT EXISTS {VERDICTS_TABLE} (
+            SEGMENT VARCHAR, PROMPT_HASH VARCHAR, BASKET_HASH VARCHAR, BASKET VARCHAR, VERDICT BOOLEAN,
+            EVALUATED_AT TIMESTAMP
+        )
+    """)
+    run_sql(session, f"CREATE TABLE IF NOT EXISTS {CUSTOMER_BASKETS_TABLE} (CUSTOMER_ID VARCHAR, BASKET_HASH VARCHAR)")
+    current = ", ".join(f"'{prompt_hash(template)}'" for template in segments.values())
+    run_sql(session, f"""
+        CREATE OR REPLACE VIEW {SEGMENTS_VIEW} AS
+        SELECT v.SEGMENT, v.VERDICT, m.*
+        FROM {METRICS_VIEW} m
+        JOIN {CUSTOMER_BASKETS_TABLE} b ON m.CUSTOMER_ID = b.CUSTOMER_ID
+        JOIN {VERDICTS_TABLE} v ON v.BASKET_HASH = b.BASKET_HASH
+        WHERE v.PROMPT_HASH IN ({current})
+    """)
+
+
+class BasketSegmenter:
+    """
+    Evaluates segment prompts once per distinct canonical basket.
+
+    Args:
+        session: Snowpark (or local) session holding the memo tables.
+        evaluate (Filter): (prompt template, basket texts) -> verdicts.
+        segments (Dict[str, str]): Segment name -> prompt template.
+        batch_size (int): Baskets per AI_FILTER query.
+        concurrency (int): Queries in flight at most.
+    """
+
+    def __init__(self, session, evaluate: Filter, segments: Dict[str, str] = SEGMENTS,
+                 batch_size: int = DEFAULT_BATCH_SIZE, concurrency: int = DEFAULT_CONCURRENCY):
+        self.session = session
+        self.evaluate = evaluate
+        self.segments = segments
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.router = router_for(session)
+
+    def customer_baskets(self) -> pd.DataFrame:
+        """CUSTOMER_ID, BASKET_HASH and canonical BASKET of every customer"""
+        customers = self.router.to_pandas(f"SELECT CUSTOMER_ID, PURCHASED_PRODUCTS FROM {METRICS_VIEW}")
+        baskets = [item_set(products) for products in customers["PURCHASED_PRODUCTS"]]
+        return pd.DataFrame({
+            "CUSTOMER_ID": customers["CUSTOMER_ID"],
+            "BASKET_HASH": [basket_hash(basket) for basket in baskets],
+            "BASKET": [basket_text(basket) for basket in baskets],
+        })
+
+    def _remap(self, customers: pd.DataFrame) -> int:
+        """Rewrite CUSTOMER_BASKETS for the customers whose basket changed"""
+        with self.router.pinned() as session:
+            current = {row[0]: row[1] for row in run_sql(
+                session, f"SELECT CUSTOMER_ID, BASKET_HASH FROM {CUSTOMER_BASKETS_TABLE}"
+            )}
+        changed = [(cid, bh) for cid, bh in zip(customers["CUSTOMER_ID"], customers["BASKET_HASH"])
+                   if current.get(cid) != bh]
+        return replace_rows(self.router, CUSTOMER_BASKETS_TABLE, ["CUSTOMER_ID", "BASKET_HASH"], changed)
+
+    def _evaluate(self, segment: str, template: str, baskets: List[Tuple[str, str]], stats: SegmentStats):
+        """Evaluate (basket hash, basket text) in batches, memoizing each batch as it returns"""
+        key = prompt_hash(template)
+
+        def save(session, batch, verdicts):
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            insert_rows(session, VERDICTS_TABLE, VERDICT_COLUMNS,
+                        [(segment, key, bh, text, bool(verdict), now) for (bh, text), verdict in zip(batch, verdicts)])
+            stats.evaluated += len(batch)
+
+        # Failed batches are not memoized: evaluated again by the next run
+        errors = run_batches(
+            self.router, lambda batch: self.evaluate(template, [text for _, text in batch]), baskets,
+            save, self.batch_size, self.concurrency, name="ai-filter",
+        )
+        stats.failed_batches += len(errors)
+        stats.errors.extend(errors)
+
+    def run(self, segment: str, customers: Optional[pd.DataFrame] = None) -> SegmentStats:
+        """Memoize the verdicts of `segment` for every basket of `customers` (all customers by default)"""
+        start = time.perf_counter()
+        template = self.segments[segment]
+        if customers is None:
+            customers = self.customer_baskets()
+        stats = SegmentStats(segment, customers=len(customers))
+        stats.remapped = self._remap(customers)
+
+        distinct = customers.drop_duplicates("BASKET_HASH")
+        stats.baskets = len(distinct)
+        with self.router.pinned() as session:
+            memoized = {row[0] for row in run_sql(
+                session, f"SELECT DISTINCT BASKET_HASH FROM {VERDICTS_TABLE} WHERE PROMPT_HASH = ?",
+                [prompt_hash(template)],
+            )}
+        missing = [(bh, text) for bh, text in zip(distinct["BASKET_HASH"], distinct["BASKET"]) if bh not in memoized]
+        stats.memoized = stats.baskets - len(missing)
+        # No order, nothing to judge: out of the segment without a model call
+        empty = [(bh, text) for bh, text in missing if not text]
+        if empty:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            with self.router.pinned() as session:
+                insert_rows(session, VERDICTS_TABLE, VERDICT_COLUMNS,
+                            [(segment, prompt_hash(template), bh, text, False, now) for bh, text in empty])
+            missing = [(bh, text) for bh, text in missing if text]
+        if missing:
+            self._evaluate(segment, template, missing, stats)
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+
+def segment_members(session, segment: str, verdict: bool = True) -> pd.DataFrame:
+    """Loyalty metrics of the customers of `segment`, from the memoized verdicts"""
+    return router_for(session).to_pandas(
+        f"SELECT * FROM {SEGMENTS_VIEW} WHERE SEGMENT = ? AND VERDICT = ? ORDER BY CUSTOMER_ID",
+        params=[segment, verdict],
+    )
+
+
+def self_check():
+    """Memoization, near-duplicate baskets, new baskets and prompt changes, on DuckDB with the stand-in"""
+    import loyalty_metrics
+    from backend import memory_session
+
+    session = memory_session(("RAW_POS", "RAW_CUSTOMER", "HARMONIZED", "ANALYTICS"))
+    run_sql(session, f"""
+        CREATE TABLE {loyalty_metrics.PRODUCTS_TABLE} AS SELECT * FROM (VALUES
+            ('P1', '100 Ski Jacket Men''s'), ('P2', '500 Ski Jacket Men''s'),
+            ('P3', 'Kids'' Soccer Shirt 900'), ('P4', 'Hiking Shoes 3894')
+        ) t(PRODUCTID, PRODUCT_NAME)
+    """)
+    run_sql(session, f"""
+        CREATE TABLE {loyalty_metrics.CUSTOMERS_TABLE} AS
+        SELECT 'c' || i AS CUSTOMER_ID, 'Prénom' AS FIRST_NAME, 'Nom' AS LAST_NAME, NULL AS EMAIL, NULL AS PHONE,
+               DATE '2023-01-01' AS REGISTRATION_DATE, NULL AS PREFERRED_STORE, TRUE AS MARKETING_OPT_IN
+        FROM range(6) r(i)
+    """)
+    # c0/c1: two models of the same jacket; c2/c3: the kids' shirt; c4: shoes; c5: no order
+    run_sql(session, f"""
+        CREATE TABLE {loyalty_metrics.ORDERS_TABLE} AS SELECT * FROM (VALUES
+            ('o1', 'c0', 'P1'), ('o2', 'c1', 'P2'), ('o3', 'c2', 'P3'), ('o4', 'c3', 'P3'), ('o5', 'c4', 'P4')
+        ) t(ORDER_ID, CUSTOMER_ID, PRODUCT_ID), (SELECT DATE '2024-01-10' AS SALE_DATE, 50.0 AS SALES_PRICE_EURO,
+            0.0 AS DISCOUNT_AMOUNT_EURO)
+    """)
+    loyalty_metrics.install(session)
+    loyalty_metrics.rebuild(session)
+    install(session)
+
+    calls = []
+
+    def counting(template, baskets):
+        calls.extend(baskets)
+        return local_filter(template, baskets)
+
+    stats = BasketSegmenter(session, counting).run("enfants")
+    # 6 customers, 4 baskets: jacket, kids' shirt, shoes, and the empty one, never sent to the model
+    assert (stats.customers, stats.baskets, stats.evaluated) == (6, 4, 3), stats
+    assert "" not in calls
+    assert list(segment_members(session, "enfants")["CUSTOMER_ID"]) == ["c2", "c3"]
+    assert "c5" in set(segment_members(session, "enfants", verdict=False)["CUSTOMER_ID"])
+
+    stats = BasketSegmenter(session, counting).run("enfants")
+    assert (stats.memoized, stats.evaluated, stats.remapped) == (4, 0, 0), stats
+
+    # c4 buys the kids' shirt: one new basket, one evaluation
+    run_sql(session, f"INSERT INTO {loyalty_metrics.ORDERS_TABLE} VALUES ('o6', 'c4', 'P3', DATE '2024-01-11', 20.0, 0.0)")
+    loyalty_metrics.refresh(session)
+    stats = BasketSegmenter(session, counting).run("enfants")
+    assert (stats.remapped, stats.evaluated) == (1, 1), stats
+    assert list(segment_members(session, "enfants")["CUSTOMER_ID"]) == ["c2", "c3", "c4"]
+
+    # A new prompt is evaluated again on every distinct basket, the view follows it
+    reworded = {"enfants": SEGMENTS["enfants"].replace("cette personne", "ce client")}
+    install(session, reworded)
+    stats = BasketSegmenter(session, counting, reworded).run("enfants")
+    assert (stats.baskets, stats.evaluated) == (4, 3), stats
+    assert len(segment_members(session, "enfants", verdict=False)) == 3
+    print(f"{len(calls)} évaluations pour 6 clients x 4 exécutions : OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segment", choices=sorted(SEGMENTS), default="enfants")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--local-filter", action="store_true", help="sans modèle, même sur Snowflake")
+    parser.add_argument("--self-check", action="store_true")
+    args = parser.parse_args()
+
+    if args.self_check:
+        self_check()
+        return
+
+    from backend import LOCAL, get_backend
+
+    backend = get_backend()
+    session = backend.session
+    evaluate = local_filter if args.local_filter or backend.name == LOCAL else snowflake_filter(session)
+    install(session)
+    stats = BasketSegmenter(session, evaluate, batch_size=args.batch_size, concurrency=args.concurrency).run(
+        args.segment
+    )
+    members = segment_members(session, args.segment)
+    print(f"{stats.customers:,} clients, {stats.baskets:,} paniers distincts : {stats.memoized:,} mémorisés, "
+          f"{stats.evaluated:,} évalués, {stats.failed_batches} lots en échec, {stats.remapped:,} clients "
+          f"remappés en {stats.seconds:.1f} s ; segment « {args.segment} » : {len(members):,} clients")
+    for error in stats.errors[:5]:
+        print(f"  erreur : {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Prévision locale par lots
+=========================
+Additive Holt-Winters with weekly seasonality, fitted for every store in one
+batched NumPy pass: the recursion runs over days while stores and smoothing
+parameter candidates are array dimensions. Returns the same columns as
+SPORTS_AGGREGATED_FORECAST_STORE (FORECAST, UPPER_BOUND, LOWER_BOUND), so
+what-if scenarios (horizon, promo uplift, excluded stores) need no round trip
+to the data-science warehouse.
+"""
+import itertools
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+SEASON = 7
+Z_95 = 1.96
+
+# Candidate (alpha, beta, gamma); the best one is picked per store on in-sample SSE
+DEFAULT_GRID = list(itertools.product((0.1, 0.3, 0.5), (0.01, 0.1), (0.05, 0.2)))
+
+
+@dataclass
+class BatchForecast:
+    """Forecast of every store plus the total, with fit diagnostics"""
+    stores: pd.DataFrame  # STORE_NAME, SALE_DATE, FORECAST, UPPER_BOUND, LOWER_BOUND
+    total: pd.DataFrame  # SALE_DATE, FORECAST, UPPER_BOUND, LOWER_BOUND
+    params: pd.DataFrame  # STORE_NAME, ALPHA, BETA, GAMMA, SIGMA
+    fit_seconds: float
+
+
+def empty_forecast() -> BatchForecast:
+    """No store to forecast: the columns of a BatchForecast without rows"""
+    dates = pd.DatetimeIndex([], dtype="datetime64[ns]")
+    bounds = {column: np.empty(0) for column in ("FORECAST", "UPPER_BOUND", "LOWER_BOUND")}
+    return BatchForecast(
+        stores=pd.DataFrame({"STORE_NAME": np.empty(0, dtype=object), "SALE_DATE": dates, **bounds}),
+        total=pd.DataFrame({"SALE_DATE": dates, **bounds}),
+        params=pd.DataFrame(columns=["STORE_NAME", "ALPHA", "BETA", "GAMMA", "SIGMA"]),
+        fit_seconds=0.0,
+    )
+
+
+def daily_matrix(history: pd.DataFrame, value: str = "DAILY_REVENUE"):
+    """Long daily rows -> (store names, dates, stores x days matrix); missing days are 0"""
+    history = history.assign(SALE_DATE=pd.to_datetime(history["SALE_DATE"]).dt.normalize())
+    wide = history.pivot_table(index="STORE_NAME", columns="SALE_DATE", values=value, aggfunc="sum")
+    dates = pd.date_range(wide.columns.min(), wide.columns.max(), freq="D")
+    wide = wide.reindex(columns=dates).fillna(0.0)
+    return list(wide.index), dates, wide.to_numpy(np.float64)
+
+
+def _fit(y: np.ndarray, alpha, beta, gamma, season: int = SEASON):
+    """
+    Run the additive Holt-Winters recursion on y (stores x days).
+
+    alpha, beta, gamma broadcast against the store axis, e.g. shape (C, 1) to
+    evaluate C parameter candidates for every store at once. Returns the final
+    level, trend, seasonal state and the sum of squared one-step errors.
+    """
+    n_days = y.shape[-1]
+    level = y[..., :season].mean(axis=-1)
+    if n_days >= 2 * season:
+        trend = (y[..., season:2 * season].mean(axis=-1) - level) / season
+    else:
+        trend = np.zeros_like(level)
+    seasonal = y[..., :season] - level[..., None]
+
+    shape = np.broadcast_shapes(np.shape(alpha), level.shape)
+    level = np.broadcast_to(level, shape).copy()
+    trend = np.broadcast_to(trend, shape).copy()
+    seasonal = np.broadcast_to(seasonal, shape + (season,)).copy()
+    sse = np.zeros(shape)
+
+    for t in range(season, n_days):
+        s = seasonal[..., t % season]
+        observed = y[..., t]
+        error = observed - (level + trend + s)
+        sse += error * error
+        previous_level = level
+        level = alpha * (observed - s) + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+        seasonal[..., t % season] = gamma * (observed - level) + (1 - gamma) * s
+    return level, trend, seasonal, sse
+
+
+def _interval_factor(alpha, beta, gamma, horizon: int, season: int = SEASON):
+    """sqrt of the h-step variance multiplier of additive Holt-Winters (per store, per step)"""
+    steps = np.arange(1, horizon)
+    c = (
+        alpha[:, None]
+        + alpha[:, None] * beta[:, None] * steps[None, :]
+        + gamma[:, None] * (steps[None, :] % season == 0)
+    )
+    cumulative = np.concatenate([np.zeros((len(alpha), 1)), np.cumsum(c * c, axis=1)], axis=1)
+    return np.sqrt(1.0 + cumulative)
+
+
+def forecast_all_stores(
+    history: pd.DataFrame,
+    horizon: int = 30,
+    uplift: Union[float, Dict[str, float]] = 0.0,
+    exclude: Optional[Iterable[str]] = None,
+    value: str = "DAILY_REVENUE",
+    grid=DEFAULT_GRID,
+    z: float = Z_95,
+) -> BatchForecast:
+    """
+    Forecast every store of `history` (STORE_NAME, SALE_DATE, value columns).
+
+    Args:
+        horizon (int): Days to forecast after the last historical day.
+        uplift (float | dict): Promo effect applied to the forecast, e.g. 0.1
+            for +10%, globally or per store name.
+        exclude (Iterable[str]): Stores left out of the forecast and the total.
+
+    Returns an empty BatchForecast when no store is left to forecast.
+    """
+    excluded = set(exclude or [])
+    history = history[~history["STORE_NAME"].isin(excluded)]
+    if history.empty:
+        return empty_forecast()
+    stores, dates, y = daily_matrix(history, value)
+    if y.shape[1] < SEASON:
+        raise ValueError(f"Au moins {SEASON} jours d'historique sont nécessaires")
+
+    start = time.perf_counter()
+    grid = np.asarray(grid, dtype=np.float64)
+    alphas, betas, gammas = (grid[:, i, None] for i in range(3))
+    # Every candidate for every store in a single pass: arrays are (candidates, stores)
+    _, _, _, sse = _fit(y, alphas, betas, gammas)
+    best = np.argmin(sse, axis=0)
+    alpha, beta, gamma = grid[best, 0], grid[best, 1], grid[best, 2]
+    level, trend, seasonal, sse = _fit(y, alpha, beta, gamma)
+    fit_seconds = time.perf_counter() - start
+
+    n_steps = max(y.shape[1] - SEASON, 1)
+    sigma = np.sqrt(sse / n_steps)
+    steps = np.arange(1, horizon + 1)
+    last_t = y.shape[1] - 1
+    season_idx = (last_t + steps) % SEASON
+    point = level[:, None] + trend[:, None] * steps[None, :] + seasonal[:, season_idx]
+
+    if isinstance(uplift, dict):
+        factor = np.array([1.0 + uplift.get(store, 0.0) for store in stores])[:, None]
+    else:
+        factor = 1.0 + float(uplift)
+    point = point * factor
+    spread = z * sigma[:, None] * _interval_factor(alpha, beta, gamma, horizon) * factor
+
+    future = pd.date_range(dates[-1] + pd.Timedelta(days=1), periods=horizon, freq="D")
+    per_store = pd.DataFrame({
+        "STORE_NAME": np.repeat(stores, horizon),
+        "SALE_DATE": np.tile(future, len(stores)),
+        "FORECAST": point.ravel(),
+        "UPPER_BOUND": (point + spread).ravel(),
+        "LOWER_BOUND": (point - spread).ravel(),
+    })
+    # Independent store errors: variances add up in the total
+    total_point = point.sum(axis=0)
+    total_spread = np.sqrt((spread ** 2).sum(axis=0))
+    total = pd.DataFrame({
+        "SALE_DATE": future,
+        "FORECAST": total_point,
+        "UPPER_BOUND": total_point + total_spread,
+        "LOWER_BOUND": total_point - total_spread,
+    })
+    params = pd.DataFrame({"STORE_NAME": stores, "ALPHA": alpha, "BETA": beta, "GAMMA": gamma, "SIGMA": sigma})
+    return BatchForecast(per_store, total, params, fit_seconds)
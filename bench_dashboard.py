@@ -0,0 +1,553 @@
+"""
+Benchmark des tableaux de bord
+==============================
+Loads synthetic orders into DuckDB with the schema of ss_101.analytics.orders_v
+and replays, stage by stage, what ss_sales.py (KPI dashboard) and
+streamlit_app.py (forecast app) do on a page load:
+
+* query   - every SQL statement the pages send, unchanged for the orders view
+  (the DuckDB files are attached as the SS_101 and SPORTS_DB catalogs); the
+  forecast app calls the functions of sales_data.py themselves, on the
+  LocalSession of backend.py over the same database;
+* pandas  - the post-processing of the results (rollup cube, period
+  comparison, LTTB downsampling, merges, local forecast);
+* decode  - the Arrow to pandas decoding of the cube rows, part of their
+  query stage, from the DecodeStats of result_decoder.fetch_dataframe;
+* plotly  - the construction of every figure.
+
+Each stage runs `--repeat` times; the report gives p50/p95/p99 latency and
+the peak resident memory above the level at the start of the stage, and for
+decode stages the peak Arrow allocation while the batches were fetched.
+
+Usage:
+    python bench_dashboard.py                     # 1M rows
+    python bench_dashboard.py --rows 1M 10M 100M --repeat 5 --output bench.csv
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+
+import duckdb
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objs as go
+
+from backend import LocalSession
+from batch_forecast import forecast_all_stores
+from chart_utils import SeriesBudget
+from period_comparison import previous_period
+from result_decoder import fetch_dataframe
+from rollup_cube import STORE_COLUMNS, RollupCube, cube_query, distinct_customers_query
+from sales_data import (
+    DAILY_STORE_TABLE, DAILY_TABLE, FORECAST_STORE_TABLE, FORECAST_TABLE, PAGE_KEY, SALES_TABLE,
+    fetch_forecast_horizon, fetch_sales_page, fetch_window,
+)
+from synthetic_data import parse_rows
+
+STORES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SS_STORES.csv")
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "ss_bench")
+
+# ss_101.analytics.orders_v: DATE(sale_date) AS DATE, then the columns of the
+# harmonized dynamic table (SUMMIT_SPORTS.ipynb), types of ORDERS_SV.yaml
+ORDERS_V_SCHEMA = {
+    "DATE": "DATE",
+    "ORDER_ID": "VARCHAR",
+    "STOREID": "VARCHAR",
+    "SALE_DATE": "DATE",
+    "PRODUCT_ID": "VARCHAR",
+    "QUANTITY": "DECIMAL(38, 0)",
+    "SALES_PRICE_EURO": "DOUBLE",
+    "DISCOUNT_AMOUNT_EURO": "DOUBLE",
+    "PAYMENT_METHOD": "VARCHAR",
+    "SALES_ASSISTANT_ID": "VARCHAR",
+    "CUSTOMER_ID": "VARCHAR",
+    "CARD_ID": "VARCHAR",
+    "FIRST_NAME": "VARCHAR",
+    "LAST_NAME": "VARCHAR",
+    "STORE_NAME": "VARCHAR",
+    "STORE_TYPE": "VARCHAR",
+    "POSTCODE": "VARCHAR",
+    "PRODUCT_NAME": "VARCHAR",
+    "BRAND": "VARCHAR",
+    "MRP": "DECIMAL(38, 2)",
+    "SALE_PRICE": "DECIMAL(38, 2)",
+    "COLOUR": "VARCHAR",
+    "PRODUCT_CATEGORY": "VARCHAR",
+}
+
+HISTORY_DAYS = 730
+LINES_PER_ORDER = 2.3
+CHUNK_ROWS = 5_000_000
+N_PRODUCTS = 2_000
+
+BRANDS = ["Wedze", "Forclaz", "Domyos", "Salomon", "Wilson", "Adidas", "Quechua", "Kipsta"]
+CATEGORIES = ["Ski Socks", "Gloves", "Kids' Soccer Shirts", "Women's Pants", "Women's Thermal Underwear",
+              "Men's Jackets", "Backpacks", "Hiking Shoes"]
+COLOURS = ["Black", "Whale Gray", "Light Gray", "Navy", "Red"]
+PAYMENT_METHODS = ["Cash", "Gift Card", "Debit Card", "Credit Card"]
+FIRST_NAMES = ["Sylvie", "Isabelle", "Célina", "Emmanuelle", "Christelle", "Agathe", "Louis", "Hugo"]
+LAST_NAMES = ["Collin", "Marie", "Le Roux", "Rivière", "Coulon", "Poulain", "Martin", "Bernard"]
+
+
+def _sql_list(values) -> str:
+    return "[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def _uuid(expression: str) -> str:
+    """Deterministic UUID-shaped VARCHAR from the md5 of `expression`"""
+    h = f"md5({expression})"
+    return (f"substr({h}, 1, 8) || '-' || substr({h}, 9, 4) || '-' || substr({h}, 13, 4)"
+            f" || '-' || substr({h}, 17, 4) || '-' || substr({h}, 21, 12)")
+
+
+def _create_dimensions(con, n_orders: int):
+    stores = pd.read_csv(STORES_CSV, dtype=str)
+    con.register("stores_csv", stores)
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE bench_stores AS
+        SELECT row_number() OVER (ORDER BY STOREID) - 1 AS k, STOREID, STORE_NAME, STORE_TYPE, POSTCODE
+        FROM stores_csv
+    """)
+    con.unregister("stores_csv")
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE bench_products AS
+        SELECT
+            k,
+            upper(substr(category, 1, 3)) || '-' || lpad(CAST(1000 + k AS VARCHAR), 4, '0') AS PRODUCT_ID,
+            brand || ' ' || category || ' ' || CAST(k AS VARCHAR) AS PRODUCT_NAME,
+            brand AS BRAND,
+            category AS PRODUCT_CATEGORY,
+            {_sql_list(COLOURS)}[1 + k % {len(COLOURS)}] AS COLOUR,
+            CAST(round(mrp, 2) AS DECIMAL(38, 2)) AS MRP,
+            CAST(round(mrp * (1 - (k % 4) * 0.1), 2) AS DECIMAL(38, 2)) AS SALE_PRICE
+        FROM (
+            SELECT
+                range AS k,
+                {_sql_list(BRANDS)}[1 + CAST(hash(range, 'brand') % {len(BRANDS)} AS BIGINT)] AS brand,
+                {_sql_list(CATEGORIES)}[1 + CAST(hash(range, 'category') % {len(CATEGORIES)} AS BIGINT)] AS category,
+                5 + CAST(hash(range, 'mrp') % 30000 AS BIGINT) / 100.0 AS mrp
+            FROM range({N_PRODUCTS})
+        )
+    """)
+    n_customers = max(1_000, n_orders // 8)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE bench_customers AS
+        SELECT
+            range AS k,
+            {_uuid("'customer' || range")} AS CUSTOMER_ID,
+            {_uuid("'card' || range")} AS CARD_ID,
+            {_sql_list(FIRST_NAMES)}[1 + CAST(hash(range, 'first') % {len(FIRST_NAMES)} AS BIGINT)] AS FIRST_NAME,
+            {_sql_list(LAST_NAMES)}[1 + CAST(hash(range, 'last') % {len(LAST_NAMES)} AS BIGINT)] AS LAST_NAME
+        FROM range({n_customers})
+    """)
+    return len(stores), n_customers
+
+
+def generate_orders(con, rows: int, end_date: date, chunk_rows: int = CHUNK_ROWS):
+    """Fill ss_101.analytics.orders_v with `rows` order lines over HISTORY_DAYS days up to `end_date`"""
+    n_orders = max(1, int(rows / LINES_PER_ORDER))
+    n_stores, n_customers = _create_dimensions(con, n_orders)
+    columns = ",\n".join(f"{name} {sql_type}" for name, sql_type in ORDERS_V_SCHEMA.items())
+    con.execute("CREATE SCHEMA IF NOT EXISTS ss_101.analytics")
+    con.execute(f"CREATE OR REPLACE TABLE ss_101.analytics.orders_v (\n{columns}\n)")
+    first_day = end_date - timedelta(days=HISTORY_DAYS - 1)
+
+    for lo in range(0, rows, chunk_rows):
+        hi = min(rows, lo + chunk_rows)
+        # Lines of an order share its date, store and customer; days are in insertion order
+        con.execute(f"""
+            INSERT INTO ss_101.analytics.orders_v
+            SELECT
+                sale_date AS DATE,
+                {_uuid("'order' || o.order_no")} AS ORDER_ID,
+                s.STOREID,
+                sale_date AS SALE_DATE,
+                p.PRODUCT_ID,
+                quantity AS QUANTITY,
+                round(CAST(p.SALE_PRICE AS DOUBLE) * quantity, 2) AS SALES_PRICE_EURO,
+                CASE WHEN CAST(hash(o.line, 'discount') % 5 AS BIGINT) = 0
+                     THEN round(CAST(p.SALE_PRICE AS DOUBLE) * quantity * 0.1, 2) ELSE 0 END AS DISCOUNT_AMOUNT_EURO,
+                {_sql_list(PAYMENT_METHODS)}[1 + CAST(hash(o.order_no, 'payment') % {len(PAYMENT_METHODS)} AS BIGINT)] AS PAYMENT_METHOD,
+                'ASSISTANT_' || CAST(CAST(hash(o.order_no, 'assistant') % 800 AS BIGINT) AS VARCHAR) AS SALES_ASSISTANT_ID,
+                c.CUSTOMER_ID,
+                c.CARD_ID,
+                c.FIRST_NAME,
+                c.LAST_NAME,
+                s.STORE_NAME,
+                s.STORE_TYPE,
+                s.POSTCODE,
+                p.PRODUCT_NAME,
+                p.BRAND,
+                p.MRP,
+                p.SALE_PRICE,
+                p.COLOUR,
+                p.PRODUCT_CATEGORY
+            FROM (
+                SELECT
+                    range AS line,
+                    CAST(range / {LINES_PER_ORDER} AS BIGINT) AS order_no,
+                    DATE '{first_day:%Y-%m-%d}' + CAST(range * {HISTORY_DAYS} // {rows} AS INTEGER) AS sale_date,
+                    1 + CAST(hash(range, 'quantity') % 4 AS BIGINT) AS quantity
+                FROM range({lo}, {hi})
+            ) AS o
+            JOIN bench_stores s ON s.k = CAST(hash(o.order_no, 'store') % {n_stores} AS BIGINT)
+            JOIN bench_customers c ON c.k = CAST(hash(o.order_no, 'customer') % {n_customers} AS BIGINT)
+            JOIN bench_products p ON p.k = CAST(hash(o.line, 'product') % {N_PRODUCTS} AS BIGINT)
+        """)
+        print(f"  {hi:>12,} / {rows:,} lignes", flush=True)
+
+
+def derive_forecast_tables(con):
+    """Daily aggregates, forecasts and the raw sales table read by streamlit_app.py"""
+    for schema in ("SPORTS_TRANSFORMATION", "SPORTS_datascience", "SPORTS_DATA"):
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS SPORTS_DB.{schema}")
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {DAILY_TABLE} AS
+        SELECT SALE_DATE, SUM(SALES_PRICE_EURO) AS DAILY_REVENUE, COUNT(DISTINCT ORDER_ID) AS DAILY_TRANSACTIONS
+        FROM ss_101.analytics.orders_v GROUP BY SALE_DATE
+    """)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {DAILY_STORE_TABLE} AS
+        SELECT STORE_NAME, SALE_DATE, SUM(SALES_PRICE_EURO) AS DAILY_REVENUE,
+               COUNT(DISTINCT ORDER_ID) AS DAILY_TRANSACTIONS
+        FROM ss_101.analytics.orders_v GROUP BY STORE_NAME, SALE_DATE
+    """)
+    # The stored forecasts: the last 180 days replayed on the next 180 days
+    for source, target, keys in ((DAILY_TABLE, FORECAST_TABLE, ""),
+                                 (DAILY_STORE_TABLE, FORECAST_STORE_TABLE, "STORE_NAME, ")):
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {target} AS
+            SELECT {keys}SALE_DATE + 180 AS SALE_DATE, DAILY_REVENUE AS FORECAST,
+                   DAILY_REVENUE * 1.1 AS UPPER_BOUND, DAILY_REVENUE * 0.9 AS LOWER_BOUND
+            FROM {source}
+            WHERE SALE_DATE > (SELECT MAX(SALE_DATE) FROM {source}) - 180
+        """)
+    con.execute(f"""
+        CREATE OR REPLACE VIEW {SALES_TABLE} AS
+        SELECT ORDER_ID, STOREID, STORE_NAME, PRODUCT_ID, PAYMENT_METHOD, SALES_ASSISTANT_ID,
+               CUSTOMER_ID, CARD_ID, SALE_DATE, QUANTITY, SALES_PRICE_EURO
+        FROM ss_101.analytics.orders_v
+    """)
+
+
+def open_database(rows: int, directory: str = DEFAULT_DIRECTORY, rebuild: bool = False, end_date: date = None):
+    """DuckDB connection with SS_101 and SPORTS_DB attached, generated on first use"""
+    path = os.path.join(directory, f"{rows}")
+    os.makedirs(path, exist_ok=True)
+    ss_101 = os.path.join(path, "ss_101.duckdb")
+    sports_db = os.path.join(path, "sports_db.duckdb")
+    if rebuild:
+        for file in (ss_101, sports_db):
+            if os.path.exists(file):
+                os.remove(file)
+    fresh = not os.path.exists(ss_101)
+    con = duckdb.connect()
+    con.execute(f"ATTACH '{ss_101}' AS ss_101")
+    con.execute(f"ATTACH '{sports_db}' AS sports_db")
+    if fresh:
+        start = time.perf_counter()
+        generate_orders(con, rows, end_date or date.today())
+        derive_forecast_tables(con)
+        con.execute("CHECKPOINT ss_101")
+        con.execute("CHECKPOINT sports_db")
+        print(f"  données générées en {time.perf_counter() - start:.1f} s", flush=True)
+    return con
+
+
+class PeakMemory:
+    """
+    Peak resident memory above the level at start, sampled in a thread.
+
+    Resident memory covers DuckDB and Arrow buffers that tracemalloc does not
+    see; with `python_heap`, the tracemalloc peak is reported as well.
+    """
+
+    def __init__(self, interval: float = 0.002, python_heap: bool = False):
+        self.interval = interval
+        self.python_heap = python_heap
+        self.peak_bytes = 0
+        self.python_peak_bytes = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._stop = threading.Event()
+
+    def _rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            return 0
+
+    def _sample(self, baseline: int):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self._rss() - baseline)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        baseline = self._rss()
+        self._thread = threading.Thread(target=self._sample, args=(baseline,), daemon=True)
+        self._thread.start()
+        if self.python_heap:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.python_heap:
+            self.python_peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self._stop.set()
+        self._thread.join()
+
+
+class StageTimer:
+    """Latencies and peak memory of every stage, over all repeats"""
+
+    def __init__(self, python_heap: bool = False):
+        self.python_heap = python_heap
+        self.samples: Dict[tuple, List[tuple]] = {}
+
+    def run(self, app: str, stage: str, kind: str, fn: Callable):
+        with PeakMemory(python_heap=self.python_heap) as memory:
+            start = time.perf_counter()
+            value = fn()
+            seconds = time.perf_counter() - start
+        self.record(app, stage, kind, seconds, memory.peak_bytes, memory.python_peak_bytes)
+        return value
+
+    def record(self, app: str, stage: str, kind: str, seconds: float, peak_bytes: Optional[int] = None,
+               python_peak_bytes: Optional[int] = None, arrow_peak_bytes: Optional[int] = None):
+        """A sample measured by the stage itself, e.g. the DecodeStats of a fetch"""
+        self.samples.setdefault((app, stage, kind), []).append(
+            (seconds, peak_bytes, python_peak_bytes, arrow_peak_bytes)
+        )
+
+    def report(self, rows: int) -> pd.DataFrame:
+        records = []
+        for (app, stage, kind), samples in self.samples.items():
+            seconds = np.array([s[0] for s in samples]) * 1000
+            rss_peaks = [s[1] for s in samples if s[1] is not None]
+            python_peaks = [s[2] for s in samples if s[2] is not None]
+            arrow_peaks = [s[3] for s in samples if s[3] is not None]
+            records.append({
+                "ROWS": rows,
+                "APP": app,
+                "STAGE": stage,
+                "KIND": kind,
+                "RUNS": len(samples),
+                "P50_MS": float(np.percentile(seconds, 50)),
+                "P95_MS": float(np.percentile(seconds, 95)),
+                "P99_MS": float(np.percentile(seconds, 99)),
+                "PEAK_RSS_MB": max(rss_peaks) / 1024 ** 2 if rss_peaks else None,
+                "PEAK_PY_MB": max(python_peaks) / 1024 ** 2 if python_peaks else None,
+                "PEAK_ARROW_MB": max(arrow_peaks) / 1024 ** 2 if arrow_peaks else None,
+            })
+        return pd.DataFrame(records)
+
+
+def bench_ss_sales(con, session, timer: StageTimer, start_date: date, end_date: date, product_limit: int = 20):
+    """Page load of ss_sales.py: cube, unique customers, the four tabs and the example queries"""
+    app = "ss_sales"
+    query = lambda sql: (lambda: con.sql(sql).df())
+    cube_start = min(previous_period(start_date, end_date)[0], start_date)
+
+    # DayPartitionCache cold: one query for the whole range, fetched as sales_day_cache does
+    def fetch_cube():
+        df, stats = fetch_dataframe(session, cube_query(cube_start, end_date))
+        timer.record(app, "cube", "decode", stats.decode_seconds, arrow_peak_bytes=stats.peak_arrow_bytes)
+        return df
+    cube_rows = timer.run(app, "cube", "query", fetch_cube)
+    customers = timer.run(app, "clients_uniques", "query", query(
+        distinct_customers_query(f"{start_date:%Y-%m-%d}", f"{end_date:%Y-%m-%d}")
+    ))
+    cube = timer.run(app, "cube", "pandas", lambda: RollupCube.from_frame(cube_rows))
+
+    def overview():
+        comparison = cube.period_comparison(start_date, end_date)
+        daily_sales = comparison.daily
+        daily_sales["SALE_DATE_STR"] = daily_sales["SALE_DATE"].astype(str)
+        budget = SeriesBudget()
+        return (budget, budget.frame(daily_sales, "SALE_DATE", "REVENUE"),
+                budget.frame(daily_sales, "SALE_DATE", "NB_ORDERS"))
+
+    budget, revenue_points, orders_points = timer.run(app, "vue_ensemble", "pandas", overview)
+
+    def overview_figures():
+        fig_revenue = px.line(
+            revenue_points, x="SALE_DATE_STR", y="REVENUE", title="📈 Évolution du Chiffre d'Affaires",
+            labels={"SALE_DATE_STR": "Date", "REVENUE": "Revenus (€)"}, render_mode=budget.render_mode,
+        )
+        fig_revenue.update_layout(height=400)
+        fig_orders = px.bar(orders_points, x="SALE_DATE_STR", y="NB_ORDERS",
+                            title="📦 Évolution du Nombre de Commandes")
+        fig_orders.update_layout(height=400)
+        return fig_revenue, fig_orders
+
+    timer.run(app, "vue_ensemble", "plotly", overview_figures)
+
+    products_data = timer.run(app, "produits", "pandas",
+                              lambda: cube.top_products(start_date, end_date, product_limit))
+
+    def products_figure():
+        fig = px.bar(products_data.head(15), x="TOTAL_REVENUE", y="PRODUCT_NAME", orientation="h",
+                     title="🏆 Top Produits par Revenus", color="TOTAL_REVENUE", color_continuous_scale="Blues")
+        fig.update_layout(yaxis={"categoryorder": "total ascending"}, height=600)
+        return fig
+
+    timer.run(app, "produits", "plotly", products_figure)
+
+    stores_data = timer.run(app, "magasins", "pandas", lambda: cube.store_ranking(start_date, end_date).merge(
+        customers[customers["IS_TOTAL"] == 0][STORE_COLUMNS + ["UNIQUE_CUSTOMERS"]], on=STORE_COLUMNS, how="left"
+    ))
+
+    def stores_figure():
+        fig = px.bar(stores_data.head(15), x="REVENUE", y="STORE_NAME", orientation="h",
+                     title="🏆 Top 15 Magasins par CA", color="STORE_TYPE")
+        fig.update_layout(yaxis={"categoryorder": "total ascending"}, height=600)
+        return fig
+
+    timer.run(app, "magasins", "plotly", stores_figure)
+
+    # Exemples de requêtes de l'onglet Données Détaillées et Export
+    timer.run(app, "exemple_lignes", "query", query("SELECT * FROM ss_101.analytics.orders_v LIMIT 100"))
+    timer.run(app, "exemple_top_produits", "query", query("""
+        SELECT PRODUCT_NAME, SUM(SALES_PRICE_EURO) as revenue
+        FROM ss_101.analytics.orders_v
+        WHERE SALE_DATE >= CURRENT_DATE() - 30
+        GROUP BY PRODUCT_NAME
+        ORDER BY revenue DESC
+        LIMIT 10
+    """))
+    timer.run(app, "exemple_ventes_mois", "query", query("""
+        SELECT
+            DATE_TRUNC('month', SALE_DATE) as month,
+            SUM(SALES_PRICE_EURO) as revenue
+        FROM ss_101.analytics.orders_v
+        GROUP BY month
+        ORDER BY month
+    """))
+
+
+def bench_forecast_app(session, timer: StageTimer, store: Optional[str], days: int = 30, scenario_horizon: int = 30):
+    """Page load of streamlit_app.py, through the sales_data.py functions on a local session"""
+    app = "streamlit_app"
+    table = DAILY_STORE_TABLE if store else DAILY_TABLE
+
+    # load_daily_sales without its cache
+    filtered_data = timer.run(app, "historique", "query", lambda: fetch_window(session, table, store, days))
+
+    def history_figure():
+        fig = go.Figure()
+        budget = SeriesBudget()
+        fig.add_trace(budget.scatter(x=filtered_data["SALE_DATE"], y=filtered_data["DAILY_REVENUE"], mode="lines",
+                                     name="Total Revenue", line=dict(color="red"), yaxis="y1"))
+        fig.add_trace(budget.scatter(x=filtered_data["SALE_DATE"], y=filtered_data["DAILY_TRANSACTIONS"],
+                                     mode="lines", name="# de Ventes", line=dict(color="navy"), yaxis="y2"))
+        fig.update_layout(
+            title="Ventes",
+            xaxis_title="Date",
+            yaxis=dict(title=dict(text="Revenue des Ventes (€)", font=dict(color="red")),
+                       tickfont=dict(color="red")),
+            yaxis2=dict(title=dict(text="# des Ventes", font=dict(color="navy")),
+                        tickfont=dict(color="navy"), overlaying="y", side="right"),
+            legend_title="Indicateurs",
+            hovermode="x unified",
+            template="plotly_white",
+        )
+        return fig
+
+    fig = timer.run(app, "historique", "plotly", history_figure)
+
+    # What ForecastServer runs in the background
+    last_hist_date = filtered_data["SALE_DATE"].max()
+    forecast_only = timer.run(app, "prevision", "query", lambda: fetch_forecast_horizon(
+        session, store, days, last_hist_date
+    ))
+
+    def forecast_traces():
+        last_hist_value = filtered_data.loc[filtered_data["SALE_DATE"] == last_hist_date, "DAILY_REVENUE"].values[0]
+        fig.add_trace(go.Scatter(x=[last_hist_date] + list(forecast_only["SALE_DATE"]),
+                                 y=[last_hist_value] + list(forecast_only["FORECAST"]), mode="lines",
+                                 name="Prévision de Revenue", line=dict(color="red", dash="dot"), yaxis="y1"))
+        fig.add_trace(go.Scatter(x=forecast_only["SALE_DATE"], y=forecast_only["UPPER_BOUND"], mode="lines",
+                                 name="Borne Supérieure", line=dict(color="darkred", dash="dash"), yaxis="y1",
+                                 showlegend=False))
+        fig.add_trace(go.Scatter(x=forecast_only["SALE_DATE"], y=forecast_only["LOWER_BOUND"], mode="lines",
+                                 name="Borne Inférieure", line=dict(color="salmon", dash="dash"), fill="tonexty",
+                                 fillcolor="rgba(255, 0, 0, 0.2)", yaxis="y1", showlegend=False))
+
+    timer.run(app, "prevision", "plotly", forecast_traces)
+
+    # Scénario : load_store_history(365) sans son cache, puis forecast_all_stores
+    history = timer.run(app, "scenario", "query", lambda: fetch_window(session, DAILY_STORE_TABLE, None, 365))
+    scenario = timer.run(app, "scenario", "pandas", lambda: forecast_all_stores(history, horizon=scenario_horizon))
+
+    def scenario_figure():
+        data = scenario.stores[scenario.stores["STORE_NAME"] == store] if store else scenario.total
+        scenario_fig = go.Figure()
+        scenario_fig.add_trace(go.Scatter(x=data["SALE_DATE"], y=data["UPPER_BOUND"], mode="lines",
+                                          name="Borne Supérieure", line=dict(color="darkred", dash="dash"),
+                                          showlegend=False))
+        scenario_fig.add_trace(go.Scatter(x=data["SALE_DATE"], y=data["LOWER_BOUND"], mode="lines",
+                                          name="Borne Inférieure", line=dict(color="salmon", dash="dash"),
+                                          fill="tonexty", fillcolor="rgba(255, 0, 0, 0.2)", showlegend=False))
+        scenario_fig.add_trace(go.Scatter(x=data["SALE_DATE"], y=data["FORECAST"], mode="lines",
+                                          name="Prévision de Revenue", line=dict(color="red", dash="dot")))
+        scenario_fig.update_layout(title="Scénario", xaxis_title="Date", yaxis_title="Revenue des Ventes (€)",
+                                   hovermode="x unified", template="plotly_white")
+        return scenario_fig
+
+    timer.run(app, "scenario", "plotly", scenario_figure)
+
+    # SalesBrowser: first page, then the page after its last key
+    first_page, _ = timer.run(app, "liste_ventes", "query", lambda: fetch_sales_page(session, store))
+    last = first_page.iloc[-1]
+    after = tuple(last[name].to_pydatetime() if name == "SALE_DATE" else last[name] for name in PAGE_KEY)
+    timer.run(app, "liste_ventes_suivante", "query", lambda: fetch_sales_page(session, store, after))
+
+
+def run(rows: int, repeat: int, directory: str, rebuild: bool, store: Optional[str],
+        period_days: int, python_heap: bool) -> pd.DataFrame:
+    print(f"{rows:,} lignes", flush=True)
+    con = open_database(rows, directory, rebuild)
+    end_date = con.sql("SELECT MAX(SALE_DATE) FROM ss_101.analytics.orders_v").fetchone()[0]
+    start_date = end_date - timedelta(days=period_days)
+    session = LocalSession(con)
+    timer = StageTimer(python_heap)
+    for _ in range(repeat):
+        bench_ss_sales(con, session, timer, start_date, end_date)
+        bench_forecast_app(session, timer, store)
+    session.executor.shutdown()
+    con.close()
+    return timer.report(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", nargs="+", default=["1M"], help="order lines per run, e.g. 1M 10M 100M")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of every stage")
+    parser.add_argument("--period", type=int, default=30, help="days of the KPI dashboard period")
+    parser.add_argument("--store", help="store of the forecast app (default: all stores)")
+    parser.add_argument("--directory", default=DEFAULT_DIRECTORY, help="where the DuckDB files are kept")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the data even if present")
+    parser.add_argument("--python-heap", action="store_true", help="also report the tracemalloc peak (slower)")
+    parser.add_argument("--output", help="write the report to this CSV file")
+    args = parser.parse_args()
+
+    reports = [
+        run(parse_rows(rows), args.repeat, args.directory, args.rebuild, args.store, args.period, args.python_heap)
+        for rows in args.rows
+    ]
+    report = pd.concat(reports, ignore_index=True)
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", 200, "display.float_format", "{:.1f}".format):
+        print(report.drop(columns="PEAK_PY_MB") if not args.python_heap else report)
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark de la prévision locale
+================================
+Compares batch_forecast (local Holt-Winters for every store) with the stored
+forecasts of SPORTS_AGGREGATED_FORECAST_STORE:
+
+* runtime of the batched fit for all stores;
+* backtest accuracy (MAPE / RMSE) on the last `horizon` days of history,
+  for the local model and for the stored forecast on the same days;
+* agreement between the two on the future horizon.
+
+Usage:
+    python bench_forecast.py                 # Snowflake (default connection)
+    python bench_forecast.py --synthetic 60  # offline, 60 synthetic stores
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from batch_forecast import forecast_all_stores
+
+DAILY_STORE_TABLE = "SPORTS_DB.SPORTS_TRANSFORMATION.INSTORE_SALES_CRM3_DAILY_MAGASIN_AGGREGATED"
+FORECAST_STORE_TABLE = "SPORTS_DB.SPORTS_DATASCIENCE.SPORTS_AGGREGATED_FORECAST_STORE"
+
+
+def synthetic_history(n_stores: int, n_days: int = 730, seed: int = 0) -> pd.DataFrame:
+    """Weekly + yearly seasonal daily revenue per store"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2023-01-01", periods=n_days, freq="D")
+    t = np.arange(n_days)
+    base = rng.uniform(2_000, 20_000, size=(n_stores, 1))
+    weekly = 1 + 0.3 * np.sin(2 * np.pi * t / 7)[None, :]
+    yearly = 1 + rng.uniform(0.1, 0.6, size=(n_stores, 1)) * np.cos(2 * np.pi * t / 365)[None, :]
+    noise = rng.normal(1, 0.08, size=(n_stores, n_days))
+    revenue = base * weekly * yearly * noise
+    return pd.DataFrame({
+        "STORE_NAME": np.repeat([f"SUMMITSPORT Store {i:03d}" for i in range(n_stores)], n_days),
+        "SALE_DATE": np.tile(dates, n_stores),
+        "DAILY_REVENUE": revenue.ravel(),
+    })
+
+
+def _errors(actual: pd.Series, predicted: pd.Series):
+    mask = actual.abs() > 0
+    mape = float((np.abs(actual - predicted)[mask] / actual[mask]).mean() * 100)
+    rmse = float(np.sqrt(((actual - predicted) ** 2).mean()))
+    return mape, rmse
+
+
+def backtest(history: pd.DataFrame, horizon: int, stored: pd.DataFrame = None):
+    """Fit on all but the last `horizon` days and score against the held-out days"""
+    history = history.assign(SALE_DATE=pd.to_datetime(history["SALE_DATE"]))
+    cutoff = history["SALE_DATE"].max() - pd.Timedelta(days=horizon)
+    train = history[history["SALE_DATE"] <= cutoff]
+    test = history[history["SALE_DATE"] > cutoff]
+
+    start = time.perf_counter()
+    result = forecast_all_stores(train, horizon=horizon)
+    total_seconds = time.perf_counter() - start
+
+    scored = test.merge(result.stores, on=["STORE_NAME", "SALE_DATE"], how="inner")
+    report = {
+        "stores": result.params.shape[0],
+        "train_days": train["SALE_DATE"].nunique(),
+        "fit_seconds": result.fit_seconds,
+        "total_seconds": total_seconds,
+    }
+    report["local_mape"], report["local_rmse"] = _errors(scored["DAILY_REVENUE"], scored["FORECAST"])
+    inside = (scored["DAILY_REVENUE"] >= scored["LOWER_BOUND"]) & (scored["DAILY_REVENUE"] <= scored["UPPER_BOUND"])
+    report["local_coverage"] = float(inside.mean() * 100)
+
+    if stored is not None and not stored.empty:
+        stored = stored.assign(SALE_DATE=pd.to_datetime(stored["SALE_DATE"]))
+        stored_scored = test.merge(stored, on=["STORE_NAME", "SALE_DATE"], how="inner")
+        if not stored_scored.empty:
+            report["stored_mape"], report["stored_rmse"] = _errors(
+                stored_scored["DAILY_REVENUE"], stored_scored["FORECAST"]
+            )
+    return report
+
+
+def agreement(history: pd.DataFrame, stored: pd.DataFrame, horizon: int):
+    """Mean absolute % gap between local and stored forecasts on the future horizon"""
+    result = forecast_all_stores(history, horizon=horizon)
+    stored = stored.assign(SALE_DATE=pd.to_datetime(stored["SALE_DATE"]))
+    both = result.stores.merge(stored, on=["STORE_NAME", "SALE_DATE"], suffixes=("_LOCAL", "_STORED"))
+    if both.empty:
+        return None
+    gap = np.abs(both["FORECAST_LOCAL"] - both["FORECAST_STORED"]) / both["FORECAST_STORED"].abs().clip(lower=1e-9)
+    return float(gap.mean() * 100)
+
+
+def load_from_snowflake(session):
+    history = session.table(DAILY_STORE_TABLE).select("STORE_NAME", "SALE_DATE", "DAILY_REVENUE").to_pandas()
+    stored = session.table(FORECAST_STORE_TABLE).select(
+        "STORE_NAME", "SALE_DATE", "FORECAST", "UPPER_BOUND", "LOWER_BOUND"
+    ).to_pandas()
+    return history, stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--horizon", type=int, default=30)
+    parser.add_argument("--synthetic", type=int, metavar="N_STORES", help="run offline on N synthetic stores")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of the batched fit")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        history, stored = synthetic_history(args.synthetic), None
+    else:
+        from snowflake.snowpark import Session
+        history, stored = load_from_snowflake(Session.builder.getOrCreate())
+
+    timings = []
+    for _ in range(args.repeat):
+        timings.append(forecast_all_stores(history, horizon=args.horizon).fit_seconds)
+    print(f"fit (all stores, {args.repeat} runs): best {min(timings) * 1000:.1f} ms, "
+          f"median {np.median(timings) * 1000:.1f} ms")
+
+    for key, value in backtest(history, args.horizon, stored).items():
+        print(f"{key:>16}: {value:.3f}" if isinstance(value, float) else f"{key:>16}: {value}")
+
+    if stored is not None:
+        gap = agreement(history, stored, args.horizon)
+        if gap is not None:
+            print(f"{'local vs stored':>16}: {gap:.1f}% mean absolute gap on the future horizon")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Séries temporelles pour Plotly
+==============================
+Downsamples time series on the server with Largest-Triangle-Three-Buckets
+(LTTB, shape preserving) to a point budget sized for the chart width, and
+switches to WebGL traces (Scattergl) above a threshold. Each SeriesBudget
+reports how many points were sent versus available.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+
+DEFAULT_MAX_POINTS = 1500  # ~ one point per pixel of a wide chart
+DEFAULT_WEBGL_THRESHOLD = 1000
+
+
+def _as_float(values) -> np.ndarray:
+    """Dates/timestamps -> epoch nanoseconds, numbers -> float64"""
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values) or values.dtype == object:
+        try:
+            return pd.to_datetime(values).astype("int64").to_numpy(np.float64)
+        except (TypeError, ValueError):
+            pass
+    return values.to_numpy(np.float64)
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """Indices of the `n_out` points kept by LTTB; first and last points are always kept"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    xs = _as_float(x)
+    ys = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    # n_out - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = xs[next_start:next_end].mean()
+        avg_y = ys[next_start:next_end].mean()
+        area = np.abs(
+            (xs[a] - avg_x) * (ys[start:end] - ys[a])
+            - (xs[a] - xs[start:end]) * (avg_y - ys[a])
+        )
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+class SeriesBudget:
+    """
+    Point budget shared by the series of one chart.
+
+    Use scatter() for graph_objects traces and frame() before Plotly Express;
+    caption() summarises points sent vs available for st.caption.
+    """
+
+    def __init__(self, max_points: int = DEFAULT_MAX_POINTS, webgl_threshold: int = DEFAULT_WEBGL_THRESHOLD):
+        self.max_points = max_points
+        self.webgl_threshold = webgl_threshold
+        self.points_available = 0
+        self.points_sent = 0
+        self.webgl = False
+
+    def _downsample(self, x, y) -> Tuple[np.ndarray, int]:
+        idx = lttb_indices(x, y, self.max_points)
+        self.points_available += len(x)
+        self.points_sent += len(idx)
+        if len(idx) > self.webgl_threshold:
+            self.webgl = True
+        return idx, len(idx)
+
+    def scatter(self, x, y, **kwargs):
+        """go.Scatter (or go.Scattergl above the threshold) on the downsampled series"""
+        x = np.asarray(x)
+        y = np.asarray(y)
+        idx, sent = self._downsample(x, y)
+        trace_type = go.Scattergl if sent > self.webgl_threshold else go.Scatter
+        return trace_type(x=x[idx], y=y[idx], **kwargs)
+
+    def frame(self, df: pd.DataFrame, x: str, y: str) -> pd.DataFrame:
+        """Rows of `df` kept by LTTB on column `y`"""
+        idx, _ = self._downsample(df[x].to_numpy(), df[y].to_numpy())
+        return df.iloc[idx]
+
+    @property
+    def render_mode(self) -> str:
+        """Value for Plotly Express' render_mode"""
+        return "webgl" if self.webgl else "svg"
+
+    def caption(self) -> Optional[str]:
+        if self.points_available == 0:
+            return None
+        text = f"{self.points_sent:,} points affichés sur {self.points_available:,}"
+        if self.webgl:
+            text += " (rendu WebGL)"
+        return text
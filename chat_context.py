@@ -0,0 +1,128 @@
+"""
+Contexte de conversation
+========================
+Builds the message list sent to Cortex Analyst on each turn. The last
+`recent_turns` exchanges are sent verbatim; older ones are compacted to the
+user question plus the final SQL of the answer, and dropped oldest first
+when the request would exceed `max_bytes`. The history kept in
+st.session_state is never modified: compaction only applies to the payload.
+"""
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+DEFAULT_RECENT_TURNS = 2
+DEFAULT_MAX_BYTES = 16_000
+SUMMARY_MAX_CHARS = 200  # answer text kept when a compacted answer has no SQL
+
+
+@dataclass
+class TurnStats:
+    """Size and latency of one call to Cortex Analyst"""
+    question: str
+    payload_bytes: int  # request body actually sent
+    history_bytes: int  # request body had the full history been sent
+    messages_sent: int
+    compacted_turns: int
+    dropped_turns: int
+    latency_ms: float
+    first_output_ms: Optional[float] = None  # first text on screen (streaming)
+
+
+def payload_size(body: Dict) -> int:
+    """Size in bytes of the JSON request body"""
+    return len(json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+
+def _split_turns(messages: List[Dict]) -> List[List[Dict]]:
+    """[user, analyst] pairs; the last turn is the pending question alone"""
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def _compact_message(message: Dict) -> Dict:
+    """Keep the question of a user message, the final SQL of an analyst one"""
+    content = message["content"]
+    if message["role"] == "user":
+        kept = [item for item in content if item["type"] == "text"]
+    else:
+        sql = [item for item in content if item["type"] == "sql"]
+        if sql:
+            kept = [{"type": "sql", "statement": sql[-1]["statement"]}]
+        else:
+            text = " ".join(item["text"] for item in content if item["type"] == "text")
+            kept = [{"type": "text", "text": text[:SUMMARY_MAX_CHARS]}]
+    return {"role": message["role"], "content": kept}
+
+
+def _compact(turn: List[Dict]) -> List[Dict]:
+    return [_compact_message(message) for message in turn]
+
+
+def _strip(message: Dict) -> Dict:
+    """Only the fields the API expects (no request_id, ...)"""
+    return {"role": message["role"], "content": message["content"]}
+
+
+class ConversationContext:
+    """
+    Token budget for the Cortex Analyst request.
+
+    Args:
+        recent_turns (int): Previous exchanges sent verbatim.
+        max_bytes (int): Target size of the request body; the pending question
+            is always sent, even alone above the budget.
+    """
+
+    def __init__(self, recent_turns: int = DEFAULT_RECENT_TURNS, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.recent_turns = recent_turns
+        self.max_bytes = max_bytes
+
+    def build(self, messages: List[Dict], extra: Dict = None):
+        """
+        Request body for `messages`, whose last item is the pending question.
+
+        Args:
+            messages (List[Dict]): The full conversation history.
+            extra (Dict): Other fields of the request body (semantic view, ...).
+
+        Returns:
+            Tuple[Dict, Dict]: The request body and its size statistics.
+        """
+        extra = extra or {}
+        turns = [[_strip(m) for m in turn] for turn in _split_turns(messages)]
+        history_bytes = payload_size({"messages": [m for turn in turns for m in turn], **extra})
+
+        previous, pending = turns[:-1], turns[-1:]
+        n_verbatim = min(self.recent_turns, len(previous))
+        split = len(previous) - n_verbatim
+        compacted = [_compact(turn) for turn in previous[:split]]
+        verbatim = previous[split:]
+
+        def body():
+            selected = compacted + verbatim + pending
+            return {"messages": [m for turn in selected for m in turn], **extra}
+
+        dropped = 0
+        # Over budget: drop the oldest compacted turns, then compact the older verbatim ones
+        while payload_size(body()) > self.max_bytes and (compacted or verbatim):
+            if compacted:
+                compacted.pop(0)
+                dropped += 1
+            else:
+                compacted.append(_compact(verbatim.pop(0)))
+
+        request_body = body()
+        stats = {
+            "payload_bytes": payload_size(request_body),
+            "history_bytes": history_bytes,
+            "messages_sent": len(request_body["messages"]),
+            "compacted_turns": len(compacted),
+            "dropped_turns": dropped,
+        }
+        return request_body, stats
@@ -0,0 +1,216 @@
+"""
+Cache partitionné par jour
+==========================
+Keeps per-day partial aggregates (the rows of the rollup cube for one day)
+instead of whole results keyed by SQL text. Asking for a range only fetches
+the days that are missing or stale, so sliding or widening the date range
+costs one day of warehouse work instead of the whole period.
+
+Objects built from a range (the rollup cube of the dashboard) are memoized
+too, and rebuilt only once one of the days of their range was reloaded.
+
+The warehouse is queried outside the cache lock: sessions reading other days
+are not held up by a miss, and a session needing days already being fetched
+waits for that fetch instead of sending its own.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+import pandas as pd
+
+DEFAULT_TTL = 300  # in seconds, for recent days still being loaded
+DEFAULT_MAX_AGE = 3600  # in seconds, for older days
+DEFAULT_HOT_DAYS = 2
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_DERIVED = 8  # ranges whose built object is kept
+
+
+class _Partition:
+    __slots__ = ("frame", "loaded_at", "last_used", "nbytes")
+
+    def __init__(self, frame: pd.DataFrame, now: float):
+        self.frame = frame
+        self.loaded_at = now
+        self.last_used = now
+        self.nbytes = int(frame.memory_usage(deep=True).sum())
+
+
+def _contiguous_runs(days: List[date]) -> List[Tuple[date, date]]:
+    """[d1, d2, d3, d7] -> [(d1, d3), (d7, d7)]"""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+class DayPartitionCache:
+    """
+    Per-day partitions of an additive aggregate.
+
+    `fetch(start_date, end_date)` must return the rows for every day of the
+    inclusive range, with a SALE_DATE column. Partitions expire by age (short
+    TTL for the last `hot_days` days, `max_age` for history) and the least
+    recently used ones are evicted above `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[date, date], pd.DataFrame],
+        ttl: int = DEFAULT_TTL,
+        max_age: int = DEFAULT_MAX_AGE,
+        hot_days: int = DEFAULT_HOT_DAYS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_derived: int = DEFAULT_MAX_DERIVED,
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_age = max_age
+        self.hot_days = hot_days
+        self.max_bytes = max_bytes
+        self.max_derived = max_derived
+        self._partitions: Dict[date, _Partition] = {}
+        # (start, end, build) -> (newest load time of the range, object)
+        self._derived: "OrderedDict[tuple, Tuple[float, Any]]" = OrderedDict()
+        # day -> fetch of its run in progress, resolved once its partitions are installed
+        self._inflight: Dict[date, Future] = {}
+        self._lock = threading.Lock()
+        self.days_fetched = 0
+        self.days_served = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(p.nbytes for p in self._partitions.values())
+
+    def _is_fresh(self, day: date, partition: _Partition, now: float) -> bool:
+        hot = day >= date.today() - timedelta(days=self.hot_days)
+        return now - partition.loaded_at <= (self.ttl if hot else self.max_age)
+
+    def _load(self, start_date: date, end_date: date, now: float) -> Dict[date, _Partition]:
+        """Partitions of every day of the range, from one fetch; called without the lock"""
+        df = self.fetch(start_date, end_date)
+        sale_days = pd.to_datetime(df["SALE_DATE"]).dt.date
+        by_day = {day: frame for day, frame in df.groupby(sale_days, sort=False)}
+        partitions = {}
+        day = start_date
+        while day <= end_date:
+            # Days without sales are cached too, so they are not fetched again
+            frame = by_day.get(day, df.iloc[0:0]).reset_index(drop=True)
+            partitions[day] = _Partition(frame, now)
+            day += timedelta(days=1)
+        return partitions
+
+    def _fetch_runs(self, runs: List[Tuple[date, date, Future]], now: float):
+        """Fetch the runs claimed by this caller, install them and resolve their futures"""
+        for i, (run_start, run_end, future) in enumerate(runs):
+            try:
+                partitions = self._load(run_start, run_end, now)
+            except BaseException as e:
+                # Waiters of this run and of the ones not fetched yet get the error
+                with self._lock:
+                    for _, _, pending in runs[i:]:
+                        self._release(pending)
+                for _, _, pending in runs[i:]:
+                    pending.set_exception(e)
+                raise
+            with self._lock:
+                self._partitions.update(partitions)
+                self.days_fetched += len(partitions)
+                self._release(future)
+            future.set_result(None)
+
+    def _release(self, future: Future):
+        for day in [day for day, f in self._inflight.items() if f is future]:
+            del self._inflight[day]
+
+    def _evict(self):
+        total = self.nbytes
+        if total <= self.max_bytes:
+            return
+        for day, partition in sorted(self._partitions.items(), key=lambda kv: kv[1].last_used):
+            del self._partitions[day]
+            total -= partition.nbytes
+            if total <= self.max_bytes:
+                break
+
+    def _frames(self, start_date: date, end_date: date) -> Tuple[List[pd.DataFrame], float]:
+        """Partitions of the range, loading the missing or stale ones, and their newest load time"""
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        while True:
+            now = time.time()
+            with self._lock:
+                missing = [
+                    day for day in days
+                    if day not in self._partitions or not self._is_fresh(day, self._partitions[day], now)
+                ]
+                waits = {self._inflight[day] for day in missing if day in self._inflight}
+                runs = []
+                for run_start, run_end in _contiguous_runs([d for d in missing if d not in self._inflight]):
+                    future = Future()
+                    for i in range((run_end - run_start).days + 1):
+                        self._inflight[run_start + timedelta(days=i)] = future
+                    runs.append((run_start, run_end, future))
+
+            self._fetch_runs(runs, now)
+            for future in waits:
+                future.result()
+
+            with self._lock:
+                # A day evicted by another session in between is fetched again
+                if any(day not in self._partitions for day in days):
+                    continue
+                frames, loaded_at = [], 0.0
+                for day in days:
+                    partition = self._partitions[day]
+                    partition.last_used = now
+                    frames.append(partition.frame)
+                    loaded_at = max(loaded_at, partition.loaded_at)
+                self.days_served += len(days)
+                self._evict()
+                return frames, loaded_at
+
+    @staticmethod
+    def _concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+        non_empty = [f for f in frames if not f.empty]
+        if not non_empty:
+            return frames[0] if frames else pd.DataFrame(columns=["SALE_DATE"])
+        return pd.concat(non_empty, ignore_index=True)
+
+    def get(self, start_date: date, end_date: date) -> pd.DataFrame:
+        """Rows for [start_date, end_date], fetching only missing or stale days"""
+        return self._concat(self._frames(start_date, end_date)[0])
+
+    def derive(self, start_date: date, end_date: date, build: Callable[[pd.DataFrame], Any]) -> Any:
+        """
+        `build(rows of [start_date, end_date])`, memoized until one of its days is reloaded.
+
+        A rerun over the same range returns the same object without
+        concatenating or building anything. `build` must not mutate its input.
+        """
+        key = (start_date, end_date, build)
+        # A reloaded day always has a later load time than the built object
+        frames, loaded_at = self._frames(start_date, end_date)
+        with self._lock:
+            cached = self._derived.get(key)
+            if cached is not None and cached[0] == loaded_at:
+                self._derived.move_to_end(key)
+                return cached[1]
+        # Built outside the lock, other sessions keep reading their ranges
+        built = build(self._concat(frames))
+        with self._lock:
+            self._derived[key] = (loaded_at, built)
+            self._derived.move_to_end(key)
+            while len(self._derived) > self.max_derived:
+                self._derived.popitem(last=False)
+        return built
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+            self._derived.clear()
@@ -0,0 +1,357 @@
+"""
+Emails personnalisés
+====================
+Generates the personalised promotion emails of SUMMIT_SPORTS.ipynb
+(AI_COMPLETE('mistral-large', ...) on the purchased products) for a whole
+segment instead of `limit 3`.
+
+* Customers are grouped by a hash of their canonical basket (sorted distinct
+  product names): the prompt only depends on the basket, the customer's name
+  is a placeholder filled in afterwards, so one completion serves every
+  customer with the same basket;
+* completions are cached in EMAIL_COMPLETIONS by a hash of model + prompt and
+  written there as soon as a batch returns: the cache is the checkpoint, an
+  interrupted run resumes with the prompts still missing;
+* batches of prompts run with bounded concurrency (one AI_COMPLETE query per
+  batch, on the AI warehouse of the router, see ai_pipeline.run_batches);
+* CUSTOMER_EMAILS keeps the prompt hash of every email, so a run only
+  regenerates for customers whose basket, model or prompt template changed;
+* the pipeline's own reads and writes hold the router's warehouse while the
+  completion threads route AI_COMPLETE, so the cache never lands on the AI
+  warehouse.
+
+The completion function is pluggable: snowflake_completion() on Snowflake,
+local_completion() (a deterministic stand-in, no model) on the local backend
+and in the self-check.
+
+Usage:
+    python email_campaign.py --min-avg-basket 1000 --concurrency 4
+    python email_campaign.py --self-check
+"""
+import argparse
+import hashlib
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ai_pipeline import basket_hash, insert_rows, lookup_rows, parse_products, replace_rows, run_batches, run_sql
+from warehouse_router import AI_FUNCTION, router_for
+
+MODEL = "mistral-large"
+SEGMENT_MIN_AVG_BASKET = 1000
+
+COMPLETIONS_TABLE = "SS_101.HARMONIZED.EMAIL_COMPLETIONS"
+EMAILS_TABLE = "SS_101.HARMONIZED.CUSTOMER_EMAILS"
+
+CLIENT = "[CLIENT]"
+PROMPT_TEMPLATE = (
+    "Vous etes un assistant marketing qui travaille pour un magasin de sport. En français, écrivez un email "
+    "personalisé au client <clientname>" + CLIENT + "</clientname> qui donne une promo personalisé de max 10% "
+    "sur une categorie qui leur interesse basé sur le liste de produits achetés :  "
+    "<producthistory>{products}</producthistory>. Écrivez " + CLIENT + " tel quel à chaque fois que le nom "
+    "du client apparaît."
+)
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_CONCURRENCY = 4
+
+Completion = Callable[[List[str]], List[str]]
+
+
+def product_set(products) -> Tuple[str, ...]:
+    """Sorted distinct product names, as written in the prompt"""
+    return tuple(sorted({p.strip() for p in parse_products(products) if p.strip()}))
+
+
+def basket_prompt(basket: Sequence[str]) -> str:
+    return PROMPT_TEMPLATE.format(products=", ".join(basket))
+
+
+def prompt_hash(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def personalise(completion: str, first_name, last_name) -> str:
+    name = " ".join(str(n) for n in (first_name, last_name) if isinstance(n, str) and n)
+    return completion.replace(CLIENT, name or "client")
+
+
+def snowflake_completion(session, model: str = MODEL) -> Completion:
+    """AI_COMPLETE over a batch of prompts in one query"""
+
+    def complete(prompts: List[str]) -> List[str]:
+        rows = ", ".join("(?, ?)" for _ in prompts)
+        params = [model] + [value for i, prompt in enumerate(prompts) for value in (i, prompt)]
+        df = router_for(session).to_pandas(
+            f"SELECT column1 AS I, AI_COMPLETE(?, column2) AS COMPLETION FROM VALUES {rows} ORDER BY I",
+            query_class=AI_FUNCTION, params=params,
+        )
+        return list(df["COMPLETION"])
+
+    return complete
+
+
+_PRODUCT_HISTORY = re.compile(r"<producthistory>(.*?)</producthistory>", re.DOTALL)
+
+
+def local_completion(prompts: List[str]) -> List[str]:
+    """Stand-in for AI_COMPLETE: a fixed email on the most bought product family"""
+    emails = []
+    for prompt in prompts:
+        match = _PRODUCT_HISTORY.search(prompt)
+        products = [p.strip() for p in match.group(1).split(",") if p.strip()] if match else []
+        # 'Wedze Ski Jackets 1374' -> 'Ski Jackets'
+        families = pd.Series([" ".join(p.split()[1:-1]) or p for p in products], dtype=object)
+        family = families.value_counts().index[0] if len(families) else "nos produits"
+        emails.append(
+            f"Bonjour {CLIENT},\n\nMerci pour votre fidélité. Profitez de 10 % sur la catégorie {family} "
+            f"dans votre magasin SUMMITSPORT ce mois-ci.\n\nL'équipe Summit Sports"
+        )
+    return emails
+
+
+@dataclass
+class RunStats:
+    customers: int = 0
+    unchanged: int = 0  # email already generated for the current basket
+    baskets: int = 0  # distinct baskets to (re)write
+    cached_prompts: int = 0
+    generated_prompts: int = 0
+    failed_batches: int = 0
+    written: int = 0
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+
+def install(session):
+    """Create the completion cache and the emails table when missing"""
+    run_sql(session, f"""
+        CREATE TABLE IF NOT EXISTS {COMPLETIONS_TABLE} (
+            PROMPT_HASH VARCHAR, MODEL VARCHAR, BASKET_HASH VARCHAR, COMPLETION VARCHAR, CREATED_AT TIMESTAMP
+        )
+    """)
+    run_sql(session, f"""
+        CREATE TABLE IF NOT EXISTS {EMAILS_TABLE} (
+            CUSTOMER_ID VARCHAR, BASKET_HASH VARCHAR, PROMPT_HASH VARCHAR, PRODUCT_PROFILE VARCHAR,
+            GENERATED_AT TIMESTAMP
+        )
+    """)
+
+
+class EmailPipeline:
+    """
+    Deduplicated, cached and resumable email generation for a segment.
+
+    Args:
+        session: Snowpark (or local) session holding the two tables.
+        complete (Completion): Prompts -> completions, same order.
+        model (str): Model name, part of the cache key.
+        batch_size (int): Prompts per completion call.
+        concurrency (int): Completion calls in flight at most.
+    """
+
+    def __init__(self, session, complete: Completion, model: str = MODEL,
+                 batch_size: int = DEFAULT_BATCH_SIZE, concurrency: int = DEFAULT_CONCURRENCY):
+        self.session = session
+        self.complete = complete
+        self.model = model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.router = router_for(session)
+
+    def current_prompts(self, customer_ids: Sequence[str]) -> Dict[str, str]:
+        """Prompt hash of the email each customer already has"""
+        rows = lookup_rows(self.router,
+                           f"SELECT CUSTOMER_ID, PROMPT_HASH FROM {EMAILS_TABLE} WHERE CUSTOMER_ID IN ({{keys}})",
+                           customer_ids)
+        return {row[0]: row[1] for row in rows}
+
+    def cached_completions(self, hashes: Sequence[str]) -> Dict[str, str]:
+        rows = lookup_rows(
+            self.router,
+            f"SELECT PROMPT_HASH, COMPLETION FROM {COMPLETIONS_TABLE} WHERE MODEL = ? AND PROMPT_HASH IN ({{keys}})",
+            hashes, [self.model],
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def _generate(self, prompts: Dict[str, Tuple[str, str]], stats: RunStats) -> Dict[str, str]:
+        """Complete {prompt hash: (basket hash, prompt)} in batches, saving each batch as it returns"""
+        done = {}
+
+        def save(session, batch, completions):
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            rows = [(key, self.model, basket, completion, now)
+                    for (key, (basket, _)), completion in zip(batch, completions)]
+            insert_rows(session, COMPLETIONS_TABLE,
+                        ["PROMPT_HASH", "MODEL", "BASKET_HASH", "COMPLETION", "CREATED_AT"], rows)
+            done.update((key, completion) for key, _, _, completion, _ in rows)
+            stats.generated_prompts += len(rows)
+
+        # Failed batches are left out of the cache: the next run retries them
+        errors = run_batches(
+            self.router, lambda batch: self.complete([prompt for _, (_, prompt) in batch]), list(prompts.items()),
+            save, self.batch_size, self.concurrency, name="ai-complete",
+        )
+        stats.failed_batches += len(errors)
+        stats.errors.extend(errors)
+        return done
+
+    def _write_emails(self, customers: pd.DataFrame, completions: Dict[str, str]) -> int:
+        ready = customers[customers["PROMPT_HASH"].isin(completions.keys())]
+        if ready.empty:
+            return 0
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = [
+            (row.CUSTOMER_ID, row.BASKET_HASH, row.PROMPT_HASH,
+             personalise(completions[row.PROMPT_HASH], row.FIRST_NAME, row.LAST_NAME), now)
+            for row in ready.itertuples(index=False)
+        ]
+        return replace_rows(self.router, EMAILS_TABLE,
+                            ["CUSTOMER_ID", "BASKET_HASH", "PROMPT_HASH", "PRODUCT_PROFILE", "GENERATED_AT"], rows)
+
+    def run(self, customers: pd.DataFrame) -> RunStats:
+        """
+        Emails for `customers` (CUSTOMER_ID, FIRST_NAME, LAST_NAME, PURCHASED_PRODUCTS).
+
+        Customers whose prompt failed keep their previous email, if any, and
+        are picked up by the next run.
+        """
+        start = time.perf_counter()
+        stats = RunStats(customers=len(customers))
+        customers = customers[customers["CUSTOMER_ID"].notna()].copy()
+        baskets = [product_set(products) for products in customers["PURCHASED_PRODUCTS"]]
+        customers["BASKET_HASH"] = [basket_hash(basket) for basket in baskets]
+
+        prompts = {}  # prompt hash -> (basket hash, prompt)
+        by_basket = {}
+        for basket, bh in zip(baskets, customers["BASKET_HASH"]):
+            if bh not in by_basket:
+                prompt = basket_prompt(basket)
+                by_basket[bh] = prompt_hash(self.model, prompt)
+                prompts[by_basket[bh]] = (bh, prompt)
+        customers["PROMPT_HASH"] = customers["BASKET_HASH"].map(by_basket)
+
+        # A new basket, model or template all change the prompt hash
+        current = self.current_prompts(list(customers["CUSTOMER_ID"]))
+        stale = np.array([current.get(cid) != ph for cid, ph in zip(customers["CUSTOMER_ID"], customers["PROMPT_HASH"])],
+                         dtype=bool)
+        stats.unchanged = int((~stale).sum())
+        customers = customers[stale]
+        prompts = {key: prompts[key] for key in customers["PROMPT_HASH"].unique()}
+        stats.baskets = len(prompts)
+
+        completions = self.cached_completions(list(prompts))
+        stats.cached_prompts = len(completions)
+        missing = {key: value for key, value in prompts.items() if key not in completions}
+        if missing:
+            completions.update(self._generate(missing, stats))
+
+        stats.written = self._write_emails(customers, completions)
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+
+def segment_customers(session, min_avg_basket_size: float = SEGMENT_MIN_AVG_BASKET) -> pd.DataFrame:
+    """Customers of the notebook segment, from the maintained loyalty metrics"""
+    from loyalty_metrics import segment_metrics
+
+    return segment_metrics(session, min_avg_basket_size=min_avg_basket_size)[
+        ["CUSTOMER_ID", "FIRST_NAME", "LAST_NAME", "PURCHASED_PRODUCTS"]
+    ]
+
+
+def self_check():
+    """Dedup, cache, resume and basket-change behaviour, on DuckDB with the stand-in"""
+    from backend import memory_session
+
+    session = memory_session()
+    install(session)
+
+    basket_a = ["Wedze Ski Jackets 1374", "Wedze Ski Socks 0042"]
+    basket_b = ["Quechua Hiking Shoes 3894"]
+    customers = pd.DataFrame({
+        "CUSTOMER_ID": [f"c{i}" for i in range(6)],
+        "FIRST_NAME": ["Inès", "Hugo", "Louis", "Agathe", "Sylvie", None],
+        "LAST_NAME": ["Durand", "Martin", "Collin", "Marie", "Coulon", None],
+        # Same baskets in another order or with duplicates hash the same
+        "PURCHASED_PRODUCTS": [basket_a, basket_a[::-1], json.dumps(basket_a + basket_a[:1]),
+                               basket_b, np.array(basket_b), None],
+    })
+
+    calls = []
+
+    def flaky(prompts):
+        calls.append(len(prompts))
+        if len(calls) == 2:
+            raise RuntimeError("interrompu")
+        return local_completion(prompts)
+
+    # 3 distinct baskets in batches of 1: the second batch fails
+    stats = EmailPipeline(session, flaky, batch_size=1, concurrency=1).run(customers)
+    assert (stats.baskets, stats.generated_prompts, stats.failed_batches) == (3, 2, 1), stats
+    first_written = stats.written
+
+    # Resume: only the failed basket is completed, the emails of the others are kept
+    stats = EmailPipeline(session, flaky, batch_size=1, concurrency=1).run(customers)
+    assert stats.generated_prompts == 1 and stats.unchanged == first_written, stats
+    assert stats.unchanged + stats.written == len(customers), stats
+
+    # Nothing changed: no completion, nothing written
+    stats = EmailPipeline(session, flaky).run(customers)
+    assert (stats.unchanged, stats.generated_prompts, stats.written) == (len(customers), 0, 0), stats
+
+    # One basket changed: one prompt, one email
+    customers.at[3, "PURCHASED_PRODUCTS"] = basket_b + ["Kipsta Ballons 0001"]
+    stats = EmailPipeline(session, flaky).run(customers)
+    assert (stats.baskets, stats.generated_prompts, stats.written) == (1, 1, 1), stats
+
+    # Another model: every email is regenerated, baskets unchanged
+    stats = EmailPipeline(session, flaky, model="autre").run(customers)
+    assert (stats.unchanged, stats.baskets, stats.generated_prompts, stats.written) == (0, 4, 4, 6), stats
+
+    emails = session.sql(f"SELECT * FROM {EMAILS_TABLE} ORDER BY CUSTOMER_ID").to_pandas()
+    assert len(emails) == len(customers) and emails["CUSTOMER_ID"].is_unique
+    assert emails["PRODUCT_PROFILE"].str.startswith("Bonjour Inès Durand").iloc[0]
+    assert not emails["PRODUCT_PROFILE"].str.contains(CLIENT, regex=False).any()
+    print(f"{len(calls)} appels de complétion pour {len(customers)} clients x 5 exécutions : OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-avg-basket", type=float, default=SEGMENT_MIN_AVG_BASKET)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--local-completion", action="store_true", help="sans modèle, même sur Snowflake")
+    parser.add_argument("--self-check", action="store_true")
+    args = parser.parse_args()
+
+    if args.self_check:
+        self_check()
+        return
+
+    from backend import LOCAL, get_backend
+
+    backend = get_backend()
+    session = backend.session
+    complete = local_completion if args.local_completion or backend.name == LOCAL \
+        else snowflake_completion(session, args.model)
+    install(session)
+    stats = EmailPipeline(session, complete, args.model, args.batch_size, args.concurrency).run(
+        segment_customers(session, args.min_avg_basket)
+    )
+    print(f"{stats.customers:,} clients, {stats.unchanged:,} inchangés, {stats.baskets:,} paniers distincts : "
+          f"{stats.cached_prompts:,} en cache, {stats.generated_prompts:,} générés, "
+          f"{stats.failed_batches} lots en échec ; {stats.written:,} emails écrits en {stats.seconds:.1f} s")
+    for error in stats.errors[:5]:
+        print(f"  erreur : {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Export en flux
+==============
+Streams a query result batch by batch (Arrow record batches from the
+connector cursor) into a CSV or Parquet file written incrementally on disk.
+Only a bounded preview stays in memory; row and byte budgets stop the export
+early instead of exhausting the worker.
+"""
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from result_decoder import decode_table
+from warehouse_router import session_cursor
+
+DEFAULT_MAX_ROWS = 5_000_000
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+DEFAULT_PREVIEW_ROWS = 1_000
+# st.download_button holds the whole file in the server's memory: exports
+# offered for download stay within Streamlit's default message size
+DOWNLOAD_MAX_BYTES = 200 * 1024 * 1024
+
+FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+
+@dataclass
+class ExportResult:
+    """File written by stream_export and what it contains"""
+    path: str
+    format: str
+    rows: int = 0
+    bytes_written: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    truncated: bool = False
+    preview: pd.DataFrame = field(default_factory=pd.DataFrame)
+
+    @property
+    def mime(self) -> str:
+        return FORMATS[self.format][1]
+
+
+class _Writer:
+    """Incremental CSV/Parquet writer opened on the first batch's schema"""
+
+    def __init__(self, path: str, fmt: str):
+        self.path = path
+        self.fmt = fmt
+        self._writer = None
+
+    def write(self, table: pa.Table):
+        if self._writer is None:
+            if self.fmt == "Parquet":
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            else:
+                self._writer = pa_csv.CSVWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    @property
+    def bytes_written(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+
+def stream_export(
+    session,
+    sql: str,
+    fmt: str = "CSV",
+    max_rows: int = DEFAULT_MAX_ROWS,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    preview_rows: int = DEFAULT_PREVIEW_ROWS,
+    progress: Optional[Callable[[int, int], None]] = None,
+    directory: Optional[str] = None,
+    router=None,
+) -> ExportResult:
+    """
+    Run `sql` and write its result to a temporary file, one batch at a time.
+
+    Args:
+        fmt (str): "CSV" or "Parquet".
+        max_rows (int): Row budget, the export stops once it is reached.
+        max_bytes (int): Byte budget on the written file, checked after each batch.
+        preview_rows (int): Rows kept in memory for display.
+        progress (Callable): Called with (rows, bytes written) after each batch.
+        router (WarehouseRouter): Runs the query on its warehouse when given.
+
+    Returns:
+        ExportResult: The file path, its size and a bounded preview.
+    """
+    suffix = FORMATS[fmt][0]
+    fd, path = tempfile.mkstemp(prefix="requete_personnalisee_", suffix=suffix, dir=directory)
+    os.close(fd)
+    result = ExportResult(path=path, format=fmt)
+    writer = _Writer(path, fmt)
+    preview_tables = []
+    preview_count = 0
+    start = time.perf_counter()
+
+    try:
+        # Closing the cursor abandons the rest of the result when the budget stopped the export
+        with session_cursor(session, sql, router) as cursor:
+            for table in cursor.fetch_arrow_batches():
+                if result.rows >= max_rows or result.bytes_written >= max_bytes:
+                    # Another batch is there but the budget is spent
+                    result.truncated = True
+                    break
+
+                remaining = max_rows - result.rows
+                if table.num_rows > remaining:
+                    table = table.slice(0, remaining)
+                    result.truncated = True
+
+                if preview_count < preview_rows:
+                    head = table.slice(0, preview_rows - preview_count)
+                    preview_tables.append(head)
+                    preview_count += head.num_rows
+
+                writer.write(table)
+                result.rows += table.num_rows
+                result.batches += 1
+                result.bytes_written = writer.bytes_written
+                if progress is not None:
+                    progress(result.rows, result.bytes_written)
+
+                if result.truncated:
+                    break
+    except Exception:
+        writer.close()
+        remove_export(path)
+        raise
+    finally:
+        writer.close()
+
+    result.bytes_written = writer.bytes_written
+    result.seconds = time.perf_counter() - start
+    if preview_tables:
+        result.preview = decode_table(pa.concat_tables(preview_tables))
+    return result
+
+
+def remove_export(path: Optional[str]):
+    """Delete a previous export file, if it is still there"""
+    if path and os.path.exists(path):
+        os.remove(path)
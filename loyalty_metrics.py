@@ -0,0 +1,264 @@
+"""
+Métriques de fidélité
+=====================
+Per-customer loyalty metrics (total spend, purchases, average basket, last
+purchase, purchased products) kept as running totals instead of the
+full-recompute view of SUMMIT_SPORTS.ipynb.
+
+* CUSTOMER_LOYALTY_TOTALS holds one row per customer with orders: spend,
+  number of orders, last sale date and the sorted set of product names;
+* refresh() folds only the order_detail rows of the days after the
+  watermark: spends and order counts are added, product sets merged
+  (ARRAY_DISTINCT of both sets), in the same transaction as the watermark;
+* CUSTOMER_LOYALTY_METRICS_V keeps its columns and becomes a key join of
+  the customers on the totals, so reading a segment is a lookup whatever
+  the length of the order history.
+
+Only closed days (before today) are folded and all lines of an order share
+its SALE_DATE, so an order is never split across two runs and the distinct
+order counts of the runs add up. Rows inserted with a SALE_DATE already
+behind the watermark are not seen: rebuild() recomputes everything.
+
+Usage:
+    python loyalty_metrics.py                 # install if needed, then fold the new days
+    python loyalty_metrics.py --rebuild --warehouse SS_DE_WH
+"""
+import argparse
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Sequence
+
+import pandas as pd
+
+from warehouse_router import router_for
+
+ORDERS_TABLE = "SS_101.RAW_POS.ORDER_DETAIL"
+PRODUCTS_TABLE = "SS_101.RAW_POS.REFERENTIELS_PRODUIT"
+CUSTOMERS_TABLE = "SS_101.RAW_CUSTOMER.CUSTOMER_LOYALTY"
+TOTALS_TABLE = "SS_101.HARMONIZED.CUSTOMER_LOYALTY_TOTALS"
+WATERMARK_TABLE = "SS_101.HARMONIZED.CUSTOMER_LOYALTY_WATERMARK"
+METRICS_VIEW = "SS_101.HARMONIZED.CUSTOMER_LOYALTY_METRICS_V"
+ANALYTICS_VIEW = "SS_101.ANALYTICS.CUSTOMER_LOYALTY_METRICS_V"
+
+METRICS_COLUMNS = ["AVG_BASKET_SIZE", "TOTAL_SPEND", "TOTAL_PURCHASES", "LAST_PURCHASE_DATE", "PURCHASED_PRODUCTS"]
+
+REBUILD, INCREMENTAL = "rebuild", "incremental"
+
+
+def delta_query(where: str) -> str:
+    """Totals of the order_detail rows matching `where`, per customer"""
+    # ARRAY_DISTINCT also drops the NULL names of unknown products on DuckDB
+    return f"""
+        SELECT
+            od.CUSTOMER_ID,
+            SUM(od.SALES_PRICE_EURO - od.DISCOUNT_AMOUNT_EURO) AS TOTAL_SPEND,
+            COUNT(DISTINCT od.ORDER_ID) AS TOTAL_PURCHASES,
+            MAX(od.SALE_DATE) AS LAST_PURCHASE_DATE,
+            ARRAY_SORT(ARRAY_DISTINCT(ARRAY_AGG(DISTINCT rp.PRODUCT_NAME))) AS PURCHASED_PRODUCTS
+        FROM {ORDERS_TABLE} od
+        LEFT JOIN {PRODUCTS_TABLE} rp ON od.PRODUCT_ID = rp.PRODUCTID
+        WHERE od.CUSTOMER_ID IS NOT NULL AND {where}
+        GROUP BY od.CUSTOMER_ID
+    """
+
+
+MERGE_DELTA = f"""
+    MERGE INTO {TOTALS_TABLE} t
+    USING ({delta_query("od.SALE_DATE > ? AND od.SALE_DATE <= ?")}) d
+    ON t.CUSTOMER_ID = d.CUSTOMER_ID
+    WHEN MATCHED THEN UPDATE SET
+        TOTAL_SPEND = t.TOTAL_SPEND + d.TOTAL_SPEND,
+        TOTAL_PURCHASES = t.TOTAL_PURCHASES + d.TOTAL_PURCHASES,
+        LAST_PURCHASE_DATE = GREATEST(t.LAST_PURCHASE_DATE, d.LAST_PURCHASE_DATE),
+        PURCHASED_PRODUCTS = ARRAY_SORT(ARRAY_DISTINCT(ARRAY_CAT(t.PURCHASED_PRODUCTS, d.PURCHASED_PRODUCTS)))
+    WHEN NOT MATCHED THEN INSERT (CUSTOMER_ID, TOTAL_SPEND, TOTAL_PURCHASES, LAST_PURCHASE_DATE, PURCHASED_PRODUCTS)
+        VALUES (d.CUSTOMER_ID, d.TOTAL_SPEND, d.TOTAL_PURCHASES, d.LAST_PURCHASE_DATE, d.PURCHASED_PRODUCTS)
+"""
+
+# Same columns as the view of the notebook; PURCHASED_PRODUCTS is NULL for
+# customers without any order
+METRICS_VIEW_SELECT = f"""
+    SELECT
+        c.CUSTOMER_ID, c.FIRST_NAME, c.LAST_NAME, c.EMAIL, c.PHONE, c.REGISTRATION_DATE,
+        c.PREFERRED_STORE, c.MARKETING_OPT_IN,
+        ROUND(COALESCE(t.TOTAL_SPEND / NULLIF(t.TOTAL_PURCHASES, 0), 0), 2) AS AVG_BASKET_SIZE,
+        COALESCE(t.TOTAL_SPEND, 0) AS TOTAL_SPEND,
+        COALESCE(t.TOTAL_PURCHASES, 0) AS TOTAL_PURCHASES,
+        t.LAST_PURCHASE_DATE,
+        t.PURCHASED_PRODUCTS
+    FROM {CUSTOMERS_TABLE} c
+    LEFT JOIN {TOTALS_TABLE} t ON c.CUSTOMER_ID = t.CUSTOMER_ID
+"""
+
+
+@dataclass
+class Freshness:
+    """How far the running totals are behind order_detail"""
+    last_sale_date: Optional[date]  # last day folded into the totals
+    refreshed_at: Optional[datetime]
+    mode: Optional[str]
+    source_last_date: Optional[date] = None
+
+    @property
+    def lag_days(self) -> Optional[int]:
+        if pd.isna(self.source_last_date):
+            return 0
+        if pd.isna(self.last_sale_date):
+            return None
+        return max((pd.Timestamp(self.source_last_date) - pd.Timestamp(self.last_sale_date)).days, 0)
+
+
+def _run(session, sql: str, params: Optional[Sequence] = None):
+    # Never on a warehouse switched by a routed query of another thread
+    with router_for(session).pinned() as pinned:
+        return pinned.sql(sql, params=params).collect()
+
+
+def install(session):
+    """Create the totals and watermark tables when missing and point the views at them"""
+    _run(session, f"CREATE TABLE IF NOT EXISTS {TOTALS_TABLE} AS {delta_query('1 = 0')}")
+    _run(session, f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} AS
+        SELECT CAST(NULL AS DATE) AS LAST_SALE_DATE, CAST(NULL AS TIMESTAMP) AS REFRESHED_AT,
+               CAST(NULL AS VARCHAR) AS MODE
+        WHERE 1 = 0
+    """)
+    _run(session, f"CREATE OR REPLACE VIEW {METRICS_VIEW} AS {METRICS_VIEW_SELECT}")
+    _run(session, f"CREATE OR REPLACE VIEW {ANALYTICS_VIEW} AS SELECT * FROM {METRICS_VIEW}")
+
+
+def freshness(session, with_source: bool = True) -> Freshness:
+    """Watermark of the totals; with_source also reads MAX(SALE_DATE) of order_detail"""
+    rows = _run(session, f"SELECT LAST_SALE_DATE, REFRESHED_AT, MODE FROM {WATERMARK_TABLE}")
+    state = Freshness(*rows[0]) if rows else Freshness(None, None, None)
+    if with_source:
+        state.source_last_date = _run(session, f"SELECT MAX(SALE_DATE) FROM {ORDERS_TABLE}")[0][0]
+    return state
+
+
+def _last_closed_day(session, after: Optional[date], today: Optional[date]) -> Optional[date]:
+    """Latest SALE_DATE after `after`, capped at the day before `today`"""
+    if after is None:
+        newest = _run(session, f"SELECT MAX(SALE_DATE) FROM {ORDERS_TABLE}")[0][0]
+    else:
+        newest = _run(session, f"SELECT MAX(SALE_DATE) FROM {ORDERS_TABLE} WHERE SALE_DATE > ?", [after])[0][0]
+    if pd.isna(newest):
+        return None
+    newest = pd.Timestamp(newest).date()
+    return min(newest, (today or date.today()) - timedelta(days=1))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def rebuild(session, today: Optional[date] = None) -> Freshness:
+    """
+    Recompute the totals from the whole history of closed days.
+
+    CREATE OR REPLACE TABLE commits on its own, so the watermark is dropped
+    first: a rebuild interrupted after it leaves no watermark and the next
+    refresh() rebuilds again instead of folding days already counted. The
+    session stays pinned to its warehouse for the whole sequence.
+    """
+    with router_for(session).pinned():
+        through = _last_closed_day(session, None, today)
+        if through is None:
+            return freshness(session)
+        _run(session, f"DELETE FROM {WATERMARK_TABLE}")
+        _run(session, f"CREATE OR REPLACE TABLE {TOTALS_TABLE} AS {delta_query('od.SALE_DATE <= ?')}", [through])
+        _run(session, f"INSERT INTO {WATERMARK_TABLE} (LAST_SALE_DATE, REFRESHED_AT, MODE) VALUES (?, ?, ?)",
+             [through, _now(), REBUILD])
+        return freshness(session)
+
+
+def refresh(session, today: Optional[date] = None) -> Freshness:
+    """
+    Fold the closed days after the watermark into the totals.
+
+    Rebuilds when the totals were never computed. The MERGE and the new
+    watermark commit together: an interrupted run leaves the totals as they
+    were and the next one folds the same days. The watermark only moves from
+    the value read here, so of two concurrent runs the second one finds it
+    already moved and rolls back instead of folding the same days twice.
+    The session stays pinned to its warehouse from BEGIN to COMMIT.
+    """
+    with router_for(session).pinned():
+        state = freshness(session, with_source=False)
+        if pd.isna(state.last_sale_date):
+            return rebuild(session, today)
+        after = pd.Timestamp(state.last_sale_date).date()
+        through = _last_closed_day(session, after, today)
+        if through is None or through <= after:
+            return freshness(session)
+        _run(session, "BEGIN")
+        try:
+            # Claimed before the MERGE: the row lock holds off the other runs
+            moved = _run(
+                session,
+                f"UPDATE {WATERMARK_TABLE} SET LAST_SALE_DATE = ?, REFRESHED_AT = ?, MODE = ? WHERE LAST_SALE_DATE = ?",
+                [through, _now(), INCREMENTAL, after],
+            )[0][0]
+            if not moved:
+                _run(session, "ROLLBACK")
+                return freshness(session)
+            _run(session, MERGE_DELTA, [after, through])
+        except Exception:
+            _run(session, "ROLLBACK")
+            raise
+        _run(session, "COMMIT")
+        return freshness(session)
+
+
+def segment_metrics(
+    session,
+    customer_ids: Optional[Sequence[str]] = None,
+    min_avg_basket_size: Optional[float] = None,
+    limit: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Loyalty metrics of a segment, read from the maintained totals.
+
+    Args:
+        customer_ids (Sequence[str]): Customers to read, all when None.
+        min_avg_basket_size (float): Keep customers whose average basket is above it.
+        limit (int): At most this many customers.
+    """
+    conditions, params = [], []
+    if customer_ids is not None:
+        if not customer_ids:
+            return pd.DataFrame(columns=["CUSTOMER_ID"] + METRICS_COLUMNS)
+        conditions.append(f"CUSTOMER_ID IN ({', '.join('?' for _ in customer_ids)})")
+        params.extend(customer_ids)
+    if min_avg_basket_size is not None:
+        conditions.append("AVG_BASKET_SIZE > ?")
+        params.append(min_avg_basket_size)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    limit_clause = f"LIMIT {int(limit)}" if limit else ""
+    return router_for(session).to_pandas(
+        f"SELECT * FROM {METRICS_VIEW} {where} ORDER BY CUSTOMER_ID {limit_clause}", params=params
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="recalcule tout l'historique")
+    parser.add_argument("--warehouse", help="entrepôt du job, celui de la session sinon")
+    args = parser.parse_args()
+
+    from backend import get_backend
+
+    session = get_backend().session
+    if args.warehouse:
+        session.use_warehouse(args.warehouse)
+    install(session)
+    state = rebuild(session) if args.rebuild else refresh(session)
+    if pd.isna(state.last_sale_date):
+        print("Aucune commande à agréger")
+        return
+    print(f"Totaux à jour au {pd.Timestamp(state.last_sale_date):%Y-%m-%d} ({state.mode}, {state.refreshed_at:%Y-%m-%d %H:%M} UTC), "
+          f"retard sur order_detail : {state.lag_days} jour(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Comparaison de périodes
+=======================
+Typed result of the KPI tab of ss_sales.py: KPIs of the current and
+previous periods and the daily series of the current one, read by the metric
+cards and both charts, plus the previous-period window itself.
+
+The three figures used to come from one GROUPING SETS scan of orders_v. The
+rollup cube (rollup_cube.py) now covers that scan: the tab loads the cube once
+over both periods and RollupCube.period_comparison fills this result from it,
+with no query of its own.
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+import pandas as pd
+
+DAILY_COLUMNS = ["SALE_DATE", "NB_ORDERS", "REVENUE", "AVG_ORDER_VALUE"]
+
+
+@dataclass
+class PeriodKpis:
+    """Aggregates of one period"""
+    total_orders: int = 0
+    total_revenue: float = 0.0
+    avg_order_value: float = 0.0
+    total_quantity: float = 0.0
+    unique_customers: int = 0
+
+
+@dataclass
+class PeriodComparison:
+    """Current vs previous period, plus the daily series of the current period"""
+    current: PeriodKpis
+    previous: Optional[PeriodKpis]
+    daily: pd.DataFrame
+
+    @property
+    def is_empty(self) -> bool:
+        return self.daily.empty and self.previous is None
+
+
+def previous_period(start_date, end_date):
+    """Window of the same length right before [start_date, end_date]"""
+    days_diff = (end_date - start_date).days
+    return start_date - timedelta(days=days_diff), start_date - timedelta(days=1)
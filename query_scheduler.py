@@ -0,0 +1,135 @@
+"""
+Planificateur de requêtes
+=========================
+Submits every tab's SQL at the top of the script as Snowpark async jobs
+(collect_nowait). Each tab then waits only on its own job, so page latency is
+the slowest query instead of the sum of all of them. Results get the
+schema-driven types of result_decoder (dates as datetime64, decimals as
+int64/float64), like the synchronous fetches.
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from result_decoder import decode_frame
+
+DEFAULT_TTL = 300  # in seconds, same as the run_query cache
+
+
+@st.cache_resource
+def _result_cache() -> Tuple[Dict[str, Tuple[float, pd.DataFrame]], threading.Lock]:
+    """Process-wide results keyed by SQL text, shared by every session"""
+    return {}, threading.Lock()
+
+
+def _cached_result(sql: str, ttl: int) -> Optional[pd.DataFrame]:
+    results, lock = _result_cache()
+    with lock:
+        entry = results.get(sql)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > ttl:
+            del results[sql]
+            return None
+        return entry[1]
+
+
+def _store_result(sql: str, df: pd.DataFrame, ttl: int):
+    results, lock = _result_cache()
+    now = time.time()
+    with lock:
+        for key in [k for k, (ts, _) in results.items() if now - ts > ttl]:
+            del results[key]
+        results[sql] = (now, df)
+
+
+def clear_results():
+    """Drop every cached result (used by the "Actualiser" button)"""
+    results, lock = _result_cache()
+    with lock:
+        results.clear()
+
+
+class QueryScheduler:
+    """
+    Named async queries for one Streamlit session.
+
+    Keep one instance in st.session_state: jobs still running when a rerun
+    starts are reused if their SQL did not change, and cancelled otherwise.
+    """
+
+    def __init__(
+        self,
+        session,
+        ttl: int = DEFAULT_TTL,
+        postprocess: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+        router=None,
+    ):
+        self.session = session
+        self.router = router  # WarehouseRouter, or the session's own warehouse when None
+        self.ttl = ttl
+        self.postprocess = postprocess
+        self._jobs = {}  # name -> (sql, AsyncJob or None once collected)
+        self._cycle = None
+
+    def start_cycle(self, cycle_key):
+        """Cancel everything still in flight when the cycle key (e.g. date range) changes"""
+        if cycle_key != self._cycle:
+            self.cancel_all()
+            self._cycle = cycle_key
+
+    def _start(self, sql: str):
+        if self.router is not None:
+            return self.router.collect_nowait(sql)
+        return self.session.sql(sql).collect_nowait()
+
+    def submit(self, name: str, sql: str):
+        """Start `sql` under `name` unless it is cached or already running"""
+        current = self._jobs.get(name)
+        if current is not None and current[0] == sql:
+            return
+        self.cancel(name)
+        if _cached_result(sql, self.ttl) is not None:
+            self._jobs[name] = (sql, None)
+        else:
+            self._jobs[name] = (sql, self._start(sql))
+
+    def result(self, name: str) -> pd.DataFrame:
+        """Block until the query submitted under `name` is done and return its rows"""
+        sql, job = self._jobs[name]
+        df = _cached_result(sql, self.ttl)
+        if df is None:
+            if job is None:
+                # Expired from the shared cache since submission
+                job = self._start(sql)
+                self._jobs[name] = (sql, job)
+            try:
+                df = job.result("pandas")
+            except Exception:
+                self._jobs.pop(name, None)
+                raise
+            df = decode_frame(df)
+            if self.postprocess is not None:
+                df = self.postprocess(df)
+            _store_result(sql, df, self.ttl)
+            self._jobs[name] = (sql, None)
+        return df.copy()
+
+    def cancel(self, name: str):
+        """Cancel the job submitted under `name` if it is still running"""
+        entry = self._jobs.pop(name, None)
+        if entry is None or entry[1] is None:
+            return
+        try:
+            if not entry[1].is_done():
+                entry[1].cancel()
+        except Exception:
+            # The query may finish or fail between the two calls
+            pass
+
+    def cancel_all(self):
+        for name in list(self._jobs):
+            self.cancel(name)
@@ -0,0 +1,236 @@
+"""
+Traces des requêtes
+===================
+Tags every query with the app, tab and widget that issued it and records
+how long each widget waited for its data.
+
+* set_app() once per script run, then `with widget_span(tab, widget):`
+  around the data loading of each widget;
+* the warehouse router calls record_query() for every query it runs and
+  passes statement_params() so QUERY_TAG carries the same app/tab/widget;
+* a span without any query was served from a cache (st.cache_data, day
+  cache, result store...) and is recorded as a cache hit.
+
+Records go to a JSONL file (QUERY_TRACE_PATH, default in the temp directory)
+and to an in-memory ring shown by performance_panel(). Warehouse execution
+time and bytes scanned are looked up in QUERY_HISTORY_BY_SESSION on demand.
+"""
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+TRACE_PATH = os.environ.get("QUERY_TRACE_PATH", os.path.join(tempfile.gettempdir(), "ss_query_trace.jsonl"))
+MAX_RECORDS = 2_000
+
+# Same shape as the session query_tag of ss0_setup.sql
+QUERY_TAG_BASE = {"origin": "sf_sit-is", "name": "ss_zts", "version": {"major": 1, "minor": 1}}
+
+_app: contextvars.ContextVar = contextvars.ContextVar("trace_app", default=None)
+_span: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+@dataclass
+class QueryRecord:
+    query_id: Optional[str]
+    warehouse: Optional[str]
+    query_class: Optional[str]
+    wall_ms: float
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+    failed: bool = False
+
+
+@dataclass
+class SpanRecord:
+    """Data loading of one widget, or one query issued outside any widget"""
+    ts: float
+    app: Optional[str]
+    tab: Optional[str]
+    widget: Optional[str]
+    wall_ms: float = 0.0
+    queries: List[QueryRecord] = field(default_factory=list)
+    cache_hit: bool = False
+
+    @property
+    def rows(self) -> int:
+        return sum(q.rows or 0 for q in self.queries)
+
+    @property
+    def bytes(self) -> int:
+        return sum(q.bytes or 0 for q in self.queries)
+
+
+_records: Deque[SpanRecord] = deque(maxlen=MAX_RECORDS)
+_warehouse_times: Dict[str, Dict] = {}  # query_id -> {"execution_ms", "bytes_scanned"}
+_lock = threading.Lock()
+
+
+def set_app(app: str):
+    """Name of the app issuing the queries of this script run"""
+    _app.set(app)
+
+
+def current_tag() -> Dict:
+    span = _span.get()
+    return {
+        "app": _app.get(),
+        "tab": span.tab if span else None,
+        "widget": span.widget if span else None,
+    }
+
+
+def statement_params() -> Dict[str, str]:
+    """QUERY_TAG for Snowpark/connector statement params"""
+    return {"QUERY_TAG": json.dumps({**QUERY_TAG_BASE, "attributes": current_tag()})}
+
+
+def _write(record: Dict):
+    try:
+        with open(TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    except OSError:
+        # Tracing must never break a page
+        pass
+
+
+def _store(span: SpanRecord):
+    with _lock:
+        _records.append(span)
+        record = asdict(span)
+        record.update(kind="span", rows=span.rows, bytes=span.bytes)
+        _write(record)
+
+
+@contextmanager
+def widget_span(tab: Optional[str], widget: str, cache_probe: bool = True):
+    """
+    Time the data loading of a widget and collect the queries it runs.
+
+    With cache_probe=False (e.g. a span that also waits on an API), a span
+    without queries is not counted as a cache hit.
+    """
+    span = SpanRecord(ts=time.time(), app=_app.get(), tab=tab, widget=widget)
+    token = _span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        _span.reset(token)
+        span.wall_ms = (time.perf_counter() - start) * 1000
+        span.cache_hit = cache_probe and not span.queries
+        _store(span)
+
+
+def record_query(query_id, warehouse, query_class, seconds, result=None, failed=False):
+    """Attach one query to the current span, or record it alone outside a span"""
+    query = QueryRecord(
+        query_id=query_id,
+        warehouse=warehouse,
+        query_class=query_class,
+        wall_ms=seconds * 1000,
+        failed=failed,
+    )
+    if isinstance(result, pd.DataFrame):
+        query.rows = len(result)
+        query.bytes = int(result.memory_usage(deep=True).sum())
+    elif isinstance(result, list):
+        query.rows = len(result)
+    span = _span.get()
+    if span is not None:
+        span.queries.append(query)
+    else:
+        tag = current_tag()
+        _store(SpanRecord(ts=time.time(), app=tag["app"], tab=None, widget=None,
+                          wall_ms=query.wall_ms, queries=[query]))
+
+
+def resolve_warehouse_times(session, limit: int = 1000) -> int:
+    """Fetch execution time and bytes scanned of the traced queries; returns how many were found"""
+    with _lock:
+        missing = {q.query_id for span in _records for q in span.queries
+                   if q.query_id and q.query_id not in _warehouse_times}
+    if not missing:
+        return 0
+    # warehouse_router imports this module
+    from warehouse_router import router_for
+
+    ids = ", ".join(f"'{query_id}'" for query_id in missing)
+    # Pinned, not routed: the lookup itself is not traced
+    with router_for(session).pinned() as pinned:
+        rows = pinned.sql(f"""
+            SELECT QUERY_ID, EXECUTION_TIME, BYTES_SCANNED
+            FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => {limit}))
+            WHERE QUERY_ID IN ({ids})
+        """).collect()
+    with _lock:
+        for row in rows:
+            times = {"execution_ms": row["EXECUTION_TIME"], "bytes_scanned": row["BYTES_SCANNED"]}
+            _warehouse_times[row["QUERY_ID"]] = times
+            _write({"kind": "warehouse_time", "query_id": row["QUERY_ID"], **times})
+    return len(rows)
+
+
+def spans_frame(app: Optional[str] = None) -> pd.DataFrame:
+    """One row per recorded span, most recent first"""
+    with _lock:
+        spans = [span for span in _records if app is None or span.app == app]
+        rows = [{
+            "HEURE": pd.Timestamp(span.ts, unit="s"),
+            "ONGLET": span.tab,
+            "WIDGET": span.widget or "(hors widget)",
+            "MUR_MS": span.wall_ms,
+            "ENTREPOT_MS": sum(_warehouse_times.get(q.query_id, {}).get("execution_ms") or 0
+                               for q in span.queries) if span.queries else None,
+            "REQUETES": len(span.queries),
+            "LIGNES": span.rows,
+            "OCTETS": span.bytes,
+            "CACHE": span.cache_hit,
+        } for span in reversed(spans)]
+    return pd.DataFrame(rows)
+
+
+def widget_summary(spans: pd.DataFrame) -> pd.DataFrame:
+    """Per-widget p50/p95 wall time, cache hit rate and volumes"""
+    if spans.empty:
+        return spans
+    grouped = spans.groupby(["ONGLET", "WIDGET"], dropna=False)
+    summary = grouped.agg(
+        APPELS=("MUR_MS", "size"),
+        P50_MS=("MUR_MS", "median"),
+        P95_MS=("MUR_MS", lambda s: float(np.percentile(s, 95))),
+        TAUX_CACHE=("CACHE", "mean"),
+        LIGNES=("LIGNES", "sum"),
+        OCTETS=("OCTETS", "sum"),
+    ).reset_index()
+    return summary.sort_values("P95_MS", ascending=False)
+
+
+def performance_panel(session, app: str, container=None):
+    """Collapsible panel with the slowest widgets of `app` and the latest spans"""
+    container = container or st
+    with container.expander("⏱️ Performance", expanded=False):
+        spans = spans_frame(app)
+        if spans.empty:
+            st.caption("Aucune trace pour l'instant")
+            return
+        if st.button("Temps entrepôt", key=f"resolve_trace_{app}",
+                     help="Lit QUERY_HISTORY_BY_SESSION pour les requêtes tracées"):
+            try:
+                resolve_warehouse_times(session)
+            except Exception as e:
+                st.warning(f"Historique des requêtes indisponible : {e}")
+            spans = spans_frame(app)
+        st.dataframe(widget_summary(spans), hide_index=True, use_container_width=True)
+        st.dataframe(spans.head(50), hide_index=True, use_container_width=True)
+        st.caption(f"Traces : {TRACE_PATH}")
@@ -0,0 +1,184 @@
+"""
+Données de référence
+====================
+Stores and product catalogue loaded once per process and shared by every
+session of the three apps. Lookups (STOREID <-> STORE_NAME <-> cleaned name,
+PRODUCTID -> product) are O(1) dictionary hits; the tables are reloaded only
+when their LAST_ALTERED timestamp changes, checked at most once per
+`refresh_seconds` on the point-query warehouse.
+"""
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+import unidecode
+
+from warehouse_router import POINT_KPI, router_for
+
+STORES_TABLE = "ss_101.raw_pos.magasins"
+PRODUCTS_TABLE = "ss_101.raw_pos.referentiels_produit"
+STORES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SS_STORES.csv")
+
+VERSION_QUERY = """
+    SELECT TABLE_NAME, LAST_ALTERED
+    FROM SS_101.INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = 'RAW_POS'
+        AND TABLE_NAME IN ('MAGASINS', 'REFERENTIELS_PRODUIT')
+"""
+
+DEFAULT_REFRESH_SECONDS = 60
+
+# Identifier columns of query results labelled by with_names: (id, name, holder)
+NAMED_IDS = [
+    ("STOREID", "STORE_NAME", "stores"),
+    ("PRODUCT_ID", "PRODUCT_NAME", "products"),
+    ("PRODUCTID", "PRODUCT_NAME", "products"),
+]
+
+
+def clean_store_name(store_name: str) -> str:
+    """'SUMMITSPORT Grenoble Grand'Place' -> 'GrenobleGrandPlace'"""
+    name = unidecode.unidecode(store_name).replace("SUMMITSPORT ", "")
+    return re.sub(r'[^A-Za-z0-9]', '', name)
+
+
+class StoreDirectory:
+    """Stores indexed by STOREID, STORE_NAME and cleaned name"""
+
+    def __init__(self, stores: pd.DataFrame):
+        self.frame = stores.sort_values("STORE_NAME").reset_index(drop=True)
+        self.frame["CLEAN_NAME"] = [clean_store_name(n) for n in self.frame["STORE_NAME"]]
+        self._by_id: Dict[str, int] = {sid: i for i, sid in enumerate(self.frame["STOREID"])}
+        self._by_name: Dict[str, int] = {n: i for i, n in enumerate(self.frame["STORE_NAME"])}
+        self._by_clean: Dict[str, int] = {n: i for i, n in enumerate(self.frame["CLEAN_NAME"])}
+        self.names: List[str] = list(self.frame["STORE_NAME"])
+
+    def __len__(self):
+        return len(self.frame)
+
+    def _row(self, index: Optional[int]) -> Optional[dict]:
+        return None if index is None else self.frame.iloc[index].to_dict()
+
+    def by_id(self, store_id: str) -> Optional[dict]:
+        return self._row(self._by_id.get(store_id))
+
+    def by_name(self, store_name: str) -> Optional[dict]:
+        return self._row(self._by_name.get(store_name))
+
+    def by_clean_name(self, clean_name: str) -> Optional[dict]:
+        return self._row(self._by_clean.get(clean_name))
+
+    def id_of(self, store_name: str) -> Optional[str]:
+        index = self._by_name.get(store_name)
+        return None if index is None else self.frame.at[index, "STOREID"]
+
+    def name_of(self, store_id: str) -> Optional[str]:
+        index = self._by_id.get(store_id)
+        return None if index is None else self.frame.at[index, "STORE_NAME"]
+
+    def clean_name_of(self, store_name: str) -> str:
+        index = self._by_name.get(store_name)
+        return clean_store_name(store_name) if index is None else self.frame.at[index, "CLEAN_NAME"]
+
+
+class ProductCatalogue:
+    """Product catalogue indexed by PRODUCTID"""
+
+    def __init__(self, products: pd.DataFrame):
+        self.frame = products.reset_index(drop=True)
+        self._by_id: Dict[str, int] = {pid: i for i, pid in enumerate(self.frame["PRODUCTID"])}
+        self.names: List[str] = sorted(self.frame["PRODUCT_NAME"].dropna().unique())
+
+    def __len__(self):
+        return len(self.frame)
+
+    def by_id(self, product_id: str) -> Optional[dict]:
+        index = self._by_id.get(product_id)
+        return None if index is None else self.frame.iloc[index].to_dict()
+
+    def name_of(self, product_id: str) -> Optional[str]:
+        index = self._by_id.get(product_id)
+        return None if index is None else self.frame.at[index, "PRODUCT_NAME"]
+
+
+def _load_stores_csv(path: str = STORES_CSV) -> pd.DataFrame:
+    return pd.read_csv(path, dtype=str)
+
+
+class ReferenceData:
+    """Process-wide holder refreshing stores and products on version change"""
+
+    def __init__(self, session, refresh_seconds: int = DEFAULT_REFRESH_SECONDS):
+        self.session = session
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._versions: Dict[str, object] = {}
+        self._loaded_versions: Dict[str, object] = {}
+        self._checked_at = 0.0
+        self._stores: Optional[StoreDirectory] = None
+        self._products: Optional[ProductCatalogue] = None
+        self._stores_csv = _load_stores_csv()
+
+    def _check_versions(self):
+        now = time.time()
+        if now - self._checked_at < self.refresh_seconds:
+            return
+        try:
+            rows = router_for(self.session).collect_nowait(VERSION_QUERY, query_class=POINT_KPI).result()
+            self._versions = {row["TABLE_NAME"]: row["LAST_ALTERED"] for row in rows}
+        except Exception:
+            # Without metadata access, keep what is loaded until the next check
+            pass
+        self._checked_at = now
+
+    def _is_stale(self, table_name: str, loaded) -> bool:
+        return loaded is None or self._versions.get(table_name) != self._loaded_versions.get(table_name)
+
+    @property
+    def stores(self) -> StoreDirectory:
+        with self._lock:
+            self._check_versions()
+            if self._is_stale("MAGASINS", self._stores):
+                stores = router_for(self.session).to_pandas(
+                    f"SELECT STOREID, STORE_NAME, STORE_TYPE, POSTCODE FROM {STORES_TABLE}"
+                )
+                # Adresse et téléphone viennent de SS_STORES.csv
+                stores = stores.merge(
+                    self._stores_csv[["STOREID", "ADDRESS", "PHONE"]], on="STOREID", how="left"
+                )
+                self._stores = StoreDirectory(stores)
+                self._loaded_versions["MAGASINS"] = self._versions.get("MAGASINS")
+            return self._stores
+
+    @property
+    def products(self) -> ProductCatalogue:
+        with self._lock:
+            self._check_versions()
+            if self._is_stale("REFERENTIELS_PRODUIT", self._products):
+                products = router_for(self.session).to_pandas(
+                    f"SELECT PRODUCTID, PRODUCT_NAME, BRAND, PRODUCT_CATEGORY, MRP FROM {PRODUCTS_TABLE}"
+                )
+                self._products = ProductCatalogue(products)
+                self._loaded_versions["REFERENTIELS_PRODUIT"] = self._versions.get("REFERENTIELS_PRODUIT")
+            return self._products
+
+    def with_names(self, df: pd.DataFrame) -> pd.DataFrame:
+        """`df` with STORE_NAME / PRODUCT_NAME inserted after bare STOREID / PRODUCT_ID columns"""
+        for key, name, holder in NAMED_IDS:
+            if key not in df.columns or name in df.columns:
+                continue
+            name_of = getattr(self, holder).name_of
+            names = {value: name_of(value) for value in df[key].dropna().unique()}
+            df = df.copy()
+            df.insert(df.columns.get_loc(key) + 1, name, df[key].map(names))
+        return df
+
+
+@st.cache_resource
+def reference_data(_session) -> ReferenceData:
+    """The ReferenceData shared by every session of this process"""
+    return ReferenceData(_session)
@@ -0,0 +1,89 @@
+"""
+Décodage des résultats
+======================
+Schema-driven decoding of query results. Rows are fetched as Arrow record
+batches through the connector cursor, and every column is converted exactly
+once from the Snowflake result schema: DATE/TIMESTAMP to datetime64, NUMBER
+with scale to float64, NUMBER without scale to int64. No per-column guessing
+and no Python object columns for dates or decimals.
+"""
+import time
+from dataclasses import asdict, dataclass
+from typing import Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+from warehouse_router import session_cursor
+
+
+@dataclass
+class DecodeStats:
+    """Timing and memory figures of one decoded result"""
+    sql: str
+    rows: int = 0
+    batches: int = 0
+    fetch_seconds: float = 0.0
+    decode_seconds: float = 0.0
+    peak_arrow_bytes: int = 0
+    frame_bytes: int = 0
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _target_type(arrow_type: pa.DataType) -> pa.DataType:
+    """Type a column is converted to, decided from the schema alone"""
+    if pa.types.is_decimal(arrow_type):
+        if arrow_type.scale == 0 and arrow_type.precision <= 18:
+            return pa.int64()
+        return pa.float64()
+    if pa.types.is_date(arrow_type):
+        return pa.timestamp("ns")
+    if pa.types.is_timestamp(arrow_type) and arrow_type.unit != "ns":
+        return pa.timestamp("ns", tz=arrow_type.tz)
+    return arrow_type
+
+
+def target_schema(schema: pa.Schema) -> pa.Schema:
+    return pa.schema([pa.field(f.name, _target_type(f.type)) for f in schema])
+
+
+def decode_table(table: pa.Table) -> pd.DataFrame:
+    """Cast once to the target schema and convert to pandas"""
+    schema = target_schema(table.schema)
+    if schema != table.schema:
+        table = table.cast(schema)
+    return table.to_pandas(date_as_object=False, split_blocks=True, self_destruct=True)
+
+
+def decode_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """decode_table for a result already converted to pandas (AsyncJob.result("pandas"))"""
+    return decode_table(pa.Table.from_pandas(df, preserve_index=False))
+
+
+def fetch_dataframe(session, sql: str, router=None) -> Tuple[pd.DataFrame, DecodeStats]:
+    """Run `sql` (on its warehouse when a router is given) and decode its Arrow batches into a DataFrame"""
+    stats = DecodeStats(sql=sql)
+    start = time.perf_counter()
+
+    with session_cursor(session, sql, router) as cursor:
+        tables = []
+        for table in cursor.fetch_arrow_batches():
+            tables.append(table)
+            stats.batches += 1
+            # Batches are held until the decode, whichever allocator the connector uses
+            stats.peak_arrow_bytes += table.nbytes
+        columns = [column.name for column in cursor.description]
+    stats.fetch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if tables:
+        df = decode_table(pa.concat_tables(tables))
+    else:
+        df = pd.DataFrame(columns=columns)
+    stats.decode_seconds = time.perf_counter() - start
+
+    stats.rows = len(df)
+    stats.frame_bytes = int(df.memory_usage(deep=True).sum())
+    return df, stats
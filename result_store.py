@@ -0,0 +1,139 @@
+"""
+Résultats du chatbot
+====================
+Per-session store of the DataFrames returned by the SQL of Cortex Analyst.
+Results live in memory up to `max_bytes` (least recently used first out);
+evicted ones are spilled to zstd-compressed Parquet files up to
+`max_spill_bytes`, beyond which they are dropped and re-executed on demand.
+Memory per chat session stays bounded however long the conversation.
+"""
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_SPILL_BYTES = 256 * 1024 * 1024
+
+# Where a result came from, for the UI
+MEMORY, SPILL, QUERY = "mémoire", "disque", "requête"
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ResultStore:
+    """
+    Size-bounded LRU of query results, keyed by SQL text.
+
+    Errors are kept too (they are small) so a failing query is not re-run on
+    every rerun. Keep one instance per session in st.session_state.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_spill_bytes: int = DEFAULT_MAX_SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self._memory = OrderedDict()  # sql -> (DataFrame | None, error | None, nbytes)
+        self._spilled = OrderedDict()  # sql -> (path, file size)
+        self._memory_bytes = 0
+        self._spill_bytes = 0
+        self._lock = threading.Lock()
+        self._file_ids = itertools.count()
+        self._directory = tempfile.mkdtemp(prefix="chat_results_")
+        # Spill files go away with the session
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._directory, True)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    @property
+    def spill_bytes(self) -> int:
+        return self._spill_bytes
+
+    def __len__(self):
+        return len(self._memory) + len(self._spilled)
+
+    def __contains__(self, sql: str) -> bool:
+        return sql in self._memory or sql in self._spilled
+
+    def _spill(self, sql: str, df: pd.DataFrame):
+        path = os.path.join(self._directory, f"{next(self._file_ids)}.parquet")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, compression="zstd")
+        size = os.path.getsize(path)
+        self._spilled[sql] = (path, size)
+        self._spill_bytes += size
+        while self._spill_bytes > self.max_spill_bytes and self._spilled:
+            self._drop_spilled(next(iter(self._spilled)))
+
+    def _drop_spilled(self, sql: str):
+        path, size = self._spilled.pop(sql)
+        self._spill_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        # The most recent result always stays in memory, even above the budget
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            sql, (df, _, nbytes) = self._memory.popitem(last=False)
+            self._memory_bytes -= nbytes
+            if df is not None:
+                self._spill(sql, df)
+
+    def put(self, sql: str, df: Optional[pd.DataFrame], error: Optional[str] = None):
+        with self._lock:
+            if sql in self._memory:
+                self._memory_bytes -= self._memory.pop(sql)[2]
+            if sql in self._spilled:
+                self._drop_spilled(sql)
+            nbytes = frame_nbytes(df) if df is not None else 0
+            self._memory[sql] = (df, error, nbytes)
+            self._memory_bytes += nbytes
+            self._evict()
+
+    def lookup(self, sql: str) -> Optional[Tuple[Optional[pd.DataFrame], Optional[str], str]]:
+        """(df, error, source) if the result is stored, None otherwise"""
+        with self._lock:
+            if sql in self._memory:
+                self._memory.move_to_end(sql)
+                df, error, _ = self._memory[sql]
+                return df, error, MEMORY
+            if sql not in self._spilled:
+                return None
+            path, _ = self._spilled[sql]
+            try:
+                df = pq.read_table(path).to_pandas()
+            except (OSError, pa.ArrowException):
+                self._drop_spilled(sql)
+                return None
+            # Served from the file, which stays: promoting it would rewrite
+            # another result to disk on every rerun of a long history
+            self._spilled.move_to_end(sql)
+            return df, None, SPILL
+
+    def get(self, sql: str, execute: Callable[[str], Tuple[Optional[pd.DataFrame], Optional[str]]]):
+        """(df, error, source), running `execute(sql)` when the result is not stored"""
+        stored = self.lookup(sql)
+        if stored is not None:
+            return stored
+        df, error = execute(sql)
+        self.put(sql, df, error)
+        return df, error, QUERY
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for sql in list(self._spilled):
+                self._drop_spilled(sql)
@@ -0,0 +1,199 @@
+"""
+Cube journalier
+===============
+In-process rollup of ss_101.analytics.orders_v keyed by (day, store, product).
+Revenue, quantity and order counts are held in NumPy arrays sorted by day, so
+any date range, top-N products or store ranking is a vectorized slice with no
+warehouse round trip. Distinct-customer counts are not additive and still
+come from the warehouse (see distinct_customers_query).
+"""
+from datetime import timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from period_comparison import DAILY_COLUMNS, PeriodComparison, PeriodKpis, previous_period
+
+ORDERS_VIEW = "ss_101.analytics.orders_v"
+
+STORE_COLUMNS = ["STORE_NAME", "STORE_TYPE", "POSTCODE"]
+PRODUCT_COLUMNS = ["PRODUCT_NAME", "BRAND", "PRODUCT_CATEGORY"]
+
+
+def cube_query(start_date, end_date, table=ORDERS_VIEW):
+    """Cube rows for every day of [start_date, end_date]"""
+    next_day = end_date + timedelta(days=1)
+    return f"""
+    SELECT
+        SALE_DATE::DATE as SALE_DATE,
+        STORE_NAME,
+        COALESCE(STORE_TYPE, 'Non spécifié') as STORE_TYPE,
+        COALESCE(POSTCODE, 'N/A') as POSTCODE,
+        PRODUCT_NAME,
+        COALESCE(BRAND, 'Non spécifié') as BRAND,
+        COALESCE(PRODUCT_CATEGORY, 'Non spécifié') as PRODUCT_CATEGORY,
+        COUNT(*) as NB_ORDERS,
+        COUNT(SALES_PRICE_EURO) as NB_PRICED,
+        COALESCE(SUM(SALES_PRICE_EURO), 0) as REVENUE,
+        COALESCE(SUM(QUANTITY), 0) as QUANTITY
+    FROM {table}
+    WHERE SALE_DATE >= '{start_date:%Y-%m-%d}' AND SALE_DATE < '{next_day:%Y-%m-%d}'
+    GROUP BY ALL
+    """
+
+
+def distinct_customers_query(start_date_str, end_date_str, table=ORDERS_VIEW):
+    """Unique customers for the whole period and per store (not additive, so not in the cube)"""
+    return f"""
+        SELECT
+            STORE_NAME,
+            COALESCE(STORE_TYPE, 'Non spécifié') as STORE_TYPE,
+            COALESCE(POSTCODE, 'N/A') as POSTCODE,
+            GROUPING(STORE_NAME) as IS_TOTAL,
+            COUNT(DISTINCT CUSTOMER_ID) as UNIQUE_CUSTOMERS
+        FROM {table}
+        WHERE SALE_DATE BETWEEN '{start_date_str}' AND '{end_date_str}'
+        GROUP BY GROUPING SETS ((), (STORE_NAME, STORE_TYPE, POSTCODE))
+    """
+
+
+def _factorize(df: pd.DataFrame, columns):
+    """Integer code per row and the matching dimension table"""
+    grouped = df.groupby(columns, dropna=False, sort=False)
+    codes = grouped.ngroup().to_numpy(np.int32)
+    dims = grouped.size().reset_index()[columns]
+    return codes, dims
+
+
+def _safe_ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    out = np.zeros_like(num, dtype=np.float64)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+class RollupCube:
+    """Additive daily aggregates per (store, product), sorted by day"""
+
+    def __init__(self, days, store_codes, product_codes, orders, priced, revenue, quantity, stores, products):
+        self.days = days
+        self.store_codes = store_codes
+        self.product_codes = product_codes
+        self.orders = orders
+        self.priced = priced
+        self.revenue = revenue
+        self.quantity = quantity
+        self.stores = stores
+        self.products = products
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "RollupCube":
+        """Build the cube from rows returned by cube_query"""
+        df = df.sort_values("SALE_DATE", kind="stable").reset_index(drop=True)
+        store_codes, stores = _factorize(df, STORE_COLUMNS)
+        product_codes, products = _factorize(df, PRODUCT_COLUMNS)
+        return cls(
+            days=pd.to_datetime(df["SALE_DATE"]).to_numpy().astype("datetime64[D]"),
+            store_codes=store_codes,
+            product_codes=product_codes,
+            orders=df["NB_ORDERS"].to_numpy(np.int64),
+            priced=df["NB_PRICED"].to_numpy(np.int64),
+            revenue=df["REVENUE"].to_numpy(np.float64),
+            quantity=df["QUANTITY"].to_numpy(np.float64),
+            stores=stores,
+            products=products,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (
+            self.days, self.store_codes, self.product_codes,
+            self.orders, self.priced, self.revenue, self.quantity,
+        ))
+
+    def _slice(self, start_date, end_date) -> slice:
+        lo = np.searchsorted(self.days, np.datetime64(start_date, "D"), side="left")
+        hi = np.searchsorted(self.days, np.datetime64(end_date, "D"), side="right")
+        return slice(lo, hi)
+
+    def totals(self, start_date, end_date) -> Optional[PeriodKpis]:
+        """Period KPIs, None when there is no order in the period"""
+        s = self._slice(start_date, end_date)
+        orders = int(self.orders[s].sum())
+        if orders == 0:
+            return None
+        revenue = float(self.revenue[s].sum())
+        priced = int(self.priced[s].sum())
+        return PeriodKpis(
+            total_orders=orders,
+            total_revenue=revenue,
+            avg_order_value=revenue / priced if priced else 0.0,
+            total_quantity=float(self.quantity[s].sum()),
+        )
+
+    def daily(self, start_date, end_date) -> pd.DataFrame:
+        """Daily orders, revenue and average order value"""
+        s = self._slice(start_date, end_date)
+        days = self.days[s]
+        if len(days) == 0:
+            return pd.DataFrame(columns=DAILY_COLUMNS)
+        offsets = (days - days[0]).astype(np.int64)
+        orders = np.bincount(offsets, weights=self.orders[s])
+        priced = np.bincount(offsets, weights=self.priced[s])
+        revenue = np.bincount(offsets, weights=self.revenue[s])
+        present = orders > 0
+        return pd.DataFrame({
+            "SALE_DATE": (days[0] + np.arange(len(orders)))[present].astype(object),
+            "NB_ORDERS": orders[present].astype(np.int64),
+            "REVENUE": revenue[present],
+            "AVG_ORDER_VALUE": _safe_ratio(revenue, priced)[present],
+        })
+
+    def period_comparison(self, start_date, end_date) -> PeriodComparison:
+        """KPIs of the period and of the previous one, and the daily series; unique customers left at 0"""
+        prev_start, prev_end = previous_period(start_date, end_date)
+        return PeriodComparison(
+            current=self.totals(start_date, end_date) or PeriodKpis(),
+            previous=self.totals(prev_start, prev_end) if prev_start <= prev_end else None,
+            daily=self.daily(start_date, end_date),
+        )
+
+    def top_products(self, start_date, end_date, limit) -> pd.DataFrame:
+        """Products ranked by revenue, same columns as the products query"""
+        s = self._slice(start_date, end_date)
+        codes = self.product_codes[s]
+        n = len(self.products)
+        orders = np.bincount(codes, weights=self.orders[s], minlength=n)
+        priced = np.bincount(codes, weights=self.priced[s], minlength=n)
+        revenue = np.bincount(codes, weights=self.revenue[s], minlength=n)
+        quantity = np.bincount(codes, weights=self.quantity[s], minlength=n)
+
+        keep = (orders > 0) & self.products["PRODUCT_NAME"].notna().to_numpy()
+        idx = np.flatnonzero(keep)
+        idx = idx[np.argsort(-revenue[idx], kind="stable")][:limit]
+
+        result = self.products.iloc[idx].reset_index(drop=True)
+        result["TOTAL_QUANTITY"] = quantity[idx]
+        result["TOTAL_REVENUE"] = revenue[idx]
+        result["NB_ORDERS"] = orders[idx].astype(np.int64)
+        result["AVG_PRICE"] = _safe_ratio(revenue, priced)[idx]
+        return result
+
+    def store_ranking(self, start_date, end_date) -> pd.DataFrame:
+        """Stores ranked by revenue, same columns as the stores query minus UNIQUE_CUSTOMERS"""
+        s = self._slice(start_date, end_date)
+        codes = self.store_codes[s]
+        n = len(self.stores)
+        orders = np.bincount(codes, weights=self.orders[s], minlength=n)
+        priced = np.bincount(codes, weights=self.priced[s], minlength=n)
+        revenue = np.bincount(codes, weights=self.revenue[s], minlength=n)
+
+        keep = (orders > 0) & self.stores["STORE_NAME"].notna().to_numpy()
+        idx = np.flatnonzero(keep)
+        idx = idx[np.argsort(-revenue[idx], kind="stable")]
+
+        result = self.stores.iloc[idx].reset_index(drop=True)
+        result["NB_ORDERS"] = orders[idx].astype(np.int64)
+        result["REVENUE"] = revenue[idx]
+        result["AVG_ORDER_VALUE"] = _safe_ratio(revenue, priced)[idx]
+        return result
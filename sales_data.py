@@ -0,0 +1,273 @@
+"""
+Accès aux données de ventes
+===========================
+Data-access layer for the forecast app (streamlit_app.py). Date windows are
+resolved on the server (MAX(SALE_DATE) lookup + filtered fetch) so a rerun
+only moves the rows that are actually plotted, the forecast horizon is
+served from a per-store cache warmed in the background, and the sales list
+is browsed one keyset page at a time.
+
+Queries are SQL text with bind parameters, so they run unchanged on every
+backend of backend.py.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pandas as pd
+import streamlit as st
+
+from warehouse_router import router_for
+
+# Nombre de jours par période proposée dans le selectbox
+RANGE_DAYS = {
+    "30 derniers jours": 30,
+    "90 derniers jours": 90,
+    "180 derniers jours": 180,
+}
+
+DAILY_TABLE = "SPORTS_DB.SPORTS_TRANSFORMATION.instore_sales_crm3_daily_aggregated"
+DAILY_STORE_TABLE = "SPORTS_DB.SPORTS_TRANSFORMATION.INSTORE_SALES_CRM3_DAILY_MAGASIN_AGGREGATED"
+FORECAST_TABLE = "SPORTS_DB.SPORTS_datascience.SPORTS_AGGREGATED_FORECAST"
+FORECAST_STORE_TABLE = "SPORTS_DB.SPORTS_datascience.SPORTS_AGGREGATED_FORECAST_STORE"
+SALES_TABLE = "SPORTS_DB.SPORTS_DATA.INSTORE_SALES_DATA_CRM3"
+
+# Pagination par clé : ventes les plus récentes d'abord. PRODUCT_ID départage
+# les lignes d'une même commande pour que la clé soit unique.
+PAGE_KEY = ["SALE_DATE", "ORDER_ID", "PRODUCT_ID"]
+PAGE_SIZE = 50
+MAX_CACHED_PAGES = 5
+
+# Partagé par toutes les sessions pour précharger la page suivante
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sales-prefetch")
+
+
+def _store_filter(store, prefix="WHERE"):
+    """SQL condition and bind parameters restricting a query to `store` when given"""
+    return (f"{prefix} STORE_NAME = ?", [store]) if store else ("", [])
+
+
+def window_bounds(session, table, store, days):
+    """Return (start, end) of the last `days` days, computed in the warehouse"""
+    where, params = _store_filter(store)
+    end_date = router_for(session).collect_nowait(
+        f"SELECT MAX(SALE_DATE) AS END_DATE FROM {table} {where}", params=params
+    ).result()[0]["END_DATE"]
+    # NULL arrives as None from Snowflake, NaT from DuckDB
+    if pd.isna(end_date):
+        return None, None
+    return end_date - timedelta(days=days), end_date
+
+
+def fetch_window(session, table, store, days):
+    """Fetch only the rows of `table` falling in the last `days` days"""
+    start_date, end_date = window_bounds(session, table, store, days)
+    if end_date is None:
+        # No row: the empty result still has the columns of the table
+        df = router_for(session).to_pandas(f"SELECT * FROM {table} WHERE 1 = 0")
+    else:
+        where, params = _store_filter(store, "AND")
+        df = router_for(session).to_pandas(
+            f"SELECT * FROM {table} WHERE SALE_DATE >= ? AND SALE_DATE <= ? {where} ORDER BY SALE_DATE",
+            params=[_key_value(start_date), _key_value(end_date)] + params,
+        )
+    df["SALE_DATE"] = pd.to_datetime(df["SALE_DATE"])
+    return df
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_daily_sales(_session, store, selected_range):
+    """Daily revenue/transactions for a store (or all stores), cached per (store, range)"""
+    table = DAILY_STORE_TABLE if store else DAILY_TABLE
+    return fetch_window(_session, table, store, RANGE_DAYS[selected_range])
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_store_history(_session, days):
+    """Daily series of every store over the last `days` days, for the local forecaster"""
+    return fetch_window(_session, DAILY_STORE_TABLE, None, days)
+
+
+FORECAST_COLUMNS = ["SALE_DATE", "FORECAST", "UPPER_BOUND", "LOWER_BOUND"]
+FORECAST_TTL = 300  # in seconds
+
+
+def fetch_forecast_horizon(session, store, days, last_hist_date):
+    """
+    Forecast and bounds after the last historical day, in one query.
+
+    Keeps the window semantics of the chart: at most the last `days` days up
+    to the latest forecast date (MAX computed by a window function).
+    """
+    columns = ", ".join(FORECAST_COLUMNS)
+    where, params = _store_filter(store, "AND")
+    forecast = router_for(session).to_pandas(f"""
+        SELECT {columns} FROM (
+            SELECT {columns}, MAX(SALE_DATE) OVER () AS END_DATE
+            FROM {FORECAST_STORE_TABLE if store else FORECAST_TABLE}
+            WHERE SALE_DATE > ? {where}
+        )
+        WHERE SALE_DATE >= END_DATE - INTERVAL '{int(days)} days'
+        ORDER BY SALE_DATE
+    """, params=[_key_value(last_hist_date)] + params)
+    forecast["SALE_DATE"] = pd.to_datetime(forecast["SALE_DATE"])
+    return forecast
+
+
+class ForecastServer:
+    """
+    Per-store forecast horizons, fetched in the background.
+
+    warm() is called as soon as a store is selected so the forecast is
+    usually ready by the time the button is clicked; get() waits for it.
+    """
+
+    def __init__(self, ttl=FORECAST_TTL):
+        self.ttl = ttl
+        self._entries = {}  # (store, range, last_hist_date) -> (submitted at, Future)
+        self._lock = threading.Lock()
+
+    def _future(self, session, store, selected_range, last_hist_date):
+        key = (store, selected_range, pd.Timestamp(last_hist_date))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                for old in [k for k, (ts, _) in self._entries.items() if now - ts > self.ttl]:
+                    del self._entries[old]
+                future = _prefetch_executor.submit(
+                    fetch_forecast_horizon, session, store, RANGE_DAYS[selected_range], last_hist_date
+                )
+                entry = (now, future)
+                self._entries[key] = entry
+            return key, entry[1]
+
+    def warm(self, session, store, selected_range, last_hist_date):
+        """Start fetching the forecast horizon without waiting for it"""
+        self._future(session, store, selected_range, last_hist_date)
+
+    def get(self, session, store, selected_range, last_hist_date):
+        """Forecast horizon for the store, fetched now if warm() was not called"""
+        key, future = self._future(session, store, selected_range, last_hist_date)
+        try:
+            return future.result()
+        except Exception:
+            with self._lock:
+                self._entries.pop(key, None)
+            raise
+
+
+@st.cache_resource
+def forecast_server():
+    """The ForecastServer shared by every session of this process"""
+    return ForecastServer()
+
+
+def _key_value(value):
+    """pandas/NumPy scalar -> plain Python value usable as a bind parameter"""
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, "item") else value
+
+
+def _before_key(key):
+    """Condition and bind parameters selecting rows strictly after `key` in descending PAGE_KEY order"""
+    terms, params = [], []
+    for i, name in enumerate(PAGE_KEY):
+        terms.append("(" + " AND ".join([f"{previous} = ?" for previous in PAGE_KEY[:i]] + [f"{name} < ?"]) + ")")
+        params.extend(list(key[:i]) + [key[i]])
+    return "(" + " OR ".join(terms) + ")", params
+
+
+def fetch_sales_page(session, store, after=None, page_size=PAGE_SIZE):
+    """
+    One page of sales, newest first, starting right after the `after` key.
+
+    One extra row is fetched to know whether a next page exists; it is not
+    part of the returned page.
+    """
+    conditions, params = [], []
+    if store:
+        conditions.append("STORE_NAME = ?")
+        params.append(store)
+    if after is not None:
+        condition, key_params = _before_key(after)
+        conditions.append(condition)
+        params.extend(key_params)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = ", ".join(f"{name} DESC" for name in PAGE_KEY)
+    rows = router_for(session).to_pandas(
+        f"SELECT * FROM {SALES_TABLE} {where} ORDER BY {order} LIMIT {int(page_size) + 1}", params=params
+    )
+    return rows.head(page_size), len(rows) > page_size
+
+
+class SalesBrowser:
+    """
+    Keyset-paginated view on the sales table for one store.
+
+    Keep one instance per store in st.session_state: visited pages stay
+    cached (up to MAX_CACHED_PAGES) and the next page is fetched in the
+    background while the current one is displayed.
+    """
+
+    def __init__(self, session, store, page_size=PAGE_SIZE):
+        self.session = session
+        self.store = store
+        self.page_size = page_size
+        self.index = 0
+        self._start_keys = [None]  # key right before each page, page 0 has none
+        self._pages = {}  # page index -> (DataFrame, has_next)
+        self._prefetch = None  # (page index, Future)
+
+    def _fetch(self, index):
+        return fetch_sales_page(self.session, self.store, self._start_keys[index], self.page_size)
+
+    def _load(self, index):
+        if index in self._pages:
+            return self._pages[index]
+        if self._prefetch is not None and self._prefetch[0] == index:
+            page = self._prefetch[1].result()
+            self._prefetch = None
+        else:
+            page = self._fetch(index)
+        self._pages[index] = page
+        # Only the pages around the current one stay in memory
+        for old in [i for i in self._pages if abs(i - index) >= MAX_CACHED_PAGES]:
+            del self._pages[old]
+        return page
+
+    def _start_prefetch(self, index, df):
+        if index + 1 in self._pages or df.empty:
+            return
+        if self._prefetch is not None and self._prefetch[0] == index + 1:
+            return
+        last_key = tuple(_key_value(df.iloc[-1][name]) for name in PAGE_KEY)
+        if len(self._start_keys) == index + 1:
+            self._start_keys.append(last_key)
+        self._prefetch = (index + 1, _prefetch_executor.submit(self._fetch, index + 1))
+
+    def page(self):
+        """Current page as a DataFrame; starts prefetching the next one"""
+        df, has_next = self._load(self.index)
+        if has_next:
+            self._start_prefetch(self.index, df)
+        return df
+
+    @property
+    def has_next(self):
+        return self._load(self.index)[1]
+
+    @property
+    def has_previous(self):
+        return self.index > 0
+
+    def next(self):
+        if self.has_next:
+            self.page()  # records the start key of the next page
+            self.index += 1
+
+    def previous(self):
+        if self.has_previous:
+            self.index -= 1
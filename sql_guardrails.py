@@ -0,0 +1,146 @@
+"""
+Garde-fous SQL
+==============
+Checks the SQL generated by Cortex Analyst before running it. EXPLAIN USING
+JSON gives the partitions and bytes the query would scan without executing
+it; the decision is then:
+
+* run   - within budget, with a LIMIT injected (or tightened) to `max_rows`;
+* preview - above `max_scan_bytes`: only `preview_rows` rows come back,
+  the query wrapped in a plain LIMIT so the warehouse can stop early (no
+  total count: it would need the whole result);
+* refuse - above `refuse_scan_bytes` / `refuse_partitions`, or not a
+  single SELECT statement.
+
+The decision travels with the DataFrame in df.attrs["guardrail"]. EXPLAIN
+and the query go through the warehouse router of the session, so they never
+run while another thread has switched the shared session's warehouse.
+"""
+import json
+import re
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from warehouse_router import POINT_KPI, router_for
+
+RUN, PREVIEW, REFUSE = "run", "preview", "refuse"
+
+_TRAILING_NOISE = re.compile(r"(\s*(--[^\n]*)?\s*;?\s*)+$")
+_TRAILING_LIMIT = re.compile(r"\blimit\s+(\d+)(\s+offset\s+\d+)?\s*$", re.IGNORECASE)
+_SELECT = re.compile(r"^\s*(\(\s*)*(select|with)\b", re.IGNORECASE)
+
+
+@dataclass
+class GuardrailPolicy:
+    max_rows: int = 10_000
+    preview_rows: int = 1_000
+    max_scan_bytes: int = 5 * 1024 ** 3
+    refuse_scan_bytes: int = 100 * 1024 ** 3
+    refuse_partitions: int = 50_000
+
+
+@dataclass
+class GuardrailDecision:
+    action: str
+    sql: str  # statement actually executed
+    reason: Optional[str] = None
+    partitions_assigned: Optional[int] = None
+    partitions_total: Optional[int] = None
+    bytes_assigned: Optional[int] = None
+    row_limit: Optional[int] = None
+    truncated: bool = False
+
+    def caption(self) -> Optional[str]:
+        """Short French summary for st.caption, None when nothing was changed"""
+        scan = ""
+        if self.bytes_assigned is not None:
+            scan = (f"{self.partitions_assigned or 0:,} partitions sur {self.partitions_total or 0:,}, "
+                    f"{self.bytes_assigned / 1024 ** 3:.2f} Go estimés")
+        if self.action == PREVIEW:
+            more = " (il y en a davantage)" if self.truncated else ""
+            return f"Aperçu de {self.row_limit:,} lignes{more} : requête trop volumineuse ({scan})."
+        if self.truncated:
+            return f"Résultat limité à {self.row_limit:,} lignes ({scan})."
+        return None
+
+
+def strip_statement(sql: str) -> str:
+    """SQL without trailing comments and semicolon"""
+    return _TRAILING_NOISE.sub("", sql)
+
+
+def limit_statement(sql: str, limit: int) -> str:
+    """Add a LIMIT, or lower the top-level one when above `limit`"""
+    body = strip_statement(sql)
+    match = _TRAILING_LIMIT.search(body)
+    if match is None:
+        # New line: a comment inside the statement must not swallow the LIMIT
+        return f"{body}\nLIMIT {limit}"
+    if int(match.group(1)) <= limit:
+        return body
+    return f"{body[:match.start(1)]}{limit}{body[match.end(1):]}"
+
+
+def preview_statement(sql: str, rows: int) -> str:
+    """First `rows` rows of the query, whatever its own LIMIT or ORDER BY"""
+    return f"SELECT * FROM (\n{strip_statement(sql)}\n) AS q\nLIMIT {rows}"
+
+
+def explain(session, sql: str) -> dict:
+    """GlobalStats of the plan: partitionsTotal, partitionsAssigned, bytesAssigned"""
+    row = router_for(session).collect_nowait(
+        f"EXPLAIN USING JSON\n{strip_statement(sql)}", query_class=POINT_KPI
+    ).result()[0]
+    return json.loads(row[0]).get("GlobalStats", {})
+
+
+def check_sql(session, sql: str, policy: GuardrailPolicy = GuardrailPolicy()) -> GuardrailDecision:
+    """Decide how `sql` may run; EXPLAIN errors (invalid SQL) propagate"""
+    if not _SELECT.match(sql) or ";" in strip_statement(sql):
+        return GuardrailDecision(REFUSE, sql, reason="Seules les requêtes SELECT uniques sont exécutées.")
+
+    stats = explain(session, sql)
+    decision = GuardrailDecision(
+        RUN,
+        sql,
+        partitions_assigned=stats.get("partitionsAssigned"),
+        partitions_total=stats.get("partitionsTotal"),
+        bytes_assigned=stats.get("bytesAssigned"),
+    )
+    scanned = decision.bytes_assigned or 0
+    if scanned > policy.refuse_scan_bytes or (decision.partitions_assigned or 0) > policy.refuse_partitions:
+        decision.action = REFUSE
+        decision.reason = (
+            f"Requête refusée : {decision.partitions_assigned or 0:,} partitions et "
+            f"{scanned / 1024 ** 3:.1f} Go à parcourir dépassent le budget "
+            f"({policy.refuse_scan_bytes / 1024 ** 3:.0f} Go). Précise la période ou les magasins."
+        )
+    elif scanned > policy.max_scan_bytes:
+        # One extra row tells whether the result was cut
+        decision.action = PREVIEW
+        decision.row_limit = policy.preview_rows
+        decision.sql = preview_statement(sql, policy.preview_rows + 1)
+    else:
+        decision.row_limit = policy.max_rows
+        decision.sql = limit_statement(sql, policy.max_rows + 1)
+    return decision
+
+
+def run_guarded(session, sql: str, policy: GuardrailPolicy = GuardrailPolicy(), router=None):
+    """
+    Run `sql` under the guardrails, on its warehouse (router_for(session) by default).
+
+    Returns:
+        Tuple[Optional[pd.DataFrame], Optional[str]]: The result, with the
+            decision in df.attrs["guardrail"], or the refusal/error message.
+    """
+    decision = check_sql(session, sql, policy)
+    if decision.action == REFUSE:
+        return None, decision.reason
+    router = router or router_for(session)
+    df = router.to_pandas(decision.sql, scan_bytes=decision.bytes_assigned)
+    if len(df) > decision.row_limit:
+        df = df.head(decision.row_limit)
+        decision.truncated = True
+    df.attrs["guardrail"] = asdict(decision)
+    return df, None
@@ -4,11 +4,25 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta, date
-import snowflake.snowpark.context as context
 import numpy as np
 
-# Get current session
-session = context.get_active_session()
+from backend import get_backend
+from chart_utils import SeriesBudget
+from query_scheduler import QueryScheduler, clear_results
+from reference_data import reference_data
+from export_stream import DEFAULT_MAX_ROWS, DEFAULT_PREVIEW_ROWS, DOWNLOAD_MAX_BYTES, FORMATS, remove_export, stream_export
+from result_decoder import fetch_dataframe
+from day_cache import DayPartitionCache
+from period_comparison import previous_period
+from rollup_cube import STORE_COLUMNS, RollupCube, cube_query, distinct_customers_query
+from query_trace import performance_panel, set_app, widget_span
+from warehouse_router import router_for
+
+# Session Snowflake, ou DuckDB local avec SS_BACKEND=local
+session = get_backend().session
+set_app("ss_sales")
+# Chaque requête part sur l'entrepôt de sa classe (KPI, agrégat, scan complet)
+router = router_for(session)
 
 # Configuration de la page
 st.set_page_config(
@@ -38,20 +52,10 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Fonctions utilitaires
-@st.cache_data(ttl=300)
-def run_query(query_sql):
-    """Execute query and return DataFrame"""
+def scheduled_result(name):
+    """Wait for a query submitted to the scheduler and return DataFrame"""
     try:
-        df = session.sql(query_sql).to_pandas()
-        # Conversion sécurisée des colonnes de dates
-        for col in df.columns:
-            if 'DATE' in col.upper() or 'PERIOD' in col.upper():
-                if df[col].dtype == 'object':
-                    try:
-                        df[col] = pd.to_datetime(df[col]).dt.date
-                    except:
-                        pass
-        return df
+        return scheduler.result(name)
     except Exception as e:
         st.error(f"Erreur d'exécution: {e}")
         return pd.DataFrame()
@@ -83,6 +87,25 @@ def safe_calculate_delta(current, previous):
     except:
         return None
 
+@st.cache_resource
+def sales_day_cache():
+    """Agrégats (jour, magasin, produit) partagés par toutes les sessions, jour par jour"""
+    return DayPartitionCache(
+        lambda start, end: fetch_dataframe(session, cube_query(start, end), router)[0]
+    )
+
+def load_cube(start_date, end_date):
+    """Rollup cube covering [start_date, end_date]; only missing days hit the warehouse.
+    Built once per range and shared by reruns and sessions until a day is reloaded: read only"""
+    return sales_day_cache().derive(start_date, end_date, RollupCube.from_frame)
+
+def scheduled_customers():
+    """Unique customers (total row + one row per store) from the scheduled query"""
+    customers = scheduled_result("customers")
+    if customers.empty:
+        return pd.DataFrame(columns=STORE_COLUMNS + ['IS_TOTAL', 'UNIQUE_CUSTOMERS'])
+    return customers
+
 # Header principal
 st.markdown('<h1 class="main-header">📊 Dashboard Ventes SS 101</h1>', unsafe_allow_html=True)
 
@@ -105,6 +128,10 @@ try:
             key="end_date"
         )
     
+    if start_date > end_date:
+        st.sidebar.error("La date de début doit précéder la date de fin")
+        st.stop()
+    
     # Conversion sécurisée des dates
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
@@ -115,6 +142,31 @@ except Exception as e:
     st.error(f"Erreur avec les dates: {e}")
     st.stop()
 
+with st.sidebar.expander("⚙️ Entrepôts"):
+    warehouse_stats = router.stats_frame()
+    if warehouse_stats.empty:
+        st.caption("Aucune requête routée pour l'instant")
+    else:
+        st.dataframe(warehouse_stats, hide_index=True, use_container_width=True)
+
+# Les clients uniques ne sont pas additifs : seule cette requête part en
+# entrepôt à chaque changement de période, lancée avant le rendu des onglets
+if "query_scheduler" not in st.session_state:
+    st.session_state.query_scheduler = QueryScheduler(session, router=router)
+scheduler = st.session_state.query_scheduler
+scheduler.start_cycle((start_date_str, end_date_str))
+scheduler.submit("customers", distinct_customers_query(start_date_str, end_date_str))
+
+# Tous les agrégats additifs (KPIs, produits, magasins) sont lus dans le cube,
+# qui couvre aussi la période précédente pour les deltas
+try:
+    with st.spinner("Chargement des ventes..."):
+        with widget_span(None, "cube"):
+            cube = load_cube(min(previous_period(start_date, end_date)[0], start_date), end_date)
+except Exception as e:
+    st.error(f"Erreur de chargement des ventes: {e}")
+    st.stop()
+
 # Onglets principaux
 tab1, tab2, tab3, tab4 = st.tabs([
     "📈 Vue d'ensemble", 
@@ -128,49 +180,28 @@ with tab1:
     st.markdown('<h2 class="sub-header">📊 Indicateurs Clés de Performance</h2>', unsafe_allow_html=True)
     
     try:
-        # Requête KPIs actuels
-        kpi_query = f"""
-        SELECT 
-            COUNT(*) as total_orders,
-            COALESCE(SUM(SALES_PRICE_EURO), 0) as total_revenue,
-            COALESCE(AVG(SALES_PRICE_EURO), 0) as avg_order_value,
-            COALESCE(SUM(QUANTITY), 0) as total_quantity,
-            COUNT(DISTINCT CUSTOMER_ID) as unique_customers
-        FROM ss_101.analytics.orders_v
-        WHERE SALE_DATE BETWEEN '{start_date_str}' AND '{end_date_str}'
-        """
+        # KPIs période actuelle, période précédente et série quotidienne, lus dans le cube
+        comparison = cube.period_comparison(start_date, end_date)
         
-        kpi_data = run_query(kpi_query)
-        
-        if not kpi_data.empty:
-            kpis = kpi_data.iloc[0]
-            
-            # KPIs période précédente pour comparaison
-            days_diff = (end_date - start_date).days
-            prev_start = start_date - timedelta(days=days_diff)
-            prev_end = start_date - timedelta(days=1)
+        if not comparison.is_empty:
+            kpis = comparison.current
+            prev_kpis = comparison.previous
             
-            prev_kpi_query = f"""
-            SELECT 
-                COUNT(*) as total_orders,
-                COALESCE(SUM(SALES_PRICE_EURO), 0) as total_revenue,
-                COALESCE(AVG(SALES_PRICE_EURO), 0) as avg_order_value
-            FROM ss_101.analytics.orders_v
-            WHERE SALE_DATE BETWEEN '{prev_start.strftime('%Y-%m-%d')}' AND '{prev_end.strftime('%Y-%m-%d')}'
-            """
-            
-            prev_kpi_data = run_query(prev_kpi_query)
+            with widget_span("Vue d'ensemble", "clients_uniques"):
+                customers = scheduled_customers()
+            total_customers = customers[customers['IS_TOTAL'] == 1]
+            if not total_customers.empty:
+                kpis.unique_customers = int(total_customers['UNIQUE_CUSTOMERS'].iloc[0])
             
             # Calcul des deltas sécurisé
             delta_revenue = None
             delta_orders = None
             delta_aov = None
             
-            if not prev_kpi_data.empty:
-                prev_kpis = prev_kpi_data.iloc[0]
-                delta_revenue = safe_calculate_delta(kpis['TOTAL_REVENUE'], prev_kpis['TOTAL_REVENUE'])
-                delta_orders = safe_calculate_delta(kpis['TOTAL_ORDERS'], prev_kpis['TOTAL_ORDERS'])
-                delta_aov = safe_calculate_delta(kpis['AVG_ORDER_VALUE'], prev_kpis['AVG_ORDER_VALUE'])
+            if prev_kpis is not None:
+                delta_revenue = safe_calculate_delta(kpis.total_revenue, prev_kpis.total_revenue)
+                delta_orders = safe_calculate_delta(kpis.total_orders, prev_kpis.total_orders)
+                delta_aov = safe_calculate_delta(kpis.avg_order_value, prev_kpis.avg_order_value)
             
             # Affichage des KPIs
             col1, col2, col3, col4 = st.columns(4)
@@ -178,61 +209,55 @@ with tab1:
             with col1:
                 st.metric(
                     "💰 Chiffre d'Affaires",
-                    format_number(kpis['TOTAL_REVENUE'], 'currency'),
+                    format_number(kpis.total_revenue, 'currency'),
                     delta_revenue
                 )
             
             with col2:
                 st.metric(
                     "📦 Commandes",
-                    format_number(kpis['TOTAL_ORDERS'], 'number'),
+                    format_number(kpis.total_orders, 'number'),
                     delta_orders
                 )
             
             with col3:
                 st.metric(
                     "🛒 Panier Moyen",
-                    format_number(kpis['AVG_ORDER_VALUE'], 'currency'),
+                    format_number(kpis.avg_order_value, 'currency'),
                     delta_aov
                 )
             
             with col4:
                 st.metric(
                     "👥 Clients Uniques",
-                    format_number(kpis['UNIQUE_CUSTOMERS'], 'number')
+                    format_number(kpis.unique_customers, 'number')
                 )
             
             st.markdown("---")
             
             # Graphiques de tendances
-            daily_sales_query = f"""
-            SELECT 
-                SALE_DATE::DATE as SALE_DATE,
-                COUNT(*) as NB_ORDERS,
-                COALESCE(SUM(SALES_PRICE_EURO), 0) as REVENUE,
-                COALESCE(AVG(SALES_PRICE_EURO), 0) as AVG_ORDER_VALUE
-            FROM ss_101.analytics.orders_v
-            WHERE SALE_DATE BETWEEN '{start_date_str}' AND '{end_date_str}'
-            GROUP BY SALE_DATE
-            ORDER BY SALE_DATE
-            """
-            
-            daily_sales = run_query(daily_sales_query)
+            daily_sales = comparison.daily
             
             if not daily_sales.empty:
                 # Conversion sécurisée des dates pour Plotly
                 daily_sales['SALE_DATE_STR'] = daily_sales['SALE_DATE'].astype(str)
                 
+                # Sous-échantillonnage (LTTB) des longues séries avant envoi au navigateur
+                chart_budget = SeriesBudget()
+                revenue_points = chart_budget.frame(daily_sales, 'SALE_DATE', 'REVENUE')
+                orders_points = chart_budget.frame(daily_sales, 'SALE_DATE', 'NB_ORDERS')
+                
                 col1, col2 = st.columns(2)
                 
                 with col1:
                     # Évolution du CA
                     fig_revenue = px.line(
-                        daily_sales,
+                        revenue_points,
                         x='SALE_DATE_STR',
                         y='REVENUE',
                         title="📈 Évolution du Chiffre d'Affaires",
-                        labels={'SALE_DATE_STR': 'Date', 'REVENUE': 'Revenus (€)'}
+                        labels={'SALE_DATE_STR': 'Date', 'REVENUE': 'Revenus (€)'},
+                        render_mode=chart_budget.render_mode
                     )
                     fig_revenue.update_layout(height=400)
                     st.plotly_chart(fig_revenue, use_container_width=True)
@@ -240,7 +265,7 @@ with tab1:
                 with col2:
                     # Évolution des commandes
                     fig_orders = px.bar(
-                        daily_sales,
+                        orders_points,
                         x='SALE_DATE_STR',
                         y='NB_ORDERS',
                         title="📦 Évolution du Nombre de Commandes"
@@ -248,6 +273,8 @@ with tab1:
                     fig_orders.update_layout(height=400)
                     st.plotly_chart(fig_orders, use_container_width=True)
                 
+                st.caption(chart_budget.caption())
+                
                 # Métriques additionnelles sécurisées
                 col1, col2 = st.columns(2)
                 
@@ -280,25 +307,7 @@ with tab2:
         with col2:
             sort_by = st.selectbox("Trier par", ["Revenus", "Quantité", "Commandes"])
         
-        # Requête produits
-        products_query = f"""
-            SELECT 
-                COALESCE(PRODUCT_NAME, 'Non spécifié') as PRODUCT_NAME,
-                COALESCE(BRAND, 'Non spécifié') as BRAND,
-                COALESCE(PRODUCT_CATEGORY, 'Non spécifié') as PRODUCT_CATEGORY,
-                SUM(QUANTITY) as TOTAL_QUANTITY,
-                COALESCE(SUM(SALES_PRICE_EURO), 0) as TOTAL_REVENUE,
-                COUNT(*) as NB_ORDERS,
-                COALESCE(AVG(SALES_PRICE_EURO), 0) as AVG_PRICE
-            FROM ss_101.analytics.orders_v
-            WHERE SALE_DATE BETWEEN '{start_date_str}' AND '{end_date_str}'
-                AND PRODUCT_NAME IS NOT NULL
-            GROUP BY PRODUCT_NAME, BRAND, PRODUCT_CATEGORY
-            ORDER BY TOTAL_REVENUE DESC
-            LIMIT {product_limit}
-        """
-        
-        products_data = run_query(products_query)
+        products_data = cube.top_products(start_date, end_date, product_limit)
         
         if not products_data.empty:
             # Tri selon sélection
@@ -347,24 +356,16 @@ with tab3:
     st.markdown('<h2 class="sub-header">🏪 Performance des Magasins</h2>', unsafe_allow_html=True)
     
     try:
-        # Requête magasins
-        stores_query = f"""
-            SELECT 
-                COALESCE(STORE_NAME, 'Non spécifié') as STORE_NAME,
-                COALESCE(STORE_TYPE, 'Non spécifié') as STORE_TYPE,
-                COALESCE(POSTCODE, 'N/A') as POSTCODE,
-                COUNT(*) as NB_ORDERS,
-                COALESCE(SUM(SALES_PRICE_EURO), 0) as REVENUE,
-                COUNT(DISTINCT CUSTOMER_ID) as UNIQUE_CUSTOMERS,
-                COALESCE(AVG(SALES_PRICE_EURO), 0) as AVG_ORDER_VALUE
-            FROM ss_101.analytics.orders_v
-            WHERE SALE_DATE BETWEEN '{start_date_str}' AND '{end_date_str}'
-                AND STORE_NAME IS NOT NULL
-            GROUP BY STORE_NAME, STORE_TYPE, POSTCODE
-            ORDER BY REVENUE DESC
-        """
+        stores_data = cube.store_ranking(start_date, end_date)
         
-        stores_data = run_query(stores_query)
+        # Clients uniques par magasin (requête entrepôt, non additif)
+        with widget_span("Magasins", "clients_uniques"):
+            customers = scheduled_customers()
+        stores_data = stores_data.merge(
+            customers[customers['IS_TOTAL'] == 0][STORE_COLUMNS + ['UNIQUE_CUSTOMERS']],
+            on=STORE_COLUMNS,
+            how='left'
+        )
         
         if not stores_data.empty:
             # KPIs magasins
@@ -398,10 +399,15 @@ with tab3:
             display_stores = stores_data.copy()
             display_stores['REVENUE'] = display_stores['REVENUE'].apply(lambda x: format_number(x, 'currency'))
             display_stores['AVG_ORDER_VALUE'] = display_stores['AVG_ORDER_VALUE'].apply(lambda x: format_number(x, 'currency'))
+            with widget_span("Magasins", "adresses"):
+                store_directory = reference_data(session).stores
+            display_stores['ADDRESS'] = [
+                (store_directory.by_name(name) or {}).get('ADDRESS') for name in display_stores['STORE_NAME']
+            ]
             
             st.dataframe(
                 display_stores[[
-                    'STORE_NAME', 'STORE_TYPE', 'POSTCODE', 
+                    'STORE_NAME', 'STORE_TYPE', 'POSTCODE', 'ADDRESS',
                     'REVENUE', 'NB_ORDERS', 'UNIQUE_CUSTOMERS', 'AVG_ORDER_VALUE'
                 ]],
                 use_container_width=True,
@@ -449,33 +455,68 @@ ORDER BY month;
         placeholder="SELECT * FROM ss_101.analytics.orders_v LIMIT 100"
     )
     
+    col1, col2, col3 = st.columns([2, 2, 3])
+    with col1:
+        export_format = st.selectbox("Format d'export", list(FORMATS))
+    with col2:
+        max_rows = st.number_input(
+            "Lignes max.",
+            min_value=1,
+            value=DEFAULT_MAX_ROWS,
+            step=100_000
+        )
+    
     col1, col2 = st.columns([1, 4])
     with col1:
         execute_query = st.button("▶️ Exécuter", type="primary")
     with col2:
         if st.button("🧹 Effacer"):
+            remove_export(st.session_state.pop("custom_export_path", None))
             st.rerun()
     
     if execute_query and custom_query.strip():
         try:
-            with st.spinner("Exécution de la requête..."):
-                custom_result = run_query(custom_query)
+            # Le résultat est écrit par lots sur disque, seul un aperçu reste en mémoire
+            remove_export(st.session_state.pop("custom_export_path", None))
+            progress_bar = st.progress(0.0, text="Exécution de la requête...")
+            
+            def show_progress(rows, bytes_written):
+                progress_bar.progress(
+                    min(rows / max_rows, 1.0),
+                    text=f"{rows:,} lignes · {bytes_written / 1e6:.1f} Mo écrits"
+                )
+            
+            with widget_span("Données Détaillées et Export", "export"):
+                export = stream_export(
+                    session,
+                    custom_query,
+                    fmt=export_format,
+                    max_rows=int(max_rows),
+                    max_bytes=DOWNLOAD_MAX_BYTES,
+                    progress=show_progress,
+                    router=router
+                )
+            progress_bar.empty()
+            st.session_state.custom_export_path = export.path
+            
+            if export.rows > 0:
+                st.success(f"✅ Requête exécutée ! {export.rows:,} lignes exportées en {export.seconds:.1f} s.")
+                if export.truncated:
+                    st.warning(f"⚠️ Budget d'export atteint ({DOWNLOAD_MAX_BYTES / 1e6:.0f} Mo ou {int(max_rows):,} lignes) : le fichier est tronqué.")
+                st.caption(f"Aperçu des {len(export.preview):,} premières lignes (max. {DEFAULT_PREVIEW_ROWS:,})")
+                st.dataframe(export.preview, use_container_width=True)
                 
-                if not custom_result.empty:
-                    st.success(f"✅ Requête exécutée ! {len(custom_result)} lignes retournées.")
-                    st.dataframe(custom_result, use_container_width=True)
-                    
-                    # Option de téléchargement
-                    csv_custom = custom_result.to_csv(index=False)
+                # Option de téléchargement
+                with open(export.path, "rb") as export_file:
                     st.download_button(
-                        label="⬇️ Télécharger CSV",
-                        data=csv_custom,
-                        file_name=f"requete_personnalisee_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv"
+                        label=f"⬇️ Télécharger {export_format} ({export.bytes_written / 1e6:.1f} Mo)",
+                        data=export_file,
+                        file_name=f"requete_personnalisee_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FORMATS[export_format][0]}",
+                        mime=export.mime
                     )
-                else:
-                    st.warning("⚠️ Aucun résultat retourné.")
-                    
+            else:
+                st.warning("⚠️ Aucun résultat retourné.")
+                
         except Exception as e:
             st.error(f"❌ Erreur: {str(e)}")
 
@@ -492,4 +533,8 @@ with col2:
 with col3:
     if st.button("🔄 Actualiser"):
         st.cache_data.clear()
+        clear_results()
+        sales_day_cache().clear()
         st.rerun()
+
+performance_panel(session, "ss_sales", st.sidebar)
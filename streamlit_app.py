@@ -1,24 +1,15 @@
-import streamlit as st
-import pandas as pd
 import plotly.graph_objs as go
-from snowflake.snowpark import Session
-
-import snowflake.snowpark.functions as F
-from snowflake.snowpark.functions import col
-from datetime import datetime, timedelta
-import numpy as np
-import unidecode
-from snowflake.snowpark.context import get_active_session
-import re
-
-import _snowflake
-import json
 import streamlit as st
-import time
-from typing import Dict, List, Optional, Tuple
-from snowflake.snowpark.exceptions import SnowparkSQLException
 
-session = get_active_session()
+from backend import get_backend
+from chart_utils import SeriesBudget
+from query_trace import performance_panel, set_app, widget_span
+from reference_data import reference_data
+from batch_forecast import forecast_all_stores
+from sales_data import PAGE_SIZE, SalesBrowser, forecast_server, load_daily_sales, load_store_history
+
+session = get_backend().session
+set_app("previsions")
 
 # Créer l'application Streamlit
 st.set_page_config(page_title="Dashboard Adhérant Summit Sport", layout="wide")
@@ -35,42 +26,33 @@ tab1, tab2, tab3 = st.tabs(["Prévoir les Ventes", "Poser des Questions", "Perso
 with tab1:
 
     #####FILTERS##### 
-    magasin_options = session.table("ss_101.raw_pos.magasins").select("STORE_NAME").sort("STORE_NAME").collect()
-    product_options = [row[0] for row in magasin_options]
+    with widget_span("Prévoir les Ventes", "magasins"):
+        stores = reference_data(session).stores
+    magasin_options = stores.names
 
     col1, col2 = st.columns(2)
     with col1:
         selected_magasin = st.selectbox("Sélectionnez un magasin :", magasin_options, index=None, placeholder="Tous les magasins")
         if selected_magasin: 
-            selected_magasin_clean = unidecode.unidecode(selected_magasin).replace("SUMMITSPORT ", "")
-            selected_magasin_cleaned = re.sub(r'[^A-Za-z0-9]', '', selected_magasin_clean)
+            selected_magasin_cleaned = stores.clean_name_of(selected_magasin)
 
     with col2:
         selected_range = st.selectbox("Sélectionnez la période :", ["30 derniers jours", "90 derniers jours", "180 derniers jours"])
 
     ##### GET DATA ######
-    if not selected_magasin:
-        filtered_data = session.table(["SPORTS_DB", "SPORTS_TRANSFORMATION", "instore_sales_crm3_daily_aggregated"]).sort(col("SALE_DATE")).to_pandas()
-    else:
-        filtered_data = session.table(["SPORTS_DB", "SPORTS_TRANSFORMATION", "INSTORE_SALES_CRM3_DAILY_MAGASIN_AGGREGATED"]).filter(
-            (F.col("STORE_NAME") == selected_magasin)).sort(col("SALE_DATE")).to_pandas()
-
-    filtered_data['SALE_DATE'] = pd.to_datetime(filtered_data['SALE_DATE'])
-    end_date = filtered_data['SALE_DATE'].max()
-    if selected_range == "30 derniers jours":
-        start_date = end_date - timedelta(days=30)
-    elif selected_range == "90 derniers jours":
-        start_date = end_date - timedelta(days=90)
-    else:
-        start_date = end_date - timedelta(days=180)
-
-    filtered_data = filtered_data[(filtered_data['SALE_DATE'] >= start_date) & (filtered_data['SALE_DATE'] <= end_date)]
-    filtered_data['SALE_DATE'] = pd.to_datetime(filtered_data['SALE_DATE'])
+    with widget_span("Prévoir les Ventes", "historique"):
+        filtered_data = load_daily_sales(session, selected_magasin, selected_range)
+
+    # Préchargement des prévisions en arrière-plan dès la sélection du magasin
+    last_hist_date = filtered_data['SALE_DATE'].max() if not filtered_data.empty else None
+    if last_hist_date is not None:
+        forecast_server().warm(session, selected_magasin, selected_range, last_hist_date)
 
     #### CREATE INITIAL FIGURE #######
     fig = go.Figure()
+    chart_budget = SeriesBudget()
 
-    fig.add_trace(go.Scatter(
+    fig.add_trace(chart_budget.scatter(
         x=filtered_data['SALE_DATE'],
         y=filtered_data['DAILY_REVENUE'],
         mode='lines',
@@ -79,7 +61,7 @@ with tab1:
         yaxis='y1'
     ))
 
-    fig.add_trace(go.Scatter(
+    fig.add_trace(chart_budget.scatter(
         x=filtered_data['SALE_DATE'],
         y=filtered_data['DAILY_TRANSACTIONS'],
         mode='lines',
@@ -92,13 +74,11 @@ with tab1:
         title=f"Ventes {selected_range}",
         xaxis_title="Date",
         yaxis=dict(
-            title="Revenue des Ventes (€)",
-            titlefont=dict(color="red"),
+            title=dict(text="Revenue des Ventes (€)", font=dict(color="red")),
             tickfont=dict(color="red"),
         ),
         yaxis2=dict(
-            title="# des Ventes",
-            titlefont=dict(color="navy"),
+            title=dict(text="# des Ventes", font=dict(color="navy")),
             tickfont=dict(color="navy"),
             overlaying="y",
             side="right"
@@ -109,35 +89,17 @@ with tab1:
     )
 
     ####### FORECAST BUTTON ########
-    if st.button("Visualisez des prédictions de vente"):
-        if not selected_magasin:
-            forecast_data = session.table(["SPORTS_DB", "SPORTS_datascience", "SPORTS_AGGREGATED_FORECAST"]).sort(col("SALE_DATE")).to_pandas()
-        else:
-            forecast_data = session.table(["SPORTS_DB", "SPORTS_datascience", "SPORTS_AGGREGATED_FORECAST_STORE"]).filter(
-                (F.col("STORE_NAME") == selected_magasin)).sort(col("SALE_DATE")).to_pandas()
-
-        forecast_data['SALE_DATE'] = pd.to_datetime(forecast_data['SALE_DATE'])
-        end_date = forecast_data['SALE_DATE'].max()
-        if selected_range == "30 derniers jours":
-            start_date = end_date - timedelta(days=30)
-        elif selected_range == "90 derniers jours":
-            start_date = end_date - timedelta(days=90)
-        else:
-            start_date = end_date - timedelta(days=180)
-
-        forecast_data = forecast_data[(forecast_data['SALE_DATE'] >= start_date) & (forecast_data['SALE_DATE'] <= end_date)]
+    if st.button("Visualisez des prédictions de vente") and last_hist_date is not None:
+        with widget_span("Prévoir les Ventes", "prevision"):
+            forecast_only = forecast_server().get(session, selected_magasin, selected_range, last_hist_date)
 
         with st.status("Génération des prédictions", expanded=True) as status:        
             st.write("... modèle entraîné ...")
             status.update(label="Prédictions finies", state="complete", expanded=True)
 
         # Get last historical point
-        last_hist_date = filtered_data['SALE_DATE'].max()
         last_hist_value = filtered_data.loc[filtered_data['SALE_DATE'] == last_hist_date, 'DAILY_REVENUE'].values[0]
         
-        # Filter forecast data starting after that point
-        forecast_only = forecast_data[forecast_data['SALE_DATE'] > last_hist_date].copy()
-        
         # Prepend last actual value to forecast for seamless line
         stitched_dates = [last_hist_date] + list(forecast_only['SALE_DATE'])
         stitched_values = [last_hist_value] + list(forecast_only['FORECAST'])
@@ -153,17 +115,8 @@ with tab1:
         ))
 
         fig.add_trace(go.Scatter(
-            x=forecast_data['SALE_DATE'],
-            y=forecast_data['FORECAST'],
-            mode='lines',
-            name='Prévision de Revenue',
-            line=dict(color='red', dash='dot'),
-            yaxis='y1'
-        ))
-
-        fig.add_trace(go.Scatter(
-            x=forecast_data['SALE_DATE'],
-            y=forecast_data['UPPER_BOUND'],
+            x=forecast_only['SALE_DATE'],
+            y=forecast_only['UPPER_BOUND'],
             mode='lines',
             name='Borne Supérieure',
             line=dict(color='darkred', dash='dash'),
@@ -172,8 +125,8 @@ with tab1:
         ))
 
         fig.add_trace(go.Scatter(
-            x=forecast_data['SALE_DATE'],
-            y=forecast_data['LOWER_BOUND'],
+            x=forecast_only['SALE_DATE'],
+            y=forecast_only['LOWER_BOUND'],
             mode='lines',
             name='Borne Inférieure',
             line=dict(color='salmon', dash='dash'),
@@ -187,10 +140,92 @@ with tab1:
 
     #### DISPLAY FINAL FIGURE ####
     st.plotly_chart(fig, use_container_width=True)
+    if chart_budget.caption():
+        st.caption(chart_budget.caption())
+
+    with st.expander("Scénarios de prévision (calcul local, tous magasins)"):
+        col_horizon, col_uplift, col_exclude = st.columns(3)
+        with col_horizon:
+            scenario_horizon = st.slider("Horizon (jours)", 7, 90, 30)
+        with col_uplift:
+            scenario_uplift = st.slider("Effet promotion (%)", -30, 50, 0)
+        with col_exclude:
+            scenario_excluded = st.multiselect("Magasins exclus", magasin_options)
+
+        if st.button("Calculer le scénario"):
+            # Un an d'historique : la saisonnalité hebdomadaire est bien estimée
+            with widget_span("Prévoir les Ventes", "scenario"):
+                history = load_store_history(session, 365)
+            try:
+                scenario = forecast_all_stores(
+                    history,
+                    horizon=scenario_horizon,
+                    uplift=scenario_uplift / 100,
+                    exclude=scenario_excluded
+                )
+            except ValueError as e:
+                scenario = None
+                st.warning(f"Scénario impossible : {e}")
+            if scenario is not None and scenario.stores.empty:
+                st.warning("Aucun magasin à prévoir : l'historique est vide ou tous les magasins sont exclus.")
+            elif scenario is not None:
+                if selected_magasin and selected_magasin not in scenario_excluded:
+                    scenario_data = scenario.stores[scenario.stores['STORE_NAME'] == selected_magasin]
+                else:
+                    scenario_data = scenario.total
+
+                scenario_fig = go.Figure()
+                scenario_fig.add_trace(go.Scatter(
+                    x=scenario_data['SALE_DATE'],
+                    y=scenario_data['UPPER_BOUND'],
+                    mode='lines',
+                    name='Borne Supérieure',
+                    line=dict(color='darkred', dash='dash'),
+                    showlegend=False
+                ))
+                scenario_fig.add_trace(go.Scatter(
+                    x=scenario_data['SALE_DATE'],
+                    y=scenario_data['LOWER_BOUND'],
+                    mode='lines',
+                    name='Borne Inférieure',
+                    line=dict(color='salmon', dash='dash'),
+                    fill='tonexty',
+                    fillcolor='rgba(255, 0, 0, 0.2)',
+                    showlegend=False
+                ))
+                scenario_fig.add_trace(go.Scatter(
+                    x=scenario_data['SALE_DATE'],
+                    y=scenario_data['FORECAST'],
+                    mode='lines',
+                    name='Prévision de Revenue',
+                    line=dict(color='red', dash='dot')
+                ))
+                scenario_fig.update_layout(
+                    title=f"Scénario {selected_magasin or 'tous magasins'} – {scenario_horizon} jours",
+                    xaxis_title="Date",
+                    yaxis_title="Revenue des Ventes (€)",
+                    hovermode="x unified",
+                    template="plotly_white"
+                )
+                st.plotly_chart(scenario_fig, use_container_width=True)
+                st.caption(
+                    f"{len(scenario.params)} magasins ajustés en {scenario.fit_seconds * 1000:.0f} ms "
+                    "(Holt-Winters, saisonnalité hebdomadaire)"
+                )
 
     with st.expander("Liste des ventes"):
-        if selected_magasin:
-            st.write(session.table("SPORTS_DB.SPORTS_DATA.INSTORE_SALES_DATA_CRM3").filter(
-                (F.col("STORE_NAME") == selected_magasin)).sort(col("SALE_DATE"), ascending=False))
-        else: 
-            st.write(session.table("SPORTS_DB.SPORTS_DATA.INSTORE_SALES_DATA_CRM3").sort(col("SALE_DATE"), ascending=False))
+        browser_key = f"sales_browser_{selected_magasin}"
+        if browser_key not in st.session_state:
+            st.session_state[browser_key] = SalesBrowser(session, selected_magasin)
+        browser = st.session_state[browser_key]
+
+        with widget_span("Prévoir les Ventes", "liste_ventes"):
+            sales_page = browser.page()
+        st.dataframe(sales_page, use_container_width=True)
+
+        col_prev, col_page, col_next = st.columns([1, 4, 1])
+        col_prev.button("◀ Précédent", on_click=browser.previous, disabled=not browser.has_previous, key=f"{browser_key}_prev")
+        col_page.caption(f"Page {browser.index + 1} · {PAGE_SIZE} ventes par page")
+        col_next.button("Suivant ▶", on_click=browser.next, disabled=not browser.has_next, key=f"{browser_key}_next")
+
+performance_panel(session, "previsions", st.sidebar)
@@ -3,30 +3,53 @@ Cortex Analyst App
 ====================
 This app allows users to interact with their data using natural language.
 """
+import contextvars
 import json  # To handle JSON data
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Union
 
-import _snowflake  # For interacting with Snowflake-specific APIs
 import pandas as pd
 import streamlit as st  # Streamlit library for building the web app
-from snowflake.snowpark.context import (
-    get_active_session,
-)  # To interact with Snowflake sessions
-from snowflake.snowpark.exceptions import SnowparkSQLException
+from analyst_stream import StreamedResponse, StreamError, StreamingUnavailable, stream_events
+from answer_cache import CachedAnswer, answer_cache
+from backend import get_backend
+from query_trace import performance_panel, set_app, widget_span
+from reference_data import reference_data
+from chat_context import ConversationContext, TurnStats
+from result_store import ResultStore
+from sql_guardrails import GuardrailDecision, GuardrailPolicy, run_guarded
+from warehouse_router import router_for
 
 # List of available semantic model paths in the format: <DATABASE>.<SCHEMA>.<STAGE>/<FILE-NAME>
 # Each path points to a YAML file defining a semantic model
 API_ENDPOINT = "/api/v2/cortex/analyst/message"
 FEEDBACK_API_ENDPOINT = "/api/v2/cortex/analyst/feedback"
 API_TIMEOUT = 50000  # in milliseconds
+SEMANTIC_VIEW = "SS_101.HARMONIZED.ORDERS_SV"
 
-# Initialize a Snowpark session for executing queries
-session = get_active_session()
+# Last exchanges sent verbatim, older ones reduced to question + SQL
+context = ConversationContext(recent_turns=2, max_bytes=16_000)
+
+# Rows and scan budget of the generated SQL, checked with EXPLAIN before running
+guardrail_policy = GuardrailPolicy(
+    max_rows=10_000,
+    preview_rows=1_000,
+    max_scan_bytes=5 * 1024 ** 3,
+    refuse_scan_bytes=100 * 1024 ** 3,
+)
+
+# Snowflake, or DuckDB with replayed Analyst answers (SS_BACKEND=local)
+backend = get_backend()
+session = backend.session
+
+# Runs the generated SQL while the rest of a streamed answer arrives
+_sql_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="analyst-sql")
 
 
 def main():
+    set_app("chatbot")
     # Initialize session state
     if "messages" not in st.session_state:
         reset_session_state()
@@ -46,6 +69,10 @@ def reset_session_state():
     st.session_state.form_submitted = (
         {}
     )  # Dictionary to store feedback submission for each request
+    st.session_state.turn_stats = []  # TurnStats of each call to Cortex Analyst
+    if "result_store" in st.session_state:
+        st.session_state.result_store.clear()
+    st.session_state.result_store = ResultStore()  # Bounded results of the generated SQL
 
 
 def show_header_and_sidebar():
@@ -62,6 +89,40 @@ def show_header_and_sidebar():
         _, btn_container, _ = st.columns([2, 6, 2])
         if btn_container.button("Effacer l'historique", use_container_width=True):
             reset_session_state()
+        st.toggle("Réponses en streaming", value=True, key="streaming")
+        display_turn_stats()
+        performance_panel(session, "chatbot")
+
+
+def display_turn_stats():
+    """Request size and latency of the calls to Cortex Analyst."""
+    turn_stats = st.session_state.get("turn_stats", [])
+    answers = answer_cache(session)
+    if not turn_stats and not answers.hits:
+        return
+    with st.expander("Cortex Analyst", expanded=False):
+        col1, col2 = st.columns(2)
+        if turn_stats:
+            last = turn_stats[-1]
+            col1.metric("Requête", f"{last.payload_bytes / 1024:.1f} Ko",
+                        delta=f"-{(last.history_bytes - last.payload_bytes) / 1024:.1f} Ko",
+                        delta_color="off")
+            col2.metric("Latence", f"{last.latency_ms / 1000:.1f} s")
+        col1.metric("Réponses en cache", f"{answers.hit_rate:.0%}")
+        col2.metric("Temps économisé", f"{answers.saved_ms / 1000:.1f} s")
+        store = st.session_state.result_store
+        st.caption(
+            f"{len(store)} résultats : {store.memory_bytes / 1024 ** 2:.1f} Mo en mémoire, "
+            f"{store.spill_bytes / 1024 ** 2:.1f} Mo sur disque"
+        )
+        if turn_stats:
+            st.dataframe(
+                pd.DataFrame([vars(stats) for stats in turn_stats]).drop(columns="question"),
+                use_container_width=True,
+            )
+        warehouse_stats = router_for(session).stats_frame()
+        if not warehouse_stats.empty:
+            st.dataframe(warehouse_stats, hide_index=True, use_container_width=True)
 
 
 def handle_user_inputs():
@@ -92,6 +153,8 @@ def process_user_input(prompt: str):
     """
     # Clear previous warnings at the start of a new request
     st.session_state.warnings = []
+    answers = answer_cache(session)
+    previous_question = last_user_question(st.session_state.messages)
 
     # Create a new message, append to history and display imidiately
     new_user_message = {
@@ -103,30 +166,65 @@ def process_user_input(prompt: str):
         user_msg_index = len(st.session_state.messages) - 1
         display_message(new_user_message["content"], user_msg_index)
 
+    # A question already answered in the same context skips the API call
+    cached = answers.lookup(prompt, previous_question)
+    if cached is not None:
+        st.session_state.messages.append({
+            "role": "analyst",
+            "content": cached.content,
+            "request_id": cached.request_id,
+            "cached": True,
+        })
+        st.session_state.warnings = cached.warnings
+        st.rerun()
+
     # Show progress indicator inside analyst chat message while waiting for response
     with st.chat_message("analyst"):
-        with st.spinner("En attente de la réponse de Cortex Analyst"):
-            time.sleep(1)
-            response, error_msg = get_analyst_response(st.session_state.messages)
-            if error_msg is None:
-                analyst_message = {
-                    "role": "analyst",
-                    "content": response["message"]["content"],
-                    "request_id": response["request_id"],
-                }
-            else:
-                analyst_message = {
-                    "role": "analyst",
-                    "content": [{"type": "text", "text": error_msg}],
-                    "request_id": response["request_id"],
-                }
-                st.session_state["fire_API_error_notify"] = True
+        response = None
+        if st.session_state.get("streaming", True) and not st.session_state.get("streaming_failed"):
+            try:
+                with widget_span(None, "reponse_streaming", cache_probe=False):
+                    response, error_msg = stream_analyst_response(st.session_state.messages)
+            except StreamingUnavailable:
+                # Endpoint unreachable from here: blocking calls for the rest of the session
+                st.session_state.streaming_failed = True
+                st.toast("Streaming indisponible, réponse complète attendue", icon="⚠️")
+        if response is None:
+            with st.spinner("En attente de la réponse de Cortex Analyst"):
+                response, error_msg = get_analyst_response(st.session_state.messages)
+        if error_msg is None:
+            analyst_message = {
+                "role": "analyst",
+                "content": response["message"]["content"],
+                "request_id": response["request_id"],
+            }
+            answers.store(prompt, previous_question, CachedAnswer(
+                content=analyst_message["content"],
+                request_id=analyst_message["request_id"],
+                warnings=response.get("warnings", []),
+                latency_ms=st.session_state.turn_stats[-1].latency_ms,
+            ))
+        else:
+            analyst_message = {
+                "role": "analyst",
+                "content": [{"type": "text", "text": error_msg}],
+                "request_id": response["request_id"],
+            }
+            st.session_state["fire_API_error_notify"] = True
+
+        if "warnings" in response:
+            st.session_state.warnings = response["warnings"]
+
+        st.session_state.messages.append(analyst_message)
+        st.rerun()
 
-            if "warnings" in response:
-                st.session_state.warnings = response["warnings"]
 
-            st.session_state.messages.append(analyst_message)
-            st.rerun()
+def last_user_question(messages: List[Dict]) -> Optional[str]:
+    """Text of the latest user message, None at the start of the conversation."""
+    for message in reversed(messages):
+        if message["role"] == "user":
+            return " ".join(item["text"] for item in message["content"] if item["type"] == "text")
+    return None
 
 
 def display_warnings():
@@ -148,15 +246,13 @@ def get_analyst_response(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
     Returns:
         Optional[Dict]: The response from the Cortex Analyst API.
     """
-    # Prepare the request body with the user's prompt
-    request_body = {
-        "messages": messages,
-        "semantic_view": "SS_101.HARMONIZED.ORDERS_SV"
-    }
+    # Prepare the request body: recent turns verbatim, older ones compacted
+    request_body, size_stats = context.build(messages, {"semantic_view": SEMANTIC_VIEW})
 
     # Send a POST request to the Cortex Analyst API endpoint
     # Adjusted to use positional arguments as per the API's requirement
-    resp = _snowflake.send_snow_api_request(
+    start = time.perf_counter()
+    resp = backend.send_api_request(
         "POST",  # method
         API_ENDPOINT,  # path
         {},  # headers
@@ -165,6 +261,12 @@ def get_analyst_response(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
         None,  # request_guid
         API_TIMEOUT,  # timeout in milliseconds
     )
+    question = messages[-1]["content"][0]["text"]
+    latency_ms = (time.perf_counter() - start) * 1000
+    # Nothing is shown before the whole answer has arrived
+    st.session_state.setdefault("turn_stats", []).append(
+        TurnStats(question=question, latency_ms=latency_ms, first_output_ms=latency_ms, **size_stats)
+    )
 
     # Content is a string with serialized JSON object
     parsed_content = json.loads(resp["content"])
@@ -174,20 +276,112 @@ def get_analyst_response(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
         # Return the content of the response as a JSON object
         return parsed_content, None
     else:
-        # Craft readable error message
-        error_msg = f"""
+        return parsed_content, api_error_message(resp["status"], parsed_content)
+
+
+def api_error_message(status: int, parsed_content: Dict) -> str:
+    """Craft readable error message"""
+    return f"""
 🚨 An Analyst API error has occurred 🚨
 
-* response code: `{resp['status']}`
-* request-id: `{parsed_content['request_id']}`
-* error code: `{parsed_content['error_code']}`
+* response code: `{status}`
+* request-id: `{parsed_content.get('request_id')}`
+* error code: `{parsed_content.get('error_code', parsed_content.get('code'))}`
 
 Message:
 ```
-{parsed_content['message']}
+{parsed_content.get('message')}
 ```
         """
-        return parsed_content, error_msg
+
+
+def timed_query(query: str) -> Tuple[Optional[pd.DataFrame], Optional[str], float]:
+    """get_query_exec_result plus its duration in milliseconds."""
+    start = time.perf_counter()
+    df, err_msg = get_query_exec_result(query)
+    return df, err_msg, (time.perf_counter() - start) * 1000
+
+
+def analyst_stream_target() -> Tuple[str, Dict]:
+    """URL and headers of the streaming Analyst endpoint."""
+    return backend.analyst_stream_target()
+
+
+def stream_analyst_response(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
+    """
+    Stream the answer of Cortex Analyst, rendering text as it arrives.
+
+    The generated SQL starts running as soon as its content item is complete;
+    its result is in the session result store by the time the answer is shown.
+
+    Args:
+        messages (List[Dict]): The conversation history.
+
+    Returns:
+        Tuple[Dict, Optional[str]]: The response, shaped like the non-streamed
+            one, and the error message.
+    """
+    request_body, size_stats = context.build(messages, {"semantic_view": SEMANTIC_VIEW})
+    url, headers = analyst_stream_target()
+    status_box, text_box = st.empty(), st.empty()
+    store = st.session_state.result_store
+    answers = answer_cache(session)
+    stream = StreamedResponse()
+    sql_jobs = {}
+    first_output_ms = None
+
+    def start_sql(indexes):
+        for index in indexes:
+            item = stream.items[index]
+            if item["type"] != "sql" or item["statement"] in store or item["statement"] in sql_jobs:
+                continue
+            cached_df = answers.result(item["statement"])
+            if cached_df is not None:
+                store.put(item["statement"], cached_df)
+            else:
+                # The worker thread keeps the query tag and span of this turn
+                sql_jobs[item["statement"]] = _sql_executor.submit(
+                    contextvars.copy_context().run, timed_query, item["statement"]
+                )
+
+    start = time.perf_counter()
+    try:
+        for event, data in stream_events(url, headers, request_body, API_TIMEOUT / 1000):
+            start_sql(stream.apply(event, data))
+            if stream.status_message and not stream.text:
+                status_box.caption(stream.status_message)
+            if stream.text:
+                if first_output_ms is None:
+                    first_output_ms = (time.perf_counter() - start) * 1000
+                    status_box.empty()
+                text_box.markdown(stream.text + " ▌")
+    except StreamError as e:
+        error = (e.content, api_error_message(e.status, e.content))
+    else:
+        start_sql(stream.finish())
+        if stream.error is not None:
+            error = (
+                {**stream.error, "request_id": stream.error.get("request_id") or stream.request_id},
+                api_error_message(200, stream.error),
+            )
+        else:
+            error = None
+    st.session_state.setdefault("turn_stats", []).append(TurnStats(
+        question=messages[-1]["content"][0]["text"],
+        latency_ms=(time.perf_counter() - start) * 1000,
+        first_output_ms=first_output_ms,
+        **size_stats,
+    ))
+    if error is not None:
+        return error
+
+    for query, job in sql_jobs.items():
+        with st.spinner("Running SQL..."):
+            df, err_msg, exec_ms = job.result()
+        store.put(query, df, err_msg)
+        if df is not None:
+            answers.store_result(query, df, exec_ms)
+    return stream.as_response(), None
 
 
 def display_conversation():
@@ -199,6 +393,8 @@ def display_conversation():
         content = message["content"]
         with st.chat_message(role):
             if role == "analyst":
+                if message.get("cached"):
+                    st.caption("⚡ Réponse servie depuis le cache")
                 display_message(content, idx, message["request_id"])
             else:
                 display_message(content, idx)
@@ -236,7 +432,6 @@ def display_message(
             pass
 
 
-@st.cache_data(show_spinner=False)
 def get_query_exec_result(query: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
     """
     Execute the SQL query and convert the results to a pandas DataFrame.
@@ -249,12 +444,32 @@ def get_query_exec_result(query: str) -> Tuple[Optional[pd.DataFrame], Optional[
     """
     global session
     try:
-        df = session.sql(query).to_pandas()
-        return df, None
-    except SnowparkSQLException as e:
+        return run_guarded(session, query, guardrail_policy, router_for(session))
+    except backend.sql_errors as e:
         return None, str(e)
 
 
+def execute_sql(query: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """
+    Result of the query from the shared answer cache, executed when missing.
+
+    Args:
+        query (str): The SQL query.
+
+    Returns:
+        Tuple[Optional[pd.DataFrame], Optional[str]]: The query results and the error message.
+    """
+    answers = answer_cache(session)
+    df = answers.result(query)
+    if df is not None:
+        return df, None
+    start = time.perf_counter()
+    df, err_msg = get_query_exec_result(query)
+    if df is not None:
+        answers.store_result(query, df, (time.perf_counter() - start) * 1000)
+    return df, err_msg
+
+
 def display_sql_confidence(confidence: dict):
     if confidence is None:
         return
@@ -299,20 +514,34 @@ def display_sql_query(
 
     # Display the results of the SQL query
     with st.expander("Results", expanded=True):
-        with st.spinner("Running SQL..."):
-            df, err_msg = get_query_exec_result(sql)
-            if df is None:
-                st.error(f"Could not execute generated SQL query. Error: {err_msg}")
-            elif df.empty:
-                st.write("Query returned no data")
-            else:
-                # Show query results in two tabs
-                data_tab, chart_tab = st.tabs(["Data 📄", "Chart 📉"])
-                with data_tab:
-                    st.dataframe(df, use_container_width=True)
-
-                with chart_tab:
-                    display_charts_tab(df, message_index)
+        store = st.session_state.result_store
+        is_latest = message_index >= len(st.session_state.messages) - 1
+        # Results evicted from the store are only re-executed on demand
+        run = sql in store or is_latest
+        if not run:
+            st.caption("Résultat libéré de la mémoire de la session.")
+            run = st.button("Réexécuter la requête", key=f"rerun_sql_{message_index}")
+        if run:
+            with st.spinner("Running SQL..."):
+                with widget_span(None, "resultats_sql"):
+                    df, err_msg, _ = store.get(sql, execute_sql)
+                if df is None:
+                    st.error(f"Could not execute generated SQL query. Error: {err_msg}")
+                elif df.empty:
+                    st.write("Query returned no data")
+                else:
+                    if "guardrail" in df.attrs:
+                        note = GuardrailDecision(**df.attrs["guardrail"]).caption()
+                        if note:
+                            st.caption(f"🛡️ {note}")
+                    # Show query results in two tabs
+                    data_tab, chart_tab = st.tabs(["Data 📄", "Chart 📉"])
+                    with data_tab:
+                        # Noms des magasins et produits depuis le référentiel du processus
+                        st.dataframe(reference_data(session).with_names(df), use_container_width=True)
+
+                    with chart_tab:
+                        display_charts_tab(df, message_index)
     if request_id:
         display_feedback_section(request_id)
 
@@ -387,7 +616,7 @@ def submit_feedback(
         "positive": positive,
         "feedback_message": feedback_message,
     }
-    resp = _snowflake.send_snow_api_request(
+    resp = backend.send_api_request(
         "POST",  # method
         FEEDBACK_API_ENDPOINT,  # path
         {},  # headers
@@ -0,0 +1,531 @@
+"""
+Données synthétiques
+====================
+Generates the SPORTS_DB tables at load-test scale: in-store orders
+(INSTORE_SALES_DATA_CRM3), the product catalogue (SPORTS_PRODUCT_CATALOGUE)
+and the loyalty customers (CUSTOMERS), for the stores of SS_STORES.csv.
+
+* Column names, types and sample values come from the semantic models
+  (sports_crm3.yaml, ORDERS_SV.yaml); the relationships of the models decide
+  which order columns reference which table's key.
+* Orders follow a daily intensity per store: weekly pattern plus a seasonal
+  profile per STORE_TYPE (Montagne: winter and summer holidays; Plaine:
+  Christmas, sales and back to school). Seasonal categories (ski, hiking...)
+  weigh more in their season.
+* Work units (one month x a group of stores, at most `chunk_rows` lines) run
+  in worker processes and write one Parquet file each under
+  orders/SALE_MONTH=YYYY-MM/, so memory stays bounded by the chunk size.
+
+Identifiers are derived from integer indexes (splitmix64), so workers need
+no shared state: the customer ids drawn by the order workers are the ones
+written by the customer workers.
+
+Usage:
+    python synthetic_data.py --rows 20M --output data/sports_db --workers 8
+"""
+import argparse
+import math
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATHS = [os.path.join(HERE, "sports_crm3.yaml"), os.path.join(HERE, "ORDERS_SV.yaml")]
+STORES_CSV = os.path.join(HERE, "SS_STORES.csv")
+
+ORDERS, CATALOGUE, CUSTOMERS = "INSTORE_SALES_DATA_CRM3", "SPORTS_PRODUCT_CATALOGUE", "CUSTOMERS"
+
+# Columns used by SUMMIT_SPORTS.ipynb but missing from the semantic models
+EXTRA_COLUMNS = {
+    ORDERS: {"DISCOUNT_AMOUNT_EURO": "FLOAT"},
+    CATALOGUE: {"SALE_PRICE": "NUMBER(38,2)"},
+    CUSTOMERS: {
+        "CUSTOMER_ID": "VARCHAR", "FIRST_NAME": "VARCHAR", "LAST_NAME": "VARCHAR", "EMAIL": "VARCHAR",
+        "PHONE": "VARCHAR", "REGISTRATION_DATE": "DATE", "PREFERRED_STORE": "VARCHAR", "MARKETING_OPT_IN": "BOOLEAN",
+    },
+}
+
+# Three sample values per column are too few for realistic cardinalities
+EXTRA_VALUES = {
+    "BRAND": ["Quechua", "Kipsta", "Kalenji", "Rockrider", "Tribord", "Artengo", "The North Face", "Columbia"],
+    "COLOUR": ["Navy", "Red", "White", "Khaki", "Blue", "Green", "Orange"],
+    "PRODUCT_CATEGORY": ["Ski Jackets", "Ski Goggles", "Snowboards", "Hiking Shoes", "Tents", "Swimwear",
+                         "Running Shoes", "Bikes", "Men's Thermal Underwear", "Kids' Ski Pants", "Fitness Mats"],
+    "PAYMENT_METHOD": ["Credit Card", "Mobile Payment"],
+    "FIRST_NAME": ["Louis", "Hugo", "Camille", "Léa", "Jules", "Chloé", "Lucas", "Manon", "Nathan", "Inès"],
+    "LAST_NAME": ["Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand", "Leroy", "Moreau"],
+}
+
+# Seasonal bumps per store type, added to 1 (circular Gaussians on the day of year)
+SEASONS = {
+    "winter": (35, 40),  # (centre day of year, width in days)
+    "summer": (205, 25),
+    "christmas": (354, 8),
+    "sales": (15, 10),
+    "back_to_school": (248, 10),
+}
+SEASONALITY = {
+    "Montagne": {"winter": 2.5, "summer": 0.8, "christmas": 1.0, "weekend": 0.25},
+    "Plaine": {"christmas": 0.9, "sales": 0.4, "back_to_school": 0.4, "summer": -0.2, "weekend": 0.6},
+}
+WINTER_CATEGORIES = re.compile(r"ski|snow|thermal|glove|jacket|goggle|sock", re.IGNORECASE)
+SUMMER_CATEGORIES = re.compile(r"soccer|hiking|tent|swim|bike|running|shirt", re.IGNORECASE)
+
+AUDIENCE_PREFIXES = [("women", "WOM"), ("men", "MEN"), ("kid", "KID"), ("fitness", "FIT")]
+LINES_PER_ORDER = 1 + 3 * 0.35  # 1 + Binomial(3, 0.35)
+HOME_STORE_SHARE = 0.8  # orders placed by customers of the store
+ASSISTANTS_PER_STORE = 20
+DEFAULT_CHUNK_ROWS = 1_000_000
+CUSTOMER_CHUNK = 500_000
+
+ORDER_NS, CUSTOMER_NS, CARD_NS = 1, 2, 3
+
+
+@dataclass
+class Column:
+    name: str
+    data_type: str
+    samples: List[str] = field(default_factory=list)
+
+    @property
+    def arrow_type(self) -> pa.DataType:
+        return arrow_type(self.data_type)
+
+
+@dataclass
+class Relationship:
+    left_table: str
+    left_column: str
+    right_table: str
+    right_column: str
+
+
+def arrow_type(data_type: str) -> pa.DataType:
+    """Snowflake type -> Arrow; NUMBER(p, 0) as int64, like Snowpark's to_pandas"""
+    data_type = data_type.upper().replace(" ", "")
+    number = re.match(r"NUMBER\((\d+),(\d+)\)", data_type)
+    if number:
+        precision, scale = int(number.group(1)), int(number.group(2))
+        return pa.int64() if scale == 0 else pa.decimal128(precision, scale)
+    if data_type.startswith(("FLOAT", "DOUBLE", "REAL")):
+        return pa.float64()
+    if data_type == "DATE":
+        return pa.date32()
+    if data_type == "BOOLEAN":
+        return pa.bool_()
+    if data_type.startswith("TIMESTAMP"):
+        return pa.timestamp("ns")
+    return pa.string()
+
+
+class Model:
+    """Tables, columns and relationships of the semantic models"""
+
+    def __init__(self, paths: List[str] = MODEL_PATHS):
+        self.tables: Dict[str, Dict[str, Column]] = {}
+        self.relationships: List[Relationship] = []
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                spec = yaml.safe_load(f)
+            for table in spec.get("tables", []):
+                columns = self.tables.setdefault(table["name"].upper(), {})
+                for kind in ("dimensions", "time_dimensions", "facts"):
+                    for item in table.get(kind) or []:
+                        columns[item["name"].upper()] = Column(
+                            item["name"].upper(),
+                            item.get("data_type", "VARCHAR"),
+                            [str(v).strip() for v in item.get("sample_values") or []],
+                        )
+            for rel in spec.get("relationships") or []:
+                for pair in rel["relationship_columns"]:
+                    self.relationships.append(Relationship(
+                        rel["left_table"].upper(), pair["left_column"].upper(),
+                        rel["right_table"].upper(), pair["right_column"].upper(),
+                    ))
+        for table, extra in EXTRA_COLUMNS.items():
+            columns = self.tables.setdefault(table, {})
+            for name, data_type in extra.items():
+                columns.setdefault(name, Column(name, data_type))
+        # The loyalty customers are the rows CRM_INDEXED_AGGREGATED aggregates
+        for name, column in self.tables.get("CRM_INDEXED_AGGREGATED", {}).items():
+            if name in self.tables[CUSTOMERS]:
+                self.tables[CUSTOMERS][name] = Column(name, column.data_type, column.samples)
+
+    def schema(self, table: str) -> pa.Schema:
+        return pa.schema([(c.name, c.arrow_type) for c in self.tables[table].values()])
+
+    def values(self, column: str) -> List[str]:
+        """Sample values of `column` across all tables, widened with EXTRA_VALUES"""
+        values = []
+        for columns in self.tables.values():
+            if column in columns:
+                values += [v for v in columns[column].samples if v not in values]
+        return values + [v for v in EXTRA_VALUES.get(column, []) if v not in values]
+
+    def reference(self, table: str, column: str) -> Optional[Tuple[str, str]]:
+        """(table, key) referenced by `table`.`column`, if a relationship says so"""
+        for rel in self.relationships:
+            if rel.left_table == table and rel.left_column == column:
+                return rel.right_table, rel.right_column
+        return None
+
+
+# ---------------------------------------------------------------- identifiers
+
+_HEX = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_UUID_DIGITS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        z = x + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _fixed_strings(chars: np.ndarray) -> pa.Array:
+    """(n, width) uint8 ASCII -> Arrow string array, without Python objects"""
+    n, width = chars.shape
+    offsets = np.arange(0, (n + 1) * width, width, dtype=np.int32)
+    return pa.StringArray.from_buffers(n, pa.py_buffer(offsets), pa.py_buffer(np.ascontiguousarray(chars)))
+
+
+def uuids(namespace: int, index: np.ndarray, seed: int = 0) -> pa.Array:
+    """UUID-shaped ids, the same for the same (namespace, index, seed)"""
+    index = np.asarray(index, dtype=np.uint64)
+    hi = _splitmix64(index ^ _splitmix64(np.uint64([namespace * 1_000_003 + seed]))[0])
+    lo = _splitmix64(hi)
+    raw = np.stack([hi, lo], axis=1).astype(">u8").view(np.uint8).reshape(-1, 16)
+    digits = np.empty((len(index), 32), dtype=np.uint8)
+    digits[:, 0::2] = _HEX[raw >> 4]
+    digits[:, 1::2] = _HEX[raw & 15]
+    chars = np.full((len(index), 36), ord("-"), dtype=np.uint8)
+    chars[:, _UUID_DIGITS] = digits
+    return _fixed_strings(chars)
+
+
+def _take(values, codes: np.ndarray) -> pa.Array:
+    return pc.take(pa.array(values, type=pa.string()), pa.array(codes))
+
+
+# ---------------------------------------------------------------- seasonality
+
+def seasonal_profile(store_type: str, days: pd.DatetimeIndex) -> np.ndarray:
+    """Relative daily intensity of a store type"""
+    profile = SEASONALITY.get(store_type, {})
+    doy = days.dayofyear.to_numpy()
+    intensity = np.ones(len(days))
+    for season, (centre, width) in SEASONS.items():
+        if season in profile:
+            distance = (doy - centre + 182) % 365 - 182
+            intensity += profile[season] * np.exp(-0.5 * (distance / width) ** 2)
+    weekend = days.dayofweek.to_numpy() >= 5
+    return np.clip(intensity, 0.05, None) * (1 + profile.get("weekend", 0.0) * weekend)
+
+
+def season_weight(days: pd.DatetimeIndex, season: str) -> float:
+    """Mean strength of a season over `days`, in [0, 1]"""
+    centre, width = SEASONS[season]
+    distance = (days.dayofyear.to_numpy() - centre + 182) % 365 - 182
+    return float(np.exp(-0.5 * (distance / width) ** 2).mean())
+
+
+# ---------------------------------------------------------------- dimensions
+
+def load_stores(path: str = STORES_CSV) -> pd.DataFrame:
+    return pd.read_csv(path, dtype=str).sort_values("STOREID").reset_index(drop=True)
+
+
+def _prefix(category: str) -> str:
+    lowered = category.lower()
+    for word, prefix in AUDIENCE_PREFIXES:
+        if lowered.startswith(word) or f" {word}" in lowered:
+            return prefix
+    return "ACC"
+
+
+def build_catalogue(model: Model, n_products: int, seed: int) -> pa.Table:
+    rng = np.random.default_rng([seed, 0])
+    brands, colours, categories = model.values("BRAND"), model.values("COLOUR"), model.values("PRODUCT_CATEGORY")
+    category = rng.integers(0, len(categories), n_products)
+    brand = rng.integers(0, len(brands), n_products)
+    colour = rng.integers(0, len(colours), n_products)
+    mrp = np.round(np.exp(rng.normal(3.5, 0.9, n_products)), 2).clip(2.99, 1999.99)
+    sale_price = np.round(mrp * rng.choice([1.0, 1.0, 0.9, 0.8, 0.7], n_products), 2)
+    names = [f"{brands[b]} {categories[c]} {i:04d}" for i, (b, c) in enumerate(zip(brand, category))]
+    columns = {
+        "PRODUCT_NAME": pa.array(names),
+        "BRAND": _take(brands, brand),
+        "COLOUR": _take(colours, colour),
+        "DESCRIPTION": pa.array([f"{name} | {categories[c]} by {brands[b]}." for name, b, c in zip(names, brand, category)]),
+        "PRODUCT_CATEGORY": _take(categories, category),
+        "PRODUCTID": pa.array([f"{_prefix(categories[c])}-{1000 + i}" for i, c in enumerate(category)]),
+        "STAR_RATING": pa.array(np.round(rng.uniform(3.5, 5.0, n_products), 1)),
+        "NUMBER_OF_REVIEWS": pa.array(rng.integers(0, 10_000, n_products)),
+        "MRP": pa.array(mrp),
+        "SALE_PRICE": pa.array(sale_price),
+    }
+    schema = model.schema(CATALOGUE)
+    return pa.table([columns[name].cast(schema.field(name).type) for name in schema.names], schema=schema)
+
+
+def customer_store(index: np.ndarray, n_stores: int) -> np.ndarray:
+    """Preferred store (position in load_stores()) of each customer index"""
+    return index % n_stores
+
+
+def build_customers(model: Model, lo: int, hi: int, stores: List[str], seed: int) -> pa.Table:
+    rng = np.random.default_rng([seed, 1, lo])
+    index = np.arange(lo, hi, dtype=np.int64)
+    n = len(index)
+    first_names, last_names = model.values("FIRST_NAME"), model.values("LAST_NAME")
+    first = rng.integers(0, len(first_names), n)
+    last = rng.integers(0, len(last_names), n)
+    emails = pc.binary_join_element_wise(
+        pc.utf8_lower(_take(first_names, first)), pc.utf8_lower(_take(last_names, last)),
+        pa.array(index.astype(str)), ".",
+    )
+    columns = {
+        "CUSTOMER_ID": uuids(CUSTOMER_NS, index, seed),
+        "FIRST_NAME": _take(first_names, first),
+        "LAST_NAME": _take(last_names, last),
+        "EMAIL": pc.binary_join_element_wise(pc.replace_substring(emails, " ", ""), "example.org", "@"),
+        "PHONE": pa.array([f"+33 6 {p // 10**6 % 100:02d} {p // 10**4 % 100:02d} {p // 100 % 100:02d} {p % 100:02d}"
+                           for p in rng.integers(0, 10**8, n)]),
+        "REGISTRATION_DATE": pa.array(
+            (np.datetime64("2004-01-01") + rng.integers(0, 365 * 20, n).astype("timedelta64[D]"))
+        ),
+        "PREFERRED_STORE": _take(stores, customer_store(index, len(stores))),
+        "MARKETING_OPT_IN": pa.array(rng.random(n) < 0.6),
+    }
+    schema = model.schema(CUSTOMERS)
+    return pa.table([columns[name].cast(schema.field(name).type) for name in schema.names], schema=schema)
+
+
+# ---------------------------------------------------------------- orders
+
+@dataclass
+class OrderUnit:
+    """Orders of a group of stores over one month, written to one file"""
+    unit: int
+    month: str
+    days: pd.DatetimeIndex
+    stores: np.ndarray  # positions in load_stores()
+    intensity: np.ndarray  # expected orders, (stores, days)
+
+
+@dataclass
+class GeneratorContext:
+    """What every worker needs; small enough to send with each task"""
+    model: Model
+    store_ids: List[str]
+    store_names: List[str]
+    store_types: List[str]
+    product_ids: List[str]
+    product_categories: List[str]
+    sale_prices: np.ndarray
+    popularity: np.ndarray
+    n_customers: int
+    seed: int
+    output: str
+
+
+def _category_weights(ctx: GeneratorContext, store_type: str, days: pd.DatetimeIndex) -> np.ndarray:
+    """Product probabilities for one store type over one month"""
+    boost = {"Montagne": 2.0}.get(store_type, 0.5)
+    winter = season_weight(days, "winter") + season_weight(days, "christmas")
+    summer = season_weight(days, "summer")
+    seasonal = np.array([
+        1 + boost * winter if WINTER_CATEGORIES.search(c) else 1 + boost * summer if SUMMER_CATEGORIES.search(c) else 1.0
+        for c in ctx.product_categories
+    ])
+    weights = ctx.popularity * seasonal
+    return weights / weights.sum()
+
+
+def _orders_table(ctx: GeneratorContext, task: OrderUnit) -> pa.Table:
+    rng = np.random.default_rng([ctx.seed, 2, task.unit])
+    n_stores = len(ctx.store_ids)
+
+    counts = rng.poisson(task.intensity).ravel()  # orders per (store, day)
+    store_of_order = np.repeat(np.repeat(task.stores, len(task.days)), counts)
+    day_of_order = np.repeat(np.tile(task.days.to_numpy().astype("datetime64[D]"), len(task.stores)), counts)
+    n_orders = len(store_of_order)
+
+    # Most customers shop at their preferred store (customer index % n_stores)
+    per_store = math.ceil(ctx.n_customers / n_stores)
+    home = store_of_order + n_stores * rng.integers(0, per_store, n_orders)
+    customer = np.where((rng.random(n_orders) < HOME_STORE_SHARE) & (home < ctx.n_customers),
+                        home, rng.integers(0, ctx.n_customers, n_orders))
+    payment = rng.integers(0, len(ctx.model.values("PAYMENT_METHOD")), n_orders)
+    assistant = store_of_order * ASSISTANTS_PER_STORE + rng.integers(0, ASSISTANTS_PER_STORE, n_orders)
+
+    lines = 1 + rng.binomial(3, 0.35, n_orders)
+    order = np.repeat(np.arange(n_orders, dtype=np.uint64), lines)
+    store = store_of_order[order]
+    n_lines = len(order)
+
+    product = np.empty(n_lines, dtype=np.int64)
+    for store_type in set(ctx.store_types):
+        mask = np.array([ctx.store_types[s] == store_type for s in range(n_stores)])[store]
+        product[mask] = rng.choice(len(ctx.product_ids), mask.sum(),
+                                   p=_category_weights(ctx, store_type, task.days))
+    quantity = rng.geometric(0.6, n_lines)
+    sales_price = np.round(ctx.sale_prices[product] * quantity, 2)
+    discounted = rng.random(n_lines) < 0.15
+    discount = np.where(discounted, np.round(sales_price * rng.uniform(0.1, 0.2, n_lines), 2), 0.0)
+
+    order_index = (np.uint64(task.unit) << np.uint64(32)) + order
+    customer_of_line = customer[order]
+    columns = {
+        "ORDER_ID": uuids(ORDER_NS, order_index, ctx.seed),
+        "STOREID": _take(ctx.store_ids, store),
+        "STORE_NAME": _take(ctx.store_names, store),
+        "PRODUCT_ID": _take(ctx.product_ids, product),
+        "PAYMENT_METHOD": _take(ctx.model.values("PAYMENT_METHOD"), payment[order]),
+        "SALES_ASSISTANT_ID": pc.binary_join_element_wise("ASSISTANT_", pa.array(assistant[order].astype(str)), ""),
+        "CUSTOMER_ID": uuids(CUSTOMER_NS, customer_of_line, ctx.seed),
+        "CARD_ID": uuids(CARD_NS, customer_of_line, ctx.seed),
+        "SALE_DATE": pa.array(day_of_order[order]),
+        "QUANTITY": pa.array(quantity),
+        "SALES_PRICE_EURO": pa.array(sales_price),
+        "DISCOUNT_AMOUNT_EURO": pa.array(discount),
+    }
+    schema = ctx.model.schema(ORDERS)
+    return pa.table([columns[name].cast(schema.field(name).type) for name in schema.names], schema=schema)
+
+
+def _write(table: pa.Table, directory: str, name: str) -> int:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    pq.write_table(table, path, compression="zstd")
+    return os.path.getsize(path)
+
+
+def _run_orders(args) -> Tuple[int, int]:
+    ctx, task = args
+    table = _orders_table(ctx, task)
+    directory = os.path.join(ctx.output, "orders", f"SALE_MONTH={task.month}")
+    return table.num_rows, _write(table, directory, f"part-{task.unit:06d}.parquet")
+
+
+def _run_customers(args) -> Tuple[int, int]:
+    ctx, lo, hi = args
+    table = build_customers(ctx.model, lo, hi, ctx.store_ids, ctx.seed)
+    return table.num_rows, _write(table, os.path.join(ctx.output, "customers"), f"part-{lo // CUSTOMER_CHUNK:06d}.parquet")
+
+
+def plan_orders(stores: pd.DataFrame, rows: int, start: date, end: date, chunk_rows: int, seed: int) -> List[OrderUnit]:
+    """Split the intensity of every (store, day) into month x store-group units"""
+    rng = np.random.default_rng([seed, 3])
+    days = pd.date_range(start, end, freq="D")
+    size = np.exp(rng.normal(0, 0.5, len(stores)))[:, None]
+    intensity = size * np.vstack([seasonal_profile(t, days) for t in stores["STORE_TYPE"]])
+    intensity *= rows / LINES_PER_ORDER / intensity.sum()
+
+    units = []
+    for month, positions in pd.Series(np.arange(len(days))).groupby(days.to_period("M")).groups.items():
+        month_days = days[positions]
+        month_intensity = intensity[:, positions]
+        lines = month_intensity.sum(axis=1) * LINES_PER_ORDER
+        group, group_lines = [], 0.0
+        for s in range(len(stores)):
+            if group and group_lines + lines[s] > chunk_rows:
+                units.append(OrderUnit(len(units), str(month), month_days, np.array(group), month_intensity[group]))
+                group, group_lines = [], 0.0
+            group.append(s)
+            group_lines += lines[s]
+        units.append(OrderUnit(len(units), str(month), month_days, np.array(group), month_intensity[group]))
+    return units
+
+
+def generate(output: str, rows: int, start: date, end: date, n_customers: Optional[int] = None,
+             n_products: int = 5_000, workers: Optional[int] = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+             seed: int = 0, model: Optional[Model] = None) -> Dict[str, int]:
+    """
+    Write orders/, catalogue/ and customers/ Parquet datasets under `output`.
+
+    Returns:
+        Dict[str, int]: Rows and bytes written per dataset, and the seconds taken.
+    """
+    started = time.perf_counter()
+    model = model or Model()
+    stores = load_stores()
+    n_customers = n_customers or max(1_000, rows // 20)
+    for table, column in ((ORDERS, "CUSTOMER_ID"), (ORDERS, "PRODUCT_ID")):
+        if model.reference(table, column) is None:
+            raise ValueError(f"Aucune relation pour {table}.{column} dans les modèles sémantiques")
+
+    catalogue = build_catalogue(model, n_products, seed)
+    catalogue_bytes = _write(catalogue, os.path.join(output, "catalogue"), "part-000000.parquet")
+    popularity = np.random.default_rng([seed, 4]).pareto(1.5, n_products) + 0.1
+    ctx = GeneratorContext(
+        model=model,
+        store_ids=stores["STOREID"].tolist(),
+        store_names=stores["STORE_NAME"].tolist(),
+        store_types=stores["STORE_TYPE"].tolist(),
+        product_ids=catalogue["PRODUCTID"].to_pylist(),
+        product_categories=catalogue["PRODUCT_CATEGORY"].to_pylist(),
+        sale_prices=catalogue["SALE_PRICE"].cast(pa.float64()).to_numpy(),
+        popularity=popularity,
+        n_customers=n_customers,
+        seed=seed,
+        output=output,
+    )
+    units = plan_orders(stores, rows, start, end, chunk_rows, seed)
+    customer_chunks = [(ctx, lo, min(n_customers, lo + CUSTOMER_CHUNK)) for lo in range(0, n_customers, CUSTOMER_CHUNK)]
+
+    report = {"catalogue_rows": catalogue.num_rows, "catalogue_bytes": catalogue_bytes,
+              "orders_rows": 0, "orders_bytes": 0, "customers_rows": 0, "customers_bytes": 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for n, nbytes in pool.map(_run_customers, customer_chunks):
+            report["customers_rows"] += n
+            report["customers_bytes"] += nbytes
+        for n, nbytes in pool.map(_run_orders, [(ctx, unit) for unit in units]):
+            report["orders_rows"] += n
+            report["orders_bytes"] += nbytes
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def parse_rows(text: str) -> int:
+    """'1M' -> 1_000_000, '250k' -> 250_000"""
+    text = text.strip().upper().replace("_", "")
+    scale = {"K": 1_000, "M": 1_000_000, "G": 1_000_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("KMG")) * scale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1M", help="order lines, e.g. 20M")
+    parser.add_argument("--output", default=os.path.join("data", "sports_db"))
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2023, 1, 1))
+    parser.add_argument("--end", type=date.fromisoformat, default=date(2024, 12, 31))
+    parser.add_argument("--customers", type=int, help="loyalty customers (default: rows / 20)")
+    parser.add_argument("--products", type=int, default=5_000)
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="order lines per file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = generate(args.output, parse_rows(args.rows), args.start, args.end, args.customers,
+                      args.products, args.workers, args.chunk_rows, args.seed)
+    for name in ("orders", "customers", "catalogue"):
+        print(f"{name:>10}: {report[f'{name}_rows']:>12,} lignes, {report[f'{name}_bytes'] / 1024 ** 2:>8.1f} Mo")
+    print(f"{report['seconds']:.1f} s, {report['orders_rows'] / report['seconds'] * 60 / 1e6:.1f} M lignes/min")
+
+
+if __name__ == "__main__":
+    main()
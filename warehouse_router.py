@@ -0,0 +1,320 @@
+"""
+Routage des entrepôts
+=====================
+Classifies each query (point KPI, group-by aggregate, full scan, AI
+function) and runs it on the warehouse provisioned for that class by
+ss0_setup.sql and SUMMIT_SPORTS.ipynb, so small dashboard queries do not
+queue behind heavy scans or AI_COMPLETE calls.
+
+With a `session_factory`, every warehouse gets its own Snowpark session.
+Otherwise (Streamlit in Snowflake, one session per app) the shared session
+switches warehouse only while a query is *submitted* (async), under a lock,
+and switches back right after: execution itself never holds the lock.
+Statements that must run on the shared session as it is (transactions,
+writes, metadata lookups) hold the same lock through pinned().
+
+Latency and estimated credits are kept per class; every query carries the
+QUERY_TAG of query_trace and is recorded in the current widget span.
+"""
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import query_trace
+
+POINT_KPI, AGGREGATE, FULL_SCAN, AI_FUNCTION = "point_kpi", "aggregate", "full_scan", "ai_function"
+
+DEFAULT_ROUTES = {
+    POINT_KPI: "SS_DEV_WH",
+    AGGREGATE: "SS_DEV_WH",
+    FULL_SCAN: "SS_DE_WH",
+    AI_FUNCTION: "SS_DATASCIENCE",
+}
+
+FULL_SCAN_BYTES = 1024 ** 3  # EXPLAIN estimate above which a query is a full scan
+POINT_LIMIT = 1_000  # a LIMIT at most this large makes a point query
+
+CREDITS_PER_HOUR = {
+    "X-SMALL": 1, "SMALL": 2, "MEDIUM": 4, "LARGE": 8, "X-LARGE": 16,
+    "2X-LARGE": 32, "3X-LARGE": 64, "4X-LARGE": 128, "5X-LARGE": 256, "6X-LARGE": 512,
+}
+SNOWPARK_OPTIMIZED_FACTOR = 1.5
+
+_AI = re.compile(r"\b(AI_[A-Z_]+|SNOWFLAKE\.CORTEX\.\w+)\s*\(", re.IGNORECASE)
+_GROUP = re.compile(r"\bGROUP\s+BY\b|\bGROUPING\s+SETS\b|\bROLLUP\s*\(|\bCUBE\s*\(", re.IGNORECASE)
+_AGGREGATE = re.compile(r"\b(SUM|COUNT|AVG|MIN|MAX|MEDIAN|APPROX_COUNT_DISTINCT)\s*\(", re.IGNORECASE)
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_LIMIT = re.compile(r"\bLIMIT\s+(\d+)", re.IGNORECASE)
+
+
+def classify(sql: str, scan_bytes: Optional[int] = None) -> str:
+    """
+    Query class from the SQL text, refined by an EXPLAIN estimate when known.
+
+    Filtered reads without GROUP BY or small LIMIT count as aggregates: they
+    stay on the interactive warehouse unless the estimate says otherwise.
+    """
+    if _AI.search(sql):
+        return AI_FUNCTION
+    if scan_bytes is not None and scan_bytes > FULL_SCAN_BYTES:
+        return FULL_SCAN
+    if _GROUP.search(sql):
+        return AGGREGATE
+    if _AGGREGATE.search(sql):
+        return POINT_KPI
+    limits = [int(n) for n in _LIMIT.findall(sql)]
+    if limits and limits[-1] <= POINT_LIMIT:
+        return POINT_KPI
+    if _WHERE.search(sql):
+        return AGGREGATE
+    return FULL_SCAN
+
+
+@dataclass
+class RouteStats:
+    query_class: str
+    warehouse: str
+    queries: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    credits: float = 0.0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=500))
+
+
+class RoutedJob:
+    """AsyncJob recording its latency in the router once its result is read"""
+
+    def __init__(self, job, router, query_class: str, warehouse: str):
+        self._job = job
+        self._router = router
+        self._query_class = query_class
+        self._warehouse = warehouse
+        self._start = time.perf_counter()
+        self._recorded = False
+
+    @property
+    def query_id(self):
+        return self._job.query_id
+
+    def is_done(self) -> bool:
+        return self._job.is_done()
+
+    def cancel(self):
+        self._job.cancel()
+
+    def result(self, result_type: Optional[str] = None):
+        failed = True
+        try:
+            value = self._job.result() if result_type is None else self._job.result(result_type)
+            failed = False
+            return value
+        finally:
+            if not self._recorded:
+                self._recorded = True
+                self._router.record(
+                    self._query_class, self._warehouse, time.perf_counter() - self._start, failed,
+                    query_id=self._job.query_id, result=None if failed else value,
+                )
+
+
+class WarehouseRouter:
+    def __init__(
+        self,
+        session,
+        routes: Optional[Dict[str, str]] = None,
+        session_factory: Optional[Callable[[str], object]] = None,
+    ):
+        self.session = session
+        self.routes = dict(DEFAULT_ROUTES, **(routes or {}))
+        self.session_factory = session_factory
+        self._sessions = {}  # warehouse -> own session, with a session_factory
+        # Reentrant: a thread may route (or look up a rate) while it holds pinned()
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, RouteStats] = {}
+        self._rates: Dict[str, float] = {}  # warehouse -> credits per second
+
+    def warehouse_for(self, query_class: str) -> str:
+        return self.routes[query_class]
+
+    def _own_session(self, warehouse: str):
+        with self._lock:
+            if warehouse not in self._sessions:
+                self._sessions[warehouse] = self.session_factory(warehouse)
+            return self._sessions[warehouse]
+
+    def _submit(self, warehouse: str, submit, own_session_ok: bool = True):
+        """submit(session) on `warehouse`, switching the shared session only for the submission"""
+        if self.session_factory is not None and own_session_ok:
+            return submit(self._own_session(warehouse))
+        with self._lock:
+            previous = self.session.get_current_warehouse()
+            self.session.use_warehouse(warehouse)
+            try:
+                return submit(self.session)
+            finally:
+                if previous:
+                    self.session.use_warehouse(previous)
+
+    @contextmanager
+    def pinned(self):
+        """
+        Shared session whose warehouse no routed submission switches while the block runs.
+
+        For statements run directly on the session (transactions, writes)
+        while other threads route queries. Queries routed from inside the
+        block by the same thread switch the warehouse for their submission
+        only, as anywhere else.
+        """
+        with self._lock:
+            yield self.session
+
+    def collect_nowait(self, sql: str, query_class: Optional[str] = None, scan_bytes: Optional[int] = None,
+                       params: Optional[Sequence] = None) -> RoutedJob:
+        """Start `sql` (with bind `params`) on its warehouse; same interface as Snowpark's AsyncJob"""
+        query_class = query_class or classify(sql, scan_bytes)
+        warehouse = self.warehouse_for(query_class)
+        tags = query_trace.statement_params()
+        job = self._submit(
+            warehouse, lambda session: session.sql(sql, params=params).collect_nowait(statement_params=tags)
+        )
+        return RoutedJob(job, self, query_class, warehouse)
+
+    def to_pandas(self, query, query_class: Optional[str] = None, scan_bytes: Optional[int] = None,
+                  params: Optional[Sequence] = None) -> pd.DataFrame:
+        """Run SQL text or a Snowpark DataFrame on its warehouse and return a pandas DataFrame"""
+        if isinstance(query, str):
+            return self.collect_nowait(query, query_class, scan_bytes, params).result("pandas")
+        query_class = query_class or classify(query.queries["queries"][-1], scan_bytes)
+        warehouse = self.warehouse_for(query_class)
+        params = query_trace.statement_params()
+        # A Snowpark DataFrame is bound to the session that built it
+        job = self._submit(
+            warehouse, lambda session: query.to_pandas(block=False, statement_params=params), own_session_ok=False
+        )
+        return RoutedJob(job, self, query_class, warehouse).result()
+
+    def collect(self, query, query_class: Optional[str] = None, scan_bytes: Optional[int] = None):
+        """Rows of a Snowpark DataFrame, run on its warehouse"""
+        query_class = query_class or classify(query.queries["queries"][-1], scan_bytes)
+        warehouse = self.warehouse_for(query_class)
+        params = query_trace.statement_params()
+        job = self._submit(
+            warehouse, lambda session: query.collect_nowait(statement_params=params), own_session_ok=False
+        )
+        return RoutedJob(job, self, query_class, warehouse).result()
+
+    @contextmanager
+    def cursor(self, sql: str, query_class: Optional[str] = None, scan_bytes: Optional[int] = None):
+        """Connector cursor holding the results of `sql`, run on its warehouse"""
+        query_class = query_class or classify(sql, scan_bytes)
+        warehouse = self.warehouse_for(query_class)
+        params = query_trace.statement_params()
+        start = time.perf_counter()
+        failed = True
+        if self.session_factory is not None:
+            cursor = self._own_session(warehouse).connection.cursor()
+        else:
+            cursor = self.session.connection.cursor()
+        try:
+            if self.session_factory is not None:
+                cursor.execute(sql, _statement_params=params)
+            else:
+                with self._lock:
+                    previous = self.session.get_current_warehouse()
+                    cursor.execute(f"USE WAREHOUSE {warehouse}")
+                    try:
+                        query_id = cursor.execute_async(sql, _statement_params=params)["queryId"]
+                    finally:
+                        if previous:
+                            cursor.execute(f"USE WAREHOUSE {previous}")
+                cursor.get_results_from_sfqid(query_id)
+            yield cursor
+            failed = False
+        finally:
+            query_id = cursor.sfqid
+            cursor.close()
+            self.record(query_class, warehouse, time.perf_counter() - start, failed, query_id=query_id)
+
+    def _credits_per_second(self, warehouse: str) -> float:
+        if warehouse not in self._rates:
+            per_hour = 1.0
+            try:
+                with self.pinned() as session:
+                    rows = session.sql(f"SHOW WAREHOUSES LIKE '{warehouse}'").collect()
+                if rows:
+                    size = str(rows[0]["size"]).upper().replace("XSMALL", "X-SMALL")
+                    per_hour = CREDITS_PER_HOUR.get(size, 1.0)
+                    if "SNOWPARK" in str(rows[0]["type"]).upper():
+                        per_hour *= SNOWPARK_OPTIMIZED_FACTOR
+            except Exception:
+                # Without SHOW privileges, count an X-Small
+                pass
+            self._rates[warehouse] = per_hour / 3600
+        return self._rates[warehouse]
+
+    def record(self, query_class: str, warehouse: str, seconds: float, failed: bool = False,
+               query_id: Optional[str] = None, result=None):
+        """Wall time includes queueing and fetch: credits are an upper estimate"""
+        query_trace.record_query(query_id, warehouse, query_class, seconds, result, failed)
+        rate = self._credits_per_second(warehouse)
+        with self._stats_lock:
+            stats = self._stats.setdefault(query_class, RouteStats(query_class, warehouse))
+            stats.queries += 1
+            stats.errors += int(failed)
+            stats.seconds += seconds
+            stats.credits += seconds * rate
+            stats.latencies.append(seconds)
+
+    def stats_frame(self) -> pd.DataFrame:
+        """Per-class summary for st.dataframe"""
+        with self._stats_lock:
+            rows = [{
+                "CLASSE": stats.query_class,
+                "ENTREPOT": stats.warehouse,
+                "REQUETES": stats.queries,
+                "ERREURS": stats.errors,
+                "P50_MS": float(np.percentile(stats.latencies, 50) * 1000) if stats.latencies else None,
+                "P95_MS": float(np.percentile(stats.latencies, 95) * 1000) if stats.latencies else None,
+                "CREDITS_ESTIMES": stats.credits,
+            } for stats in self._stats.values()]
+        return pd.DataFrame(rows)
+
+
+_routers_lock = threading.Lock()
+
+
+def router_for(session) -> WarehouseRouter:
+    """
+    The WarehouseRouter of `session`, shared by every thread of the process.
+
+    Held on the session itself, so it goes away with it and a new session
+    never inherits the router of a dead one.
+    """
+    with _routers_lock:
+        router = getattr(session, "_warehouse_router", None)
+        if router is None:
+            router = session._warehouse_router = WarehouseRouter(session)
+        return router
+
+
+@contextmanager
+def session_cursor(session, sql: str, router: Optional[WarehouseRouter] = None):
+    """Cursor holding the results of `sql`, routed when a router is given"""
+    if router is not None:
+        with router.cursor(sql) as cursor:
+            yield cursor
+        return
+    cursor = session.connection.cursor()
+    try:
+        cursor.execute(sql)
+        yield cursor
+    finally:
+        cursor.close()